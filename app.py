@@ -1,4 +1,5 @@
 from web.callback import app
+import web.route
 
 
 # Run the application
@@ -0,0 +1,170 @@
+"""
+Benchmarks of decomposition, bootstrap, cross-validation and model selection.
+
+Cohorts are synthetic but reproducible: signatures come from the bundled COSMIC catalogues,
+profiles are either drawn from data/M.csv or simulated from random exposures of a few
+signatures, and every random draw uses --seed.
+
+Examples:
+    python benchmark.py --quick
+    python benchmark.py --output output/benchmarks/after.json --compare output/benchmarks/before.json
+
+Every case reports the best wall time over --repeat runs, its throughput (items per
+second, where an item is a sample, replicate or fold) and the peak memory allocated
+while it ran (tracemalloc). Results are written as JSON; --compare prints the speedup
+of every case against a previous result file.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+import model_selection
+import model_selection_cv
+import model_selection_new
+from catalogue import load_catalogue
+from decompose import decomposeActiveSetBatch, decomposeFISTABatch, decomposeQP, decomposeQPBatch, decomposeQPScipy
+from estimates_exposures import bootstrapSigExposures, crossValidationSigExposures, findSigExposures
+
+CATALOGUE = 'data/COSMIC_v3.4_SBS_GRCh37.txt'
+PROFILES = 'data/M.csv'
+
+# (G samples, N signatures, R replicates, mutation count)
+QUICK = {'G': [50], 'N': [30], 'R': [100], 'mutation_count': [1000]}
+FULL = {'G': [100, 1000], 'N': [30, 86], 'R': [100, 1000], 'mutation_count': [1000, 50000]}
+
+
+def simulated_cohort(P, G, mutation_count, rng, active=5):
+    # Counts drawn from random exposures of 'active' signatures per sample
+    M = np.zeros((P.shape[0], G))
+    for i in range(G):
+        columns = rng.choice(P.shape[1], size=min(active, P.shape[1]), replace=False)
+        exposures = rng.dirichlet(np.ones(len(columns)))
+        m = P[:, columns] @ exposures
+        M[:, i] = rng.multinomial(mutation_count, m / m.sum())
+    return M
+
+
+def real_cohort(G, rng):
+    # Columns 0-1 hold the mutation type labels
+    profiles = np.genfromtxt(PROFILES, delimiter='\t', skip_header=1, ndmin=2)[:, 2:]
+    if profiles.shape[1] == 0:
+        raise ValueError(f"No samples in {PROFILES}")
+    columns = rng.choice(profiles.shape[1], size=min(G, profiles.shape[1]), replace=False)
+    return profiles[:, columns]
+
+
+def measure(func, repeat):
+    # Best wall time over 'repeat' runs and peak traced memory of the first one
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    best = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best, peak
+
+
+def cases(P, M, R, mutation_count, seed):
+    # name, function, number of items it processes
+    m = M[:, 0]
+    few = M[:, :min(5, M.shape[1])] / M[:, :min(5, M.shape[1])].sum(axis=0)
+    return [
+        ('decomposeQP', lambda: [decomposeQP(few[:, i], P) for i in range(few.shape[1])], few.shape[1]),
+        ('decomposeQPScipy', lambda: [decomposeQPScipy(few[:, i], P) for i in range(few.shape[1])], few.shape[1]),
+        ('decomposeQPBatch', lambda: decomposeQPBatch(M / M.sum(axis=0), P), M.shape[1]),
+        ('decomposeFISTABatch', lambda: decomposeFISTABatch(M / M.sum(axis=0), P), M.shape[1]),
+        ('decomposeActiveSetBatch', lambda: decomposeActiveSetBatch(M / M.sum(axis=0), P), M.shape[1]),
+        ('findSigExposures', lambda: findSigExposures(M, P), M.shape[1]),
+        ('bootstrapSigExposures', lambda: bootstrapSigExposures(m, P, R, mutation_count, rng=seed), R),
+        ('crossValidationSigExposures', lambda: crossValidationSigExposures(m, P, 4, rng=seed),
+         -(-P.shape[0] // 4)),
+        ('backward_elimination (bootstrap)', lambda: model_selection.backward_elimination(
+            m, P, R, 0.01, mutation_count, 0.01, seed=seed), 1),
+        ('backward_elimination (cross-validation)', lambda: model_selection_cv.backward_elimination(
+            m, P, 4, 0.01, 0.01, seed=seed), 1),
+        ('backward_elimination (shared replicates)', lambda: model_selection_new.backward_elimination(
+            m, P, R, 0.01, mutation_count, 0.01, rng=seed), 1),
+    ]
+
+
+def run(grid, seed=0, repeat=3, source='simulated', only=None):
+    signatures = np.asarray(load_catalogue(CATALOGUE)[0])
+    results = []
+    for N in grid['N']:
+        P = signatures[:, :N]
+        for G in grid['G']:
+            if G < 1:
+                raise ValueError(f"Cohorts need at least one sample, got G={G}")
+            for mutation_count in grid['mutation_count']:
+                rng = np.random.default_rng(seed)
+                if source == 'real':
+                    M = real_cohort(G, rng)
+                else:
+                    M = simulated_cohort(P, G, mutation_count, rng)
+                for R in grid['R']:
+                    for name, func, items in cases(P, M, R, mutation_count, seed):
+                        if only and not any(pattern in name for pattern in only):
+                            continue
+                        seconds, peak = measure(func, repeat)
+                        result = {'case': name, 'G': G, 'N': N, 'R': R, 'mutation_count': mutation_count,
+                                  'seconds': seconds, 'throughput': items / seconds, 'peak_bytes': peak}
+                        results.append(result)
+                        print(f"{_key(result):<90} {seconds:10.4f} s {items / seconds:12.1f} /s "
+                              f"{peak / 2 ** 20:9.1f} MiB", flush=True)
+    return results
+
+
+def _key(result):
+    return (f"{result['case']} G={result['G']} N={result['N']} R={result['R']} "
+            f"mutations={result['mutation_count']}")
+
+
+def _metadata(args):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = None
+    return {'revision': revision, 'numpy': np.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'seed': args.seed, 'repeat': args.repeat, 'source': args.source}
+
+
+def compare(results, previous_file):
+    with open(previous_file) as f:
+        previous = {_key(r): r for r in json.load(f)['results']}
+    for result in results:
+        before = previous.get(_key(result))
+        if before is not None:
+            print(f"{_key(result):<90} {before['seconds'] / result['seconds']:8.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--quick', action='store_true', help='small grid for a fast check')
+    parser.add_argument('--source', choices=['simulated', 'real'], default='simulated',
+                        help='simulate profiles or sample them from data/M.csv')
+    parser.add_argument('--case', nargs='+', help='only run cases whose name contains one of these')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    args = parser.parse_args(argv)
+
+    results = run(QUICK if args.quick else FULL, args.seed, args.repeat, args.source, args.case)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': _metadata(args), 'results': results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Streaming summaries of bootstrap distributions, for R too large to keep every replicate.
+
+Replicates are added in blocks; a summary keeps, per signature, the number of replicates,
+the sum and sum of squares of the exposures, the number of replicates above the exposure
+threshold (from which compute_p_value's p-value follows) and a fixed-grid histogram from
+which quantiles are read. Memory depends on the number of signatures and histogram bins,
+not on R. Summaries of separate blocks merge by addition, so blocks can be solved in
+any order or process and give the same result.
+"""
+import numpy as np
+
+# Histogram bins; quantiles are accurate to (high - low) / BINS
+BINS = 2000
+# Reconstruction errors are distances between two points of the probability simplex
+MAX_ERROR = np.sqrt(2)
+
+
+class QuantileSketch:
+    """
+    Fixed-grid histogram of every row of a stream of (rows, n) blocks.
+
+    Values outside [low, high] are counted in the first or last bin; the exact minimum
+    and maximum are kept, so quantiles never leave the observed range.
+    """
+
+    def __init__(self, rows, bins=BINS, low=0.0, high=1.0):
+        self.low, self.high = low, high
+        self.counts = np.zeros((rows, bins), dtype=np.int64)
+        self.minimum = np.full(rows, np.inf)
+        self.maximum = np.full(rows, -np.inf)
+
+    @property
+    def width(self):
+        return (self.high - self.low) / self.counts.shape[1]
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).reshape(self.counts.shape[0], -1)
+        bins = np.clip(((values - self.low) / self.width).astype(int), 0, self.counts.shape[1] - 1)
+        # One bincount over all rows: row i uses bins i * n_bins .. (i + 1) * n_bins - 1
+        offsets = np.arange(self.counts.shape[0])[:, None] * self.counts.shape[1]
+        self.counts += np.bincount((bins + offsets).ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        if values.shape[1]:
+            self.minimum = np.minimum(self.minimum, values.min(axis=1))
+            self.maximum = np.maximum(self.maximum, values.max(axis=1))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        return self
+
+    def quantiles(self, q):
+        """Quantiles q (array in [0, 1]) of every row, (rows, len(q)), linear within a bin."""
+        q = np.atleast_1d(q)
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1:]
+        targets = q[None, :] * total
+        result = np.empty((self.counts.shape[0], len(q)))
+        for i in range(self.counts.shape[0]):
+            b = np.minimum(np.searchsorted(cumulative[i], targets[i]), self.counts.shape[1] - 1)
+            before = cumulative[i, b] - self.counts[i, b]
+            inside = np.divide(targets[i] - before, self.counts[i, b],
+                               out=np.zeros(len(q)), where=self.counts[i, b] > 0)
+            result[i] = self.low + self.width * (b + inside)
+        return np.clip(result, self.minimum[:, None], self.maximum[:, None])
+
+
+class BootstrapStats:
+    """
+    Running summary of the bootstrap exposures (N, R) and errors (R,) of one sample.
+
+    Examples:
+        stats = BootstrapStats(P.shape[1])
+        for rng in rngs:
+            stats.add(*bootstrapSigExposures(m, P, 1000, mutation_count, rng=rng))
+        stats.p_values(), stats.quantiles([0.025, 0.975])
+    """
+
+    def __init__(self, signatures, threshold=0.01, bins=BINS):
+        self.threshold = threshold
+        self.replicates = 0
+        self.sums = np.zeros(signatures)
+        self.squares = np.zeros(signatures)
+        self.above = np.zeros(signatures, dtype=np.int64)
+        self.error_sum = 0.0
+        self.exposures = QuantileSketch(signatures, bins)
+        self.errors = QuantileSketch(1, bins, high=MAX_ERROR)
+
+    def add(self, exposures, errors):
+        self.replicates += exposures.shape[1]
+        self.sums += exposures.sum(axis=1)
+        self.squares += np.square(exposures, dtype=float).sum(axis=1)
+        self.above += (exposures > self.threshold).sum(axis=1)
+        self.error_sum += float(np.sum(errors))
+        self.exposures.add(exposures)
+        self.errors.add(errors)
+        return self
+
+    def merge(self, other):
+        self.replicates += other.replicates
+        self.sums += other.sums
+        self.squares += other.squares
+        self.above += other.above
+        self.error_sum += other.error_sum
+        self.exposures.merge(other.exposures)
+        self.errors.merge(other.errors)
+        return self
+
+    def mean(self):
+        return self.sums / self.replicates
+
+    def std(self):
+        # Population standard deviation, as np.std of all the replicates
+        return np.sqrt(np.maximum(self.squares / self.replicates - self.mean() ** 2, 0))
+
+    def p_values(self):
+        # compute_p_value of all the replicates: the fraction at or below the threshold
+        return 1 - self.above / self.replicates
+
+    def quantiles(self, q):
+        return self.exposures.quantiles(q)
+
+    def mean_error(self):
+        return self.error_sum / self.replicates
+
+    def error_quantiles(self, q):
+        return self.errors.quantiles(q)[0]
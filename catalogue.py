@@ -0,0 +1,199 @@
+import json
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from fileutils import atomic_write
+from profiling import count
+
+CACHE_DIR = '.cache'
+# Number of (catalogue, signature subset) entries kept by get_catalogue
+REGISTRY_SIZE = 32
+
+Catalogue = namedtuple('Catalogue', ['signatures', 'gram', 'names', 'mutation_types'])
+
+
+def _delimiter(path):
+    return '\t' if path.endswith('.txt') else ','
+
+
+def _cache_paths(path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    base = os.path.join(cache_dir, os.path.basename(path))
+    return base + '.npy', base + '.json'
+
+
+class MappedCatalogue(np.memmap):
+    """
+    Read-only memory map of a binary catalogue cache that pickles as the path of its file.
+
+    Processes receiving it (e.g. pool tasks of parallel.run_tasks) map the same .npy file
+    and share its pages instead of each getting a private copy. Slices, views and results
+    of computations are plain arrays and are pickled by value.
+    """
+
+    def __array_finalize__(self, obj):
+        super().__array_finalize__(obj)
+        self.npy_path = None
+
+    def __array_wrap__(self, arr, context=None, return_scalar=False):
+        arr = super().__array_wrap__(arr, context).view(np.ndarray)
+        return arr[()] if return_scalar else arr
+
+    def __getitem__(self, index):
+        result = super().__getitem__(index)
+        return result.view(np.ndarray) if isinstance(result, MappedCatalogue) else result
+
+    def __reduce__(self):
+        if self.npy_path is None:
+            return np.asarray(self).__reduce__()
+        return _map_catalogue, (self.npy_path,)
+
+
+def _map_catalogue(npy_path):
+    # The cache file is replaced on rebuild, never modified in place, so open maps stay valid
+    mapped = np.load(npy_path, mmap_mode='r').view(MappedCatalogue)
+    mapped.npy_path = npy_path
+    return mapped
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def read_catalogue(path):
+    """
+    Parse a signature catalogue text file (COSMIC .txt or organ .csv).
+
+    The first column holds the mutation types, except in the older organ catalogues
+    (data/signatures_organ/version_*), which only have signature columns; their
+    mutation_types are empty.
+
+    Returns:
+        tuple: (signatures, names, mutation_types) where signatures has shape (96, N).
+    """
+    delimiter = _delimiter(path)
+    signatures = np.genfromtxt(path, delimiter=delimiter, skip_header=1, ndmin=2)
+    if signatures.size == 0:
+        raise ValueError(f"Empty data in {path}")
+    names = np.genfromtxt(path, delimiter=delimiter, max_rows=1, dtype=str, ndmin=1)
+
+    mutation_types = []
+    # The label column has no header (or 'Type') or does not parse as numbers
+    if names[0].strip('"') in ('', 'Type') or np.isnan(signatures[:, 0]).all():
+        signatures = np.delete(signatures, 0, axis=1)
+        names = names[1:]
+        mutation_types = np.genfromtxt(path, delimiter=delimiter, skip_header=1, usecols=0, dtype=str)
+
+    return signatures, [str(x).strip('"') for x in names], [str(x).strip('"') for x in mutation_types]
+
+
+def convert_catalogue(path, cache_dir=None):
+    """
+    Convert a catalogue text file into its binary cache.
+
+    The signature matrix is stored as a .npy file (so it can be memory-mapped) and the
+    signature names, mutation types and the size/mtime of the source file go to a
+    .json sidecar.
+
+    Returns:
+        tuple: Paths of the .npy and .json files.
+    """
+    npy_path, meta_path = _cache_paths(path, cache_dir)
+    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+
+    stamp = _source_stamp(path)
+    signatures, names, mutation_types = read_catalogue(path)
+    meta = dict(stamp, names=names, mutation_types=mutation_types)
+
+    atomic_write(npy_path, lambda f: np.save(f, np.ascontiguousarray(signatures, dtype=float)))
+    atomic_write(meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+    return npy_path, meta_path
+
+
+def load_catalogue(path, cache_dir=None):
+    """
+    Load a signature catalogue through its binary cache.
+
+    The text file stays the source of truth: the cache is (re)built when it is missing
+    or the source file's size or modification time changed. The matrix is returned as
+    a read-only memory map (MappedCatalogue), so loading skips the text parsing and pool
+    workers that receive the whole matrix map the same file instead of a private copy.
+
+    Parameters:
+        path (str): Catalogue text file, tab separated for .txt and comma separated otherwise.
+        cache_dir (str, optional): Directory of the cache files. Default is '.cache' next to 'path'.
+
+    Returns:
+        tuple: (signatures, names, mutation_types) where signatures has shape (96, N), a
+            MappedCatalogue unless the cache could not be written.
+
+    Raises:
+        FileNotFoundError: If 'path' does not exist.
+        ValueError: If 'path' contains no data.
+    """
+    npy_path, meta_path = _cache_paths(path, cache_dir)
+    stamp = _source_stamp(path)
+
+    meta = None
+    if os.path.exists(npy_path) and os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if any(meta.get(key) != value for key, value in stamp.items()):
+            meta = None
+
+    count('catalogue_cache_hits' if meta is not None else 'catalogue_cache_builds')
+    if meta is None:
+        try:
+            convert_catalogue(path, cache_dir)
+        except OSError:
+            # Cache location not writable: serve the parsed text file
+            return read_catalogue(path)
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+
+    return _map_catalogue(npy_path), meta['names'], meta['mutation_types']
+
+
+@lru_cache(maxsize=REGISTRY_SIZE)
+def _registry_entry(path, mtime_ns, columns):
+    # mtime_ns is part of the key only: an edited file gets a new entry and the old one ages out
+    signatures, names, mutation_types = load_catalogue(path)
+    if columns is not None:
+        signatures = signatures[:, list(columns)]
+        names = [names[i] for i in columns]
+    # The whole catalogue stays mapped; subsets are copies
+    if not isinstance(signatures, MappedCatalogue):
+        signatures = np.ascontiguousarray(signatures, dtype=float)
+    matrix = np.asarray(signatures)
+    gram = np.dot(matrix.T, matrix)
+    signatures.flags.writeable = False
+    gram.flags.writeable = False
+
+    return Catalogue(signatures, gram, tuple(names), tuple(mutation_types))
+
+
+def get_catalogue(path, columns=None):
+    """
+    Return a catalogue, restricted to the given signature columns, from the in-process registry.
+
+    Entries hold the signature matrix, its Gram matrix P.T @ P (to pass as 'gram' to the
+    estimators) and the names. They are keyed by file, modification time and column subset,
+    and the least recently used ones are evicted. The arrays are shared and read-only; without
+    'columns' the signatures are the MappedCatalogue of load_catalogue.
+
+    Parameters:
+        path (str): Catalogue text file.
+        columns (list of int, optional): Signature columns to keep. Default is all of them.
+
+    Returns:
+        Catalogue: Named tuple (signatures, gram, names, mutation_types).
+    """
+    path = os.path.abspath(path)
+    columns = tuple(int(i) for i in columns) if columns is not None else None
+    return _registry_entry(path, os.stat(path).st_mtime_ns, columns)
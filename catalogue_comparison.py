@@ -0,0 +1,219 @@
+"""
+Fit a cohort against several signature catalogues at once and compare them by
+reconstruction error and BIC (utils.calculate_BIC).
+
+The profiles are normalized once and, with R > 0, one matrix of bootstrap replicates of
+all samples is drawn; every catalogue is fitted to the same normalized profiles and the
+same replicates, so the catalogues are compared on identical data. Each catalogue is one
+task for parallel.run_tasks and is loaded once, in the process fitting it.
+
+The statistics of a catalogue are sums over samples (see catalogue_fit_stats), so the
+results of chunks of a cohort can be added up with merge_stats before building the table.
+
+Examples:
+    table = compare_catalogues(M, ['data/COSMIC_v2_SBS_GRCh37.txt', 'data/COSMIC_v3.4_SBS_GRCh37.txt'],
+                               R=100, rng=0, n_jobs=4)
+    best = table[0]['catalogue']   # rows by increasing BIC
+"""
+import re
+
+import numpy as np
+
+from catalogue import get_catalogue
+from decompose import decomposeQP
+from estimates_exposures import decompose_columns
+from parallel import run_tasks
+from utils import BIC_from_RSS, bootstrap_samples, normalize_columns, reconstruction_errors
+
+
+def canonical_type(mutation_type):
+    # 'ACA>AAA' (cosmic_signatures_v3.csv) -> 'A[C>A]A', the notation of the COSMIC .txt files
+    compact = re.fullmatch(r'(\w)(\w)(\w)>\w(\w)\w', mutation_type)
+    return f'{compact[1]}[{compact[2]}>{compact[4]}]{compact[3]}' if compact else mutation_type
+
+
+def row_order(catalogue_types, mutation_types):
+    """
+    Rows of a catalogue in the order of 'mutation_types' (the rows of M), or None when
+    either order is unknown (no labels, or labels that are not mutation types like
+    'A[C>A]A'); the catalogue is then assumed to be in the order of M.
+
+    The organ catalogues list the mutation types in another order than the COSMIC ones.
+
+    Raises:
+        ValueError: If the catalogue has other mutation types than M.
+    """
+    if not catalogue_types or mutation_types is None or not all('>' in t for t in catalogue_types):
+        return None
+    position = {canonical_type(t): i for i, t in enumerate(catalogue_types)}
+    try:
+        return np.array([position[canonical_type(t)] for t in mutation_types])
+    except KeyError as error:
+        raise ValueError(f"Mutation type {error} of M is not in the catalogue.") from None
+
+
+def cohort_replicates(M, R, mutation_count=None, rng=None):
+    """
+    R bootstrap replicates of every sample of the normalized profiles M (96, G).
+
+    Parameters:
+        mutation_count (int or numpy.ndarray, optional): Mutations per replicate, one
+            value or one per sample. Required when M holds frequencies.
+        rng (numpy.random.Generator or int, optional): Generator (or seed for one) of the
+            draws. If None, the global numpy random state is used, as in bootstrap_samples.
+
+    Returns:
+        numpy.ndarray: Replicates (96, G * R); those of sample s are columns s*R to (s+1)*R - 1.
+    """
+    counts = np.broadcast_to(mutation_count, M.shape[1])
+    rng = np.random.default_rng(rng) if rng is not None else None
+    return np.stack([bootstrap_samples(M[:, s], counts[s], R, rng) for s in range(M.shape[1])],
+                    axis=1).reshape(M.shape[0], -1)
+
+
+def catalogue_fit_stats(M, P, replicates=None, decomposition_method=decomposeQP, gram=None):
+    """
+    Fit the normalized profiles M (and their replicates) with catalogue P.
+
+    Replicate errors are measured against the sample they were drawn from, as in
+    bootstrapSigExposures.
+
+    Returns:
+        dict: 'samples' and 'signatures' (n and k of the BIC), 'rss' (sum of squared
+            errors), 'error_sum' and, with replicates, 'replicate_rss' and
+            'replicate_error_sum', arrays with one sum per replicate.
+    """
+    exposures = decompose_columns(M, P, decomposition_method, gram)
+    errors = reconstruction_errors(M, P, exposures)
+    stats = {'samples': M.shape[1], 'signatures': P.shape[1],
+             'rss': float(np.sum(errors ** 2)), 'error_sum': float(np.sum(errors))}
+    if replicates is not None:
+        exposures = decompose_columns(replicates, P, decomposition_method, gram)
+        R = replicates.shape[1] // M.shape[1]
+        fitted = np.dot(P, exposures).reshape(M.shape[0], M.shape[1], R)
+        # Errors (G, R) of every replicate with respect to its sample
+        errors = np.sqrt(np.sum((M[:, :, None] - fitted) ** 2, axis=0))
+        stats['replicate_rss'] = np.sum(errors ** 2, axis=0)
+        stats['replicate_error_sum'] = np.sum(errors, axis=0)
+    return stats
+
+
+def _catalogue_task(catalogue, M, replicates, decomposition_method, mutation_types):
+    # A catalogue path is loaded here, in the process that fits it
+    if isinstance(catalogue, str):
+        entry = get_catalogue(catalogue)
+        P, gram, catalogue_types = entry.signatures, entry.gram, entry.mutation_types
+    else:
+        P, gram, catalogue_types = np.asarray(catalogue), None, None
+    order = row_order(catalogue_types, mutation_types)
+    if order is not None:
+        # Reordering the rows leaves P.T @ P unchanged
+        P = P[order]
+    if P.shape[0] != M.shape[0]:
+        raise ValueError(f"The catalogue has {P.shape[0]} mutation types and M {M.shape[0]}.")
+    return catalogue_fit_stats(M, P, replicates, decomposition_method, gram)
+
+
+def fit_catalogues(M, catalogues, replicates=None, decomposition_method=decomposeQP, mutation_types=None,
+                   n_jobs=1, executor=None):
+    """
+    catalogue_fit_stats of every catalogue, one task per catalogue.
+
+    Parameters:
+        M (numpy.ndarray): Normalized profiles (96, G).
+        catalogues (dict or list): Catalogues by name, each a file path or a signature
+            matrix; a list of paths is named by the paths.
+        mutation_types (list, optional): Mutation types of the rows of M; catalogue rows
+            are reordered to match them (see row_order).
+
+    Returns:
+        dict: Statistics by catalogue name.
+    """
+    if not isinstance(catalogues, dict):
+        catalogues = {path: path for path in catalogues}
+    results = run_tasks(_catalogue_task,
+                        [(catalogue, M, replicates, decomposition_method, mutation_types)
+                         for catalogue in catalogues.values()],
+                        n_jobs=n_jobs, executor=executor)
+    return dict(zip(catalogues, results))
+
+
+def merge_stats(total, stats):
+    # Statistics of two chunks of samples fitted with the same catalogues (and R)
+    if total is None:
+        return stats
+    return {name: {key: total[name][key] + value if key != 'signatures' else value
+                   for key, value in entry.items()}
+            for name, entry in stats.items()}
+
+
+def comparison_table(stats):
+    """
+    One row per catalogue, by increasing BIC.
+
+    Columns: 'catalogue', 'signatures', 'samples', 'error_mean', 'rss', 'bic' and, with
+    replicates, 'bootstrap_error_mean', 'bic_low' and 'bic_high' (2.5% and 97.5%
+    quantiles of the BIC over the replicates), and 'best_fraction', the fraction of the
+    replicates in which the catalogue has the lowest BIC.
+
+    Raises:
+        ValueError: If there are no statistics, e.g. no samples were fitted.
+    """
+    if not stats:
+        raise ValueError("No catalogue statistics to compare.")
+    names = list(stats)
+    bics = {name: BIC_from_RSS(s['rss'], s['samples'], s['signatures']) for name, s in stats.items()}
+    replicated = all('replicate_rss' in s for s in stats.values())
+    if replicated:
+        replicate_bics = np.array([BIC_from_RSS(stats[name]['replicate_rss'], stats[name]['samples'],
+                                                stats[name]['signatures']) for name in names])
+        best = np.bincount(np.argmin(replicate_bics, axis=0), minlength=len(names)) / replicate_bics.shape[1]
+
+    rows = []
+    for i, name in enumerate(names):
+        s = stats[name]
+        row = {'catalogue': name, 'signatures': s['signatures'], 'samples': s['samples'],
+               'error_mean': s['error_sum'] / s['samples'], 'rss': s['rss'], 'bic': float(bics[name])}
+        if replicated:
+            R = len(s['replicate_rss'])
+            low, high = np.quantile(replicate_bics[i], [0.025, 0.975])
+            row.update(bootstrap_error_mean=float(np.sum(s['replicate_error_sum']) / (s['samples'] * R)),
+                       bic_low=float(low), bic_high=float(high), best_fraction=float(best[i]))
+        rows.append(row)
+    return sorted(rows, key=lambda row: row['bic'])
+
+
+def compare_catalogues(M, catalogues, R=0, mutation_count=None, decomposition_method=decomposeQP, rng=None,
+                       mutation_types=None, n_jobs=1, executor=None):
+    """
+    Fit the profiles M against every catalogue and compare the fits.
+
+    Parameters:
+        M (numpy.ndarray): Profiles (96, G), counts or frequencies.
+        catalogues (dict or list): Catalogue paths or matrices (see fit_catalogues).
+        R (int, optional): Bootstrap replicates per sample, shared by all catalogues. Default 0.
+        mutation_count (int, optional): Mutations per replicate; default is the total of each
+            sample, which needs M to hold counts.
+        rng (numpy.random.Generator or int, optional): Generator (or seed) of the replicates.
+        mutation_types (list, optional): Mutation types of the rows of M, to align the catalogues.
+        n_jobs (int, optional): Worker processes, -1 for all cores.
+
+    Returns:
+        list: Rows of comparison_table, by increasing BIC.
+
+    Raises:
+        ValueError: If R > 0, 'mutation_count' is not given and M does not hold counts.
+    """
+    M = np.asarray(M, dtype=float)
+    M = M.reshape(M.shape[0], -1)
+    replicates = None
+    if R:
+        if mutation_count is None:
+            if not np.all(M == np.round(M)):
+                raise ValueError("Please specify 'mutation_count' or provide mutation counts in 'M'.")
+            mutation_count = M.sum(axis=0).astype(int)
+        replicates = cohort_replicates(normalize_columns(M), R, mutation_count, rng)
+    M = normalize_columns(M)
+    stats = fit_catalogues(M, catalogues, replicates, decomposition_method, mutation_types, n_jobs, executor)
+    return comparison_table(stats)
+
@@ -0,0 +1,213 @@
+"""
+Index of the signature catalogues in data/: every COSMIC catalogue and every organ
+catalogue (by version and organ) with its signature names, the column of every name,
+the default signature selection, and for organ signatures the column of the COSMIC
+reference signature they correspond to.
+
+The index is built from the catalogue headers once and saved as JSON in the catalogue
+cache directory; it is rebuilt when a catalogue file is added, removed or changed.
+Selecting a subset is then a lookup, and the sliced matrices come from the registry of
+catalogue.get_catalogue, so a subset requested again is not sliced again.
+
+Examples:
+    index = get_index()
+    index.organs('latest')
+    catalogue = index.catalogue('COSMIC_v3.4_SBS_GRCh37.txt', signatures=['SBS1', 'SBS5'])
+    catalogue = index.catalogue('Breast', version='latest')
+    index.reference_columns('Breast')   # columns of 'SBS13', 'SBS5', ... in the reference
+"""
+import json
+import os
+import re
+from functools import lru_cache
+
+from catalogue import CACHE_DIR, _source_stamp, get_catalogue, load_catalogue
+from fileutils import atomic_write
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+ORGAN_DIR = 'signatures_organ'
+INDEX_FILE = 'catalogue_index.json'
+INDEX_VERSION = 1
+# COSMIC catalogue the organ signatures are mapped to
+REFERENCE_CATALOGUE = 'COSMIC_v3.4_SBS_GRCh37.txt'
+# Signatures selected by default in the web app (1-based column numbers); other catalogues select all
+DEFAULT_SELECTIONS = {
+    'COSMIC_v1_SBS_GRCh37.txt': [1, 2, 3, 4, 5, 6, 7, 9, 15],
+    'COSMIC_v2_SBS_GRCh37.txt': [1, 2, 3, 5, 6, 8, 13, 17, 18, 20, 26, 30],
+    'COSMIC_v3.1_SBS_GRCh37.txt': [1, 2, 3, 5, 6, 8, 13, 17, 18, 20, 26, 30],
+}
+# Files in data/ that are not signature catalogues
+NOT_CATALOGUES = ('M.csv',)
+
+
+def reference_name(name):
+    """
+    COSMIC name of an organ signature: 'GEL-Breast_common_SBS13' -> 'SBS13',
+    'Breast_J (RefSig 1)' -> 'SBS1', 'Breast_A (RefSig MMR1)' -> 'MMR1'.
+    """
+    ref_sig = re.search(r'RefSig (\w+)', name)
+    if ref_sig:
+        number = ref_sig.group(1)
+        return 'SBS' + number if number.isdigit() else number
+    return re.search(r'([^_]+)$', name).group()
+
+
+def _sources(data_dir):
+    # Catalogue files as {key: path relative to data_dir}; organ keys are 'version/organ'
+    sources = {}
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.endswith(('.txt', '.csv')) and file_name not in NOT_CATALOGUES:
+            sources[file_name] = file_name
+    organ_dir = os.path.join(data_dir, ORGAN_DIR)
+    if os.path.isdir(organ_dir):
+        for version in sorted(os.listdir(organ_dir)):
+            if not os.path.isdir(os.path.join(organ_dir, version)):
+                continue
+            for file_name in sorted(os.listdir(os.path.join(organ_dir, version))):
+                organ = re.match(r'(.+)_Signature(_\d+)?\.csv$', file_name)
+                if organ:
+                    sources[f'{version}/{organ.group(1)}'] = os.path.join(ORGAN_DIR, version, file_name)
+    return sources
+
+
+def build_index(data_dir=DATA_DIR, reference=REFERENCE_CATALOGUE):
+    """
+    Index of the catalogues in 'data_dir' as a JSON-serializable dict.
+
+    Entries are keyed by file name for the COSMIC catalogues and by 'version/organ' for
+    the organ catalogues; each has the relative 'path', the signature 'names' and the
+    'default' columns; empty files are left out. Organ entries also have 'reference_columns', the column of each
+    signature in the reference catalogue (-1 when it has no counterpart there).
+    """
+    sources = _sources(data_dir)
+    entries = {}
+    for key, path in sources.items():
+        try:
+            _, names, _ = load_catalogue(os.path.join(data_dir, path))
+        except ValueError:
+            # Empty file (e.g. version_1/NET_Signature_1.csv)
+            continue
+        numbers = DEFAULT_SELECTIONS.get(key)
+        entries[key] = {'path': path, 'names': list(names),
+                        'default': [n - 1 for n in numbers] if numbers else list(range(len(names)))}
+
+    reference_columns = {name: j for j, name in enumerate(entries.get(reference, {}).get('names', []))}
+    for key, entry in entries.items():
+        if '/' in key:
+            entry['reference_columns'] = [reference_columns.get(reference_name(name), -1)
+                                          for name in entry['names']]
+
+    return {'version': INDEX_VERSION, 'reference': reference,
+            'stamps': {path: _source_stamp(os.path.join(data_dir, path)) for path in sources.values()},
+            'catalogues': entries}
+
+
+def _up_to_date(index, data_dir):
+    if index.get('version') != INDEX_VERSION:
+        return False
+    sources = _sources(data_dir)
+    return (sorted(index['stamps']) == sorted(sources.values())
+            and all(_source_stamp(os.path.join(data_dir, path)) == stamp for path, stamp in index['stamps'].items()))
+
+
+def load_index(data_dir=DATA_DIR, cache_dir=None):
+    """
+    The index of 'data_dir' (see build_index), read from its JSON cache when that is up to date.
+
+    Parameters:
+        cache_dir (str, optional): Directory of the cache file. Default is the catalogue
+            cache directory '.cache' in 'data_dir'.
+    """
+    cache_dir = cache_dir or os.path.join(data_dir, CACHE_DIR)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+        if _up_to_date(index, data_dir):
+            return CatalogueIndex(index, data_dir)
+
+    index = build_index(data_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(index_path, lambda f: f.write(json.dumps(index).encode('utf-8')))
+    except OSError:
+        # Cache location not writable: the index is rebuilt by every process
+        pass
+    return CatalogueIndex(index, data_dir)
+
+
+@lru_cache(maxsize=None)
+def get_index(data_dir=DATA_DIR):
+    # One index per process, loaded at the first use
+    return load_index(data_dir)
+
+
+class CatalogueIndex:
+    """
+    Lookups in a catalogue index (see build_index).
+
+    A catalogue is named by its file name, or by the organ and a 'version' (e.g.
+    'latest', 'version_1') for the organ catalogues.
+    """
+
+    def __init__(self, index, data_dir=DATA_DIR):
+        self.index = index
+        self.data_dir = data_dir
+        self.reference = index['reference']
+        self._entries = index['catalogues']
+        # Column of every signature name, per catalogue
+        self._columns = {key: {name: j for j, name in enumerate(entry['names'])}
+                         for key, entry in self._entries.items()}
+
+    @staticmethod
+    def _key(name, version=None):
+        return name if version is None else f'{version}/{name}'
+
+    def _entry(self, name, version=None):
+        try:
+            return self._entries[self._key(name, version)]
+        except KeyError:
+            raise KeyError(f"No catalogue '{self._key(name, version)}' in {self.data_dir}") from None
+
+    def catalogues(self):
+        # File names of the COSMIC catalogues
+        return [key for key in self._entries if '/' not in key]
+
+    def versions(self):
+        return sorted({key.split('/')[0] for key in self._entries if '/' in key})
+
+    def organs(self, version='latest'):
+        return [key.split('/')[1] for key in self._entries if key.startswith(version + '/')]
+
+    def path(self, name, version=None):
+        return os.path.join(self.data_dir, self._entry(name, version)['path'])
+
+    def names(self, name, version=None):
+        return self._entry(name, version)['names']
+
+    def default(self, name, version=None):
+        # Columns selected by default
+        return self._entry(name, version)['default']
+
+    def columns(self, name, signatures, version=None):
+        """
+        Columns of 'signatures', given as names or column indices.
+
+        Raises:
+            KeyError: If a signature name is not in the catalogue.
+        """
+        self._entry(name, version)
+        columns = self._columns[self._key(name, version)]
+        return [columns[s] if isinstance(s, str) else int(s) for s in signatures]
+
+    def reference_columns(self, organ, version='latest'):
+        # Columns of the reference COSMIC signatures of an organ catalogue, -1 where there is none
+        return self._entry(organ, version)['reference_columns']
+
+    def catalogue(self, name, signatures=None, version=None):
+        """
+        The catalogue restricted to 'signatures' (names or columns; default all), as
+        returned by catalogue.get_catalogue.
+        """
+        columns = None if signatures is None else self.columns(name, signatures, version)
+        return get_catalogue(self.path(name, version), columns)
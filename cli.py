@@ -0,0 +1,332 @@
+"""
+Command-line batch runner for cohort-scale signature fitting and model selection.
+
+Examples:
+    python cli.py fit data/M.csv data/COSMIC_v3.4_SBS_GRCh37.txt --skip-columns 2 -o output/run1
+    python cli.py bootstrap data/M.csv data/COSMIC_v3.4_SBS_GRCh37.txt --skip-columns 2 -R 1000 \\
+        --n-jobs 16 --seed 42 -o output/run1
+    python cli.py select data/M.csv data/COSMIC_v3.4_SBS_GRCh37.txt --skip-columns 2 --resume -o output/run1
+
+The samples are processed in chunks of --chunk-size. Every finished chunk is written to
+<output>/<command>/chunk_NNNNN.<format>, and a run restarted with --resume skips the chunks
+that are already there. The chunks are finally joined into <output>/<command>.<format>.
+With --format store the chunks are instead shards of the binary result store in
+<output>/results (see result_store.py), which keeps sample and signature names and can be
+read for a subset of samples or signatures.
+
+The compare command fits the samples against several catalogues (by default every COSMIC
+catalogue in data/, plus the organ catalogues of --organ in every version) and writes one
+row per catalogue to <output>/compare.<format>: errors and BIC, and with -R the bootstrap
+interval of the BIC (see catalogue_comparison.py):
+    python cli.py compare data/M.csv --skip-columns 2 --organ Breast -R 100 --n-jobs 4 -o output/run1
+
+--profile prints where the time went (see profiling.py) and, given a file name, also
+writes the timers and counters there as JSON.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import profiling
+from catalogue import load_catalogue
+from catalogue_comparison import comparison_table, cohort_replicates, fit_catalogues, merge_stats
+from catalogue_index import get_index
+from decompose import SOLVERS, get_solver
+from estimates_exposures import findSigExposures
+from fileutils import atomic_write
+from model_selection import runBootstrapOnMatrix, runCrossvaldiationOnMatrix
+from model_selection_new import backward_elimination
+from parallel import executor_for, run_tasks
+from result_store import ResultStore
+from utils import iter_profile_chunks, normalize_columns
+
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+FORMATS = sorted(DELIMITERS) + ['store']
+
+
+def _delimiter(path):
+    # Tab when the header line has tabs (data/M.csv is tab separated), otherwise by extension
+    with open(path) as f:
+        if '\t' in f.readline():
+            return '\t'
+    return '\t' if path.endswith(('.txt', '.tsv')) else ','
+
+
+def _select_signatures(P, names, selected):
+    # Keep the catalogue columns given by name or by 0-based index
+    if not selected:
+        return P, names
+    columns = [names.index(s) if s in names else int(s) for s in selected]
+    return P[:, columns], [names[i] for i in columns]
+
+
+def _select_sample(m, P, R, threshold, mutation_count, significance_level, rng, decomposition_method):
+    best_columns, _, _ = backward_elimination(
+        m, P, R, threshold, mutation_count, significance_level, decomposition_method, rng=rng
+    )
+    selected = np.zeros(P.shape[1])
+    selected[best_columns] = 1
+    return selected
+
+
+def run_fit(args, M, P, seed, pool):
+    exposures, errors = findSigExposures(M, P, get_solver(args.solver))
+    return np.column_stack([exposures.T, errors])
+
+
+def run_bootstrap(args, M, P, seed, pool):
+    p_values = runBootstrapOnMatrix(
+        M, P, args.R, args.mutation_count, threshold=args.threshold,
+        decomposition_method=get_solver(args.solver), executor=pool, seed=seed, chunk_size=args.replicate_chunk,
+    )
+    return p_values.T
+
+
+def run_crossval(args, M, P, seed, pool):
+    p_values = runCrossvaldiationOnMatrix(
+        M, P, fold_size=args.fold_size, threshold=args.threshold,
+        decomposition_method=get_solver(args.solver), executor=pool, seed=seed,
+    )
+    return p_values.T
+
+
+def run_select(args, M, P, seed, pool):
+    rngs = [np.random.default_rng(s) for s in seed.spawn(M.shape[1])]
+    selected = run_tasks(
+        _select_sample,
+        [(M[:, i], P, args.R, args.threshold, args.mutation_count, args.significance_level, rngs[i],
+          get_solver(args.solver))
+         for i in range(M.shape[1])],
+        executor=pool,
+    )
+    return np.array(selected)
+
+
+COMMANDS = {
+    'fit': (run_fit, 'fit signature exposures'),
+    'bootstrap': (run_bootstrap, 'bootstrap p-values of every signature'),
+    'crossval': (run_crossval, 'cross-validation p-values of every signature'),
+    'select': (run_select, 'backward elimination; 1 marks a selected signature'),
+}
+
+
+def _write_table(path, header, sample_ids, values, delimiter):
+    # Written to a temporary file first, so an interrupted run never leaves half a chunk behind
+    def write(f):
+        if header is not None:
+            f.write(delimiter.join(header) + '\n')
+        for sample, row in zip(sample_ids, values):
+            f.write(sample + delimiter + delimiter.join('%.10g' % x for x in row) + '\n')
+
+    atomic_write(path, write, mode='w')
+
+
+def _store_arrays(command, values):
+    # Arrays of a chunk in the result store, samples on axis 0
+    if command == 'fit':
+        return {'exposures': values[:, :-1], 'errors': values[:, -1]}
+    if command == 'select':
+        return {'selected': values.astype(bool)}
+    return {'p_values': values}
+
+
+def _run_parameters(args):
+    # A resumed run must be given the same parameters, the seed included
+    keys = ['command', 'profiles', 'catalogue', 'signatures', 'skip_columns', 'chunk_size', 'format', 'solver',
+            'R', 'mutation_count', 'threshold', 'fold_size', 'significance_level', 'replicate_chunk', 'seed']
+    return {key: getattr(args, key, None) for key in keys}
+
+
+def _mutation_types(path, skip_columns):
+    # Labels of the rows of a profile file when they are mutation types (e.g. 'A[C>A]A'), else None
+    labels = []
+    delimiter = _delimiter(path)
+    with open(path) as f:
+        next(f)
+        for line in f:
+            fields = line.rstrip('\r\n').split(delimiter)
+            if line.strip() and len(fields) >= skip_columns >= 1:
+                labels.append(fields[skip_columns - 1].strip('"'))
+    return labels if labels and all('>' in label for label in labels) else None
+
+
+def _compare_catalogues(args):
+    # Paths of the catalogues to compare, by name
+    index = get_index()
+    names = args.catalogues or [index.path(name) for name in index.catalogues()]
+    catalogues = {name: name for name in names}
+    for organ in args.organ or []:
+        for version in index.versions():
+            if organ in index.organs(version):
+                catalogues[f'{version}/{organ}'] = index.path(organ, version=version)
+    return catalogues
+
+
+def run_compare(args):
+    catalogues = _compare_catalogues(args)
+    mutation_types = None if args.no_align else _mutation_types(args.profiles, args.skip_columns)
+    root = np.random.SeedSequence(args.seed)
+
+    # The statistics are sums over samples, added up chunk by chunk
+    stats = None
+    with executor_for(args.n_jobs) as pool:
+        chunks = iter_profile_chunks(args.profiles, args.chunk_size,
+                                     delimiter=_delimiter(args.profiles), skip_columns=args.skip_columns)
+        for index, (sample_ids, M) in enumerate(chunks):
+            replicates = None
+            if args.R:
+                counts = args.mutation_count or M.sum(axis=0).astype(int)
+                replicates = cohort_replicates(normalize_columns(M), args.R, counts,
+                                               np.random.SeedSequence(root.entropy, spawn_key=(index,)))
+            chunk_stats = fit_catalogues(normalize_columns(M), catalogues, replicates, get_solver(args.solver),
+                                         mutation_types, executor=pool)
+            stats = merge_stats(stats, chunk_stats)
+            print(f'chunk {index}: {len(sample_ids)} samples', file=sys.stderr)
+
+    rows = comparison_table(stats)
+    delimiter = DELIMITERS[args.format]
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, f'compare.{args.format}')
+    with open(output_file, 'w') as f:
+        f.write(delimiter.join(rows[0]) + '\n')
+        for row in rows:
+            f.write(delimiter.join(value if isinstance(value, str) else '%.10g' % value
+                                   for value in row.values()) + '\n')
+    return output_file
+
+
+def run(args):
+    if args.command == 'compare':
+        return run_compare(args)
+    P, names = load_catalogue(args.catalogue)[:2]
+    P, names = _select_signatures(P, names, args.signatures)
+    columns = names + (['error'] if args.command == 'fit' else [])
+    delimiter = DELIMITERS.get(args.format)
+    store = ResultStore(os.path.join(args.output, 'results'), names) if args.format == 'store' else None
+
+    chunk_dir = os.path.join(args.output, args.command)
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # The run parameters and the seed are stored so that a resumed run continues the same computation
+    run_file = os.path.join(chunk_dir, 'run.json')
+    parameters = _run_parameters(args)
+    if args.resume and os.path.exists(run_file):
+        with open(run_file) as f:
+            previous = json.load(f)
+        if previous['parameters'] != parameters:
+            raise SystemExit(f"Cannot resume: parameters differ from the run in {chunk_dir}.")
+        entropy = previous['entropy']
+    else:
+        entropy = np.random.SeedSequence(args.seed).entropy
+        atomic_write(run_file, lambda f: json.dump({'parameters': parameters, 'entropy': entropy}, f), mode='w')
+
+    compute = COMMANDS[args.command][0]
+    chunk_files = []
+    with executor_for(args.n_jobs) as pool:
+        chunks = iter_profile_chunks(args.profiles, args.chunk_size,
+                                     delimiter=_delimiter(args.profiles), skip_columns=args.skip_columns)
+        for index, (sample_ids, M) in enumerate(chunks):
+            chunk_file = os.path.join(chunk_dir, f'chunk_{index:05d}.{args.format}')
+            chunk_files.append(chunk_file)
+            if store is not None:
+                done = store.has_shard(args.command, f'chunk_{index:05d}')
+            else:
+                done = os.path.exists(chunk_file)
+            if args.resume and done:
+                print(f'chunk {index}: done, skipped', file=sys.stderr)
+                continue
+
+            # Each chunk has its own seed, independent of the chunks before it
+            seed = np.random.SeedSequence(entropy, spawn_key=(index,))
+            values = compute(args, M, P, seed, pool)
+            if store is not None:
+                store.append(args.command, sample_ids, f'chunk_{index:05d}', **_store_arrays(args.command, values))
+            else:
+                _write_table(chunk_file, None, sample_ids, values, delimiter)
+            print(f'chunk {index}: {len(sample_ids)} samples', file=sys.stderr)
+
+    if store is not None:
+        return store.path
+
+    output_file = os.path.join(args.output, f'{args.command}.{args.format}')
+    with open(output_file, 'w') as out:
+        out.write(delimiter.join(['sample'] + columns) + '\n')
+        for chunk_file in chunk_files:
+            with open(chunk_file) as f:
+                out.write(f.read())
+
+    return output_file
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, (_, help_text) in COMMANDS.items():
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument('profiles', help='mutation count matrix, mutation types x samples (.csv or .tsv/.txt)')
+        sub.add_argument('catalogue', help='signature catalogue (.csv or COSMIC .txt)')
+        sub.add_argument('-o', '--output', default='output', help='output directory')
+        sub.add_argument('--signatures', nargs='+', help='signature names or 0-based columns to fit')
+        sub.add_argument('--skip-columns', type=int, default=1, help='label columns before the counts')
+        sub.add_argument('--chunk-size', type=int, default=1000, help='samples per chunk')
+        sub.add_argument('--n-jobs', type=int, default=1, help='worker processes, -1 for all cores')
+        sub.add_argument('--seed', type=int, help='seed of the random number generators')
+        sub.add_argument('--solver', choices=sorted(SOLVERS), default='quadprog',
+                         help='solver of the exposures (see decompose.SOLVERS)')
+        sub.add_argument('--format', choices=FORMATS, default='csv', help='output format')
+        sub.add_argument('--resume', action='store_true', help='skip chunks finished by a previous run')
+        sub.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                         help='report stage timers and counters, optionally saved to FILE as JSON')
+        if command in ('bootstrap', 'crossval', 'select'):
+            sub.add_argument('--threshold', type=float, default=0.01, help='minimal exposure of a present signature')
+        if command in ('bootstrap', 'select'):
+            sub.add_argument('-R', type=int, default=100, help='bootstrap replicates')
+            sub.add_argument('--mutation-count', type=int,
+                             help='mutations per replicate, default is the sample total')
+        if command == 'bootstrap':
+            sub.add_argument('--replicate-chunk', type=int, help='replicates per parallel task')
+        if command == 'crossval':
+            sub.add_argument('--fold-size', type=int, default=4, help='mutation types per fold')
+        if command == 'select':
+            sub.add_argument('--significance-level', type=float, default=0.01)
+
+    sub = subparsers.add_parser('compare', help='errors and BIC of the fits with several catalogues')
+    sub.add_argument('profiles', help='mutation count matrix, mutation types x samples (.csv or .tsv/.txt)')
+    sub.add_argument('catalogues', nargs='*', help='signature catalogues, default all COSMIC catalogues in data/')
+    sub.add_argument('--organ', nargs='+', help='also compare the catalogues of these organs, in every version')
+    sub.add_argument('-o', '--output', default='output', help='output directory')
+    sub.add_argument('--skip-columns', type=int, default=1, help='label columns before the counts')
+    sub.add_argument('--chunk-size', type=int, default=1000, help='samples per chunk')
+    sub.add_argument('--n-jobs', type=int, default=1, help='worker processes, -1 for all cores')
+    sub.add_argument('--seed', type=int, help='seed of the random number generators')
+    sub.add_argument('--solver', choices=sorted(SOLVERS), default='quadprog',
+                     help='solver of the exposures (see decompose.SOLVERS)')
+    sub.add_argument('--format', choices=sorted(DELIMITERS), default='csv', help='output format')
+    sub.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                     help='report stage timers and counters, optionally saved to FILE as JSON')
+    sub.add_argument('-R', type=int, default=0, help='bootstrap replicates per sample, shared by the catalogues')
+    sub.add_argument('--mutation-count', type=int, help='mutations per replicate, default is the sample total')
+    sub.add_argument('--no-align', action='store_true',
+                     help='do not reorder catalogue rows to the mutation types of the profile file')
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile is None:
+        print(run(args))
+        return
+    with profiling.profiling() as stats:
+        print(run(args))
+    print(stats.report(), file=sys.stderr)
+    if args.profile:
+        profiling.export(args.profile, stats.snapshot())
+
+
+if __name__ == '__main__':
+    main()
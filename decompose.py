@@ -1,9 +1,15 @@
+from collections import namedtuple
+
 import numpy as np
+from scipy.linalg import solve_triangular
 from scipy.optimize import minimize
 from utils import FrobeniusNorm
+from profiling import count, timed
 import quadprog
 
+@timed()
 def decomposeQPScipy(m, P):
+    count('qp_solves')
     N = P.shape[1]
 
     def objective(E):
@@ -24,7 +30,9 @@ def decomposeQPScipy(m, P):
 
 
 
+@timed()
 def decomposeQP(m, P):
+    count('qp_solves')
     # N: how many signatures are selected
     N = P.shape[1]
     # G: matrix appearing in the quadratic programming objective function
@@ -47,6 +55,445 @@ def decomposeQP(m, P):
 
     # return the exposures
     return exposures
+
+
+def decomposeQPBatch(M, P, G=None, dtype=float):
+    # Same problem as decomposeQP, solved for every column of M.
+    # Everything that depends only on P is computed once.
+    if G is None:
+        G = np.dot(P.T, P)
+    # d for all samples at once: column i is P.T @ m_i (M may be a scipy.sparse matrix)
+    D = np.asarray(P.T @ M)
+
+    return decomposeQPGram(G, D, dtype)
+
+
+def _quadprog_solver(G):
+    # quadprog for a fixed G: a function of d returning the unnormalized solution
+    N = G.shape[0]
+    C = np.column_stack([np.ones(N), np.eye(N)]).astype(float)
+    b = np.array([1] + [0]*N).astype(float)
+
+    # quadprog factorizes G on every call unless it is given R^-1 (G = R^T R)
+    try:
+        R_inv = np.linalg.inv(np.linalg.cholesky(G).T)
+    except np.linalg.LinAlgError:
+        return lambda d: quadprog.solve_qp(G, d, C, b, meq=1)[0]
+    return lambda d: quadprog.solve_qp(R_inv, d, C, b, meq=1, factorized=True)[0]
+
+
+@timed()
+def decomposeQPGram(G, D, dtype=float):
+    # decomposeQPBatch for a given Gram matrix G = P.T @ P and D = P.T @ M.
+    # Subsets of signatures only need sub-blocks: decomposeQPGram(G[np.ix_(s, s)], D[s])
+    # quadprog always works in float64; 'dtype' is only the storage of the result.
+    G = np.asarray(G, dtype=float)
+    D = np.asarray(D, dtype=float).reshape(G.shape[0], -1)
+    solve = _quadprog_solver(G)
+
+    count('qp_solves', D.shape[1])
+    exposures = np.empty((G.shape[0], D.shape[1]), dtype=dtype)
+    for i in range(D.shape[1]):
+        exposures[:, i] = solve(D[:, i])
+
+    exposures[exposures < 0] = 0
+    exposures /= exposures.sum(axis=0)
+
+    return exposures
+
+
+def _chol_solve(L, y):
+    # Solve (L L^T) x = y for a lower triangular Cholesky factor L
+    return solve_triangular(L.T, solve_triangular(L, y, lower=True), lower=False)
+
+
+def _chol_update(L, x):
+    # Factor of L L^T + x x^T
+    L = L.copy()
+    x = x.copy()
+    for k in range(len(x)):
+        r = np.hypot(L[k, k], x[k])
+        c = r / L[k, k]
+        s = x[k] / L[k, k]
+        L[k, k] = r
+        L[k + 1:, k] = (L[k + 1:, k] + s * x[k + 1:]) / c
+        x[k + 1:] = c * x[k + 1:] - s * L[k + 1:, k]
+    return L
+
+
+def _chol_delete(L, k):
+    # Factor of the matrix with row and column k removed: a rank-1 update of the trailing block
+    n = L.shape[0]
+    out = np.zeros((n - 1, n - 1))
+    out[:k, :k] = L[:k, :k]
+    out[k:, :k] = L[k + 1:, :k]
+    out[k:, k:] = _chol_update(L[k + 1:, k + 1:], L[k + 1:, k])
+    return out
+
+
+def _chol_append(L, g, g_ii):
+    # Factor of the matrix bordered by column g and diagonal element g_ii
+    n = L.shape[0]
+    l = solve_triangular(L, g, lower=True) if n else np.zeros(0)
+    l_ii = g_ii - np.dot(l, l)
+    if l_ii <= 0:
+        raise np.linalg.LinAlgError("Gram matrix of the passive set is not positive definite.")
+    out = np.zeros((n + 1, n + 1))
+    out[:n, :n] = L
+    out[n, :n] = l
+    out[n, n] = np.sqrt(l_ii)
+    return out
+
+
+class ActiveSetQP:
+    """
+    Active-set solver for the decomposeQP problem on every column of M, which keeps
+    its state between calls so signatures can be dropped one at a time.
+
+    For every column it keeps the passive set (signatures with positive exposure),
+    the Cholesky factor of the Gram matrix restricted to that set and the current
+    exposures. drop() only touches the columns in which the removed signature was
+    passive: its row and column are deleted from the factor with a rank-1 update and
+    the next solve() restarts from the previous solution.
+
+    Columns on which the iteration does not converge are solved with quadprog, as in
+    decomposeQP.
+
+    Examples:
+        solver = ActiveSetQP(M, P)
+        exposures = solver.solve()
+        solver.drop(3)
+        exposures = solver.solve()   # exposures for P without its 4th column
+    """
+
+    def __init__(self, M, P, tol=1e-12, max_iter=None):
+        M = np.asarray(M, dtype=float).reshape(P.shape[0], -1)
+        self.M = M
+        self.P = P
+        # Positions of the remaining signatures in P
+        self.columns = np.arange(P.shape[1])
+        self.G = np.dot(P.T, P).astype(float)
+        self.D = np.dot(P.T, M).astype(float)
+        self.tol = tol
+        self.max_iter = max_iter if max_iter is not None else 10 * P.shape[1]
+
+        R = M.shape[1]
+        self.exposures = np.zeros((P.shape[1], R))
+        self.passive = [[] for _ in range(R)]
+        self.factors = [np.zeros((0, 0)) for _ in range(R)]
+        self.stale = np.ones(R, dtype=bool)
+
+    @timed()
+    def solve(self):
+        # Columns without a previous solution start from the batched quadprog solution,
+        # whose support gives the passive set
+        cold = [r for r in np.where(self.stale)[0] if not self.passive[r]]
+        # The cold columns are counted by decomposeQPGram
+        count('qp_solves', self.stale.sum() - len(cold))
+        if cold:
+            self.exposures[:, cold] = decomposeQPBatch(self.M[:, cold], self.P[:, self.columns], self.G)
+            for r in cold:
+                e = self.exposures[:, r]
+                # quadprog leaves round-off sized exposures; they are released, not downdated one by one
+                e[e <= np.sqrt(self.tol)] = 0
+                e /= e.sum()
+                F = list(np.where(e > 0)[0])
+                try:
+                    self.factors[r] = np.linalg.cholesky(self.G[F][:, F])
+                    self.passive[r] = F
+                except np.linalg.LinAlgError:
+                    e[:] = 0
+
+        for r in np.where(self.stale)[0]:
+            self._solve_column(r)
+        self.stale[:] = False
+
+        exposures = self.exposures.copy()
+        exposures[exposures < 0] = 0
+        return exposures / exposures.sum(axis=0)
+
+    def drop(self, j):
+        # Remove the j-th of the remaining signatures
+        keep = np.arange(len(self.columns)) != j
+        for r in range(len(self.passive)):
+            F = self.passive[r]
+            if j in F:
+                k = F.index(j)
+                self.factors[r] = _chol_delete(self.factors[r], k)
+                F.pop(k)
+                self.stale[r] = True
+            self.passive[r] = [i - 1 if i > j else i for i in F]
+
+        self.columns = self.columns[keep]
+        self.G = self.G[keep][:, keep]
+        self.D = self.D[keep]
+        self.exposures = self.exposures[keep]
+
+        # The previous solution without the dropped signature is a feasible start
+        for r in np.where(self.stale)[0]:
+            total = self.exposures[:, r].sum()
+            if self.passive[r] and total > 0:
+                self.exposures[:, r] /= total
+            else:
+                self.passive[r] = []
+                self.factors[r] = np.zeros((0, 0))
+
+    def _solve_column(self, r):
+        G, d, e = self.G, self.D[:, r], self.exposures[:, r]
+        F, L = self.passive[r], self.factors[r]
+        try:
+            if not F:
+                # Start from the best single signature
+                i = int(np.argmin(0.5 * np.diag(G) - d))
+                F, L = [i], np.sqrt(G[[i]][:, [i]])
+                e[:] = 0
+                e[i] = 1
+
+            for _ in range(self.max_iter):
+                # Minimize on the passive set subject to sum(e) = 1
+                a = _chol_solve(L, d[F])
+                u = _chol_solve(L, np.ones(len(F)))
+                lam = (a.sum() - 1) / u.sum()
+                z = a - lam * u
+
+                blocking = z <= 0
+                if blocking.any():
+                    # Move towards z until the first exposure reaches zero and release it
+                    e_F = e[F]
+                    alpha = np.min(e_F[blocking] / (e_F[blocking] - z[blocking]))
+                    e_F = e_F + alpha * (z - e_F)
+                    e[F] = e_F
+                    released = set(np.where(e_F <= self.tol)[0]) | {int(np.argmin(e_F))}
+                    for k in sorted(released, reverse=True):
+                        L = _chol_delete(L, k)
+                        e[F[k]] = 0
+                        F.pop(k)
+                    continue
+
+                e[F] = z
+                # Lagrange multipliers of the bounds e_i >= 0 outside the passive set
+                mu = np.dot(G, e) - d + lam
+                mu[F] = np.inf
+                i = int(np.argmin(mu))
+                if mu[i] >= -self.tol:
+                    self.passive[r], self.factors[r] = F, L
+                    return
+                L = _chol_append(L, G[F, i], G[i, i])
+                F.append(i)
+        except np.linalg.LinAlgError:
+            pass
+
+        # quadprog on the same problem; solve() already counted the column
+        e[:] = np.maximum(_quadprog_solver(G)(d), 0)
+        e /= e.sum()
+        self.passive[r] = []
+        self.factors[r] = np.zeros((0, 0))
+
+
+def project_simplex(V):
+    # Euclidean projection of every column of V onto the probability simplex (sort based)
+    N = V.shape[0]
+    U = -np.sort(-V, axis=0)
+    partial = np.cumsum(U, axis=0) - 1
+    k = np.arange(1, N + 1)[:, None]
+    # Number of coordinates that stay positive: the last k with U_k > (sum_{i<=k} U_i - 1) / k
+    rho = N - np.argmax((U - partial / k > 0)[::-1], axis=0)
+    theta = partial[rho - 1, np.arange(V.shape[1])] / rho
+    return np.maximum(V - theta, 0)
+
+
+SolverInfo = namedtuple('SolverInfo', ['iterations', 'gap', 'converged'])
+
+
+def _simplex_gap(G, D, E):
+    # Frank-Wolfe gap of every column: an upper bound on f(e) - min f for f(e) = 0.5 e.G e - d.e
+    gradient = np.dot(G, E) - D
+    return np.einsum('ij,ij->j', gradient, E) - gradient.min(axis=0)
+
+
+@timed()
+def decomposeFISTAGram(G, D, dtype=float, tol=1e-12, max_iter=50000, check_every=10, return_info=False):
+    """
+    Accelerated projected gradient (FISTA with adaptive restart) for the decomposeQP problem
+    of every column of D = P.T @ M at once.
+
+    Each iteration is one (N, N) x (N, R) product and a projection of all columns onto the
+    simplex. A column stops once its Frank-Wolfe gap, an upper bound on how far
+    0.5 * ||m - P e||^2 is above its minimum, is at most 'tol'; the gap is checked every
+    'check_every' iterations. All signatures start with equal exposure.
+
+    Returns:
+        numpy.ndarray: Exposures (N, R), or (exposures, SolverInfo) with return_info=True,
+        where SolverInfo holds the iterations, final gap and convergence flag of every column.
+    """
+    G = np.asarray(G, dtype=float)
+    D = np.asarray(D, dtype=float).reshape(G.shape[0], -1)
+    N, R = D.shape
+    step = 1 / np.linalg.eigvalsh(G)[-1]
+
+    E = np.full((N, R), 1 / N)
+    iterations = np.zeros(R, dtype=int)
+    gap = _simplex_gap(G, D, E)
+    active = np.where(gap > tol)[0]
+    Y, X, t = E[:, active], E[:, active], np.ones(len(active))
+
+    for iteration in range(1, max_iter + 1):
+        if not len(active):
+            break
+        X_new = project_simplex(Y - step * (np.dot(G, Y) - D[:, active]))
+        # Restart the momentum of columns where it points uphill (O'Donoghue & Candes)
+        restart = np.einsum('ij,ij->j', Y - X_new, X_new - X) > 0
+        t_new = (1 + np.sqrt(1 + 4 * t ** 2)) / 2
+        momentum = np.where(restart, 0, (t - 1) / t_new)
+        Y = X_new + momentum * (X_new - X)
+        X, t = X_new, np.where(restart, 1, t_new)
+
+        if iteration % check_every == 0 or iteration == max_iter:
+            E[:, active] = X
+            iterations[active] = iteration
+            gap[active] = _simplex_gap(G, D[:, active], X)
+            keep = gap[active] > tol
+            active, X, Y, t = active[keep], X[:, keep], Y[:, keep], t[keep]
+
+    count('qp_solves', R)
+    exposures = (E / E.sum(axis=0)).astype(dtype, copy=False)
+    if return_info:
+        return exposures, SolverInfo(iterations, gap, gap <= tol)
+    return exposures
+
+
+def decomposeFISTABatch(M, P, G=None, dtype=float, **options):
+    # decomposeFISTAGram for the columns of M; 'options' are its tol, max_iter, ... arguments
+    if G is None:
+        G = np.dot(P.T, P)
+    return decomposeFISTAGram(G, np.asarray(P.T @ M), dtype, **options)
+
+
+def decomposeFISTA(m, P):
+    # Single-sample form with the interface of decomposeQP
+    return decomposeFISTABatch(np.reshape(m, (-1, 1)), P)[:, 0]
+
+
+def _support_solution(G, D, S, L, tol):
+    """
+    Minimizer of the decomposeQP objective over the signatures S (with sum(e) = 1 and the
+    other exposures fixed at 0) for every column of D, and whether it satisfies the KKT
+    conditions of the full problem, i.e. is the exact solution.
+    """
+    a = _chol_solve(L, D[S])
+    u = _chol_solve(L, np.ones(len(S)))
+    lam = (a.sum(axis=0) - 1) / u.sum()
+    Z = a - lam * u[:, None]
+    # Lagrange multipliers of the bounds e_i >= 0 of the signatures outside S
+    others = np.setdiff1d(np.arange(G.shape[0]), S)
+    mu = np.dot(G[np.ix_(others, S)], Z) - D[others] + lam
+    optimal = Z.min(axis=0) >= -tol
+    if len(others):
+        optimal &= mu.min(axis=0) >= -tol
+    return Z, optimal
+
+
+@timed()
+def decomposeActiveSetGram(G, D, dtype=float, tol=1e-12, max_supports=20):
+    """
+    Exact solver for the decomposeQP problem of every column of D = P.T @ M that solves
+    all columns with the same optimal support (signatures with positive exposure) at once.
+
+    Bootstrap replicates of one sample mostly share their support. A column is solved
+    with quadprog and its support S becomes a candidate: one Cholesky factorization of
+    G[S, S] gives the equality-constrained minimizer over S of all remaining columns, and
+    the columns where it satisfies the KKT conditions (exposures >= 0, no multiplier of
+    a signature outside S below -tol) are done. This repeats with the next unsolved
+    column for at most 'max_supports' candidates; what is left is solved with quadprog
+    column by column; G is factorized for quadprog only once.
+
+    Returns:
+        numpy.ndarray: Exposures (N, R), equal to those of decomposeQPGram up to 'tol'.
+    """
+    G = np.asarray(G, dtype=float)
+    D = np.asarray(D, dtype=float).reshape(G.shape[0], -1)
+    N, R = D.shape
+    solve = _quadprog_solver(G)
+    exposures = np.zeros((N, R))
+    remaining = np.arange(R)
+    supports = set()
+
+    for _ in range(max_supports):
+        if not len(remaining):
+            break
+        # The next unsolved column is solved exactly; its support is the candidate
+        first, remaining = remaining[0], remaining[1:]
+        exposures[:, first] = solve(D[:, first])
+        count('qp_solves')
+        S = tuple(np.where(exposures[:, first] > np.sqrt(tol))[0])
+        if not S or S in supports or not len(remaining):
+            continue
+        supports.add(S)
+        try:
+            L = np.linalg.cholesky(G[np.ix_(S, S)])
+        except np.linalg.LinAlgError:
+            continue
+
+        Z, optimal = _support_solution(G, D[:, remaining], list(S), L, tol)
+        solved = remaining[optimal]
+        exposures[np.ix_(S, solved)] = Z[:, optimal]
+        count('qp_solves', len(solved))
+        remaining = remaining[~optimal]
+
+    count('qp_solves', len(remaining))
+    for r in remaining:
+        exposures[:, r] = solve(D[:, r])
+
+    exposures[exposures < 0] = 0
+    exposures /= exposures.sum(axis=0)
+    return exposures.astype(dtype, copy=False)
+
+
+def decomposeActiveSetBatch(M, P, G=None, dtype=float, **options):
+    # decomposeActiveSetGram for the columns of M; 'options' are its tol and max_supports arguments
+    if G is None:
+        G = np.dot(P.T, P)
+    return decomposeActiveSetGram(G, np.asarray(P.T @ M), dtype, **options)
+
+
+def decomposeActiveSet(m, P):
+    # Single-sample form with the interface of decomposeQP
+    return decomposeActiveSetBatch(np.reshape(m, (-1, 1)), P)[:, 0]
+
+
+# Solvers by name: (function for one sample, function for all columns of M or None).
+# A batch function is called as batch(M, P, G, dtype) with G = P.T @ P or None.
+SOLVERS = {}
+
+
+def register_solver(name, func, batch=None):
+    SOLVERS[name] = (func, batch)
+    return func
+
+
+def get_solver(method):
+    # The single-sample function of a registered solver name; functions are returned as they are
+    if isinstance(method, str):
+        if method not in SOLVERS:
+            raise ValueError(f"Unknown solver '{method}', expected one of {sorted(SOLVERS)}.")
+        return SOLVERS[method][0]
+    return method
+
+
+def batch_solver(func):
+    # Batch function registered for a single-sample function, None if there is none
+    for single, batch in SOLVERS.values():
+        if single is func:
+            return batch
+    return None
+
+
+register_solver('quadprog', decomposeQP, decomposeQPBatch)
+register_solver('scipy', decomposeQPScipy)
+register_solver('fista', decomposeFISTA, decomposeFISTABatch)
+register_solver('active-set', decomposeActiveSet, decomposeActiveSetBatch)
+
+
 def decomposeQ(m, P):
     pass
 
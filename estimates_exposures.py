@@ -1,9 +1,36 @@
 import numpy as np
-from decompose import decomposeQP
-from utils import FrobeniusNorm, is_wholenumber
-
-
-def findSigExposures(M, P, decomposition_method=decomposeQP):
+from scipy import sparse
+from decompose import decomposeQP, decomposeQPGram, batch_solver, get_solver
+from utils import (is_wholenumber, bootstrap_samples, reconstruction_errors, gram_reconstruction_errors,
+                   normalize_columns)
+from profiling import count, timed
+from bootstrap_stats import BINS, BootstrapStats
+from parallel import executor_for, run_tasks, task_rngs
+
+# Chunks solved by a pool before their summaries are merged, which bounds the memory of
+# bootstrapSigExposuresStream with n_jobs > 1
+CHUNKS_PER_WAVE = 16
+
+
+def decompose_columns(M, P, decomposition_method=decomposeQP, gram=None, dtype=float):
+    # Solve every column of M; methods with a registered batch version (the default
+    # decomposeQP included) solve all columns together
+    batch = batch_solver(decomposition_method)
+    if batch is not None:
+        return batch(M, P, gram, dtype)
+    if sparse.issparse(M):
+        columns = [decomposition_method(M[:, i].toarray().ravel(), P) for i in range(M.shape[1])]
+        return np.column_stack(columns).astype(dtype, copy=False)
+    return np.apply_along_axis(decomposition_method, 0, M, P).astype(dtype, copy=False)
+
+
+def _compact(M):
+    # float32 or sparse profiles: errors are computed without a float64 copy of M
+    return sparse.issparse(M) or M.dtype != np.float64
+
+
+@timed()
+def findSigExposures(M, P, decomposition_method=decomposeQP, gram=None, dtype=None, inplace=False):
     """
      Find signature exposures for tumor profiles using specified decomposition method.
 
@@ -16,8 +43,21 @@ def findSigExposures(M, P, decomposition_method=decomposeQP):
              each column will be normalized to sum up to 1.
          P (numpy.ndarray): Signature profile matrix with a shape of (96, N),
              where N is the number of signatures (e.g., COSMIC: N=30).
-         decomposition_method (function, optional): The method selected to get the
-             optimal solution. It should be a function. Default is 'decomposeQP'.
+         decomposition_method (function or str, optional): The method selected to get the
+             optimal solution: a function or the name of a solver registered in
+             'decompose.SOLVERS' ('quadprog', 'scipy', 'fista'). Default is 'decomposeQP'.
+             Solvers with a batch version (e.g. 'decomposeQPBatch') solve all samples together.
+         gram (numpy.ndarray, optional): Precomputed P.T @ P (e.g. from 'catalogue.get_catalogue'),
+             used by the default method.
+         dtype (numpy.dtype, optional): Storage of the normalized profiles, exposures and errors.
+             Default is float64. With float32 the QP is still solved in float64, and the
+             exposures agree with the float64 ones to about 1e-6 (absolute), errors to about
+             1e-7; the R reference values are matched to 5 decimals instead of 7.
+         inplace (bool, optional): Normalize M in place instead of copying it. M must be
+             a floating point array (or sparse matrix) of 'dtype'. Default is False.
+
+         M can also be a scipy.sparse matrix of counts. It is normalized without being made
+         dense, and the results match those of the dense matrix.
 
      Returns:
          tuple: A tuple containing two numpy arrays.
@@ -43,24 +83,30 @@ def findSigExposures(M, P, decomposition_method=decomposeQP):
         raise ValueError("Matrices 'P' must have at least 2 columns (signatures).")
 
     # decomposition.method
+    decomposition_method = get_solver(decomposition_method)
     if not callable(decomposition_method):
         raise ValueError("Parameter 'decomposition_method' must be a function.")
 
     # Normalize M by column (just in case it is not normalized)
-    M = M / M.sum(axis=0)
+    M = normalize_columns(M, dtype, inplace)
 
     # Find solutions
     # Matrix of signature exposures per sample/patient (column)
-    exposures = np.apply_along_axis(decomposition_method, 0, M, P)
+    exposures = decompose_columns(M, P, decomposition_method, gram, M.dtype)
 
     # Compute estimation error for each sample/patient (Frobenius norm)
-    errors = np.vectorize(lambda i: FrobeniusNorm(M[:, i], P, exposures[:, i]))(range(M.shape[1]))
+    if _compact(M):
+        errors = gram_reconstruction_errors(M, P, exposures, gram).astype(M.dtype)
+    else:
+        errors = reconstruction_errors(M, P, exposures)
 
     return exposures, errors
 
 
 
-def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=decomposeQP):
+@timed()
+def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=decomposeQP, rng=None, gram=None,
+                          dtype=None):
     """
     Obtain the bootstrap distribution of signature exposures for a tumor sample.
 
@@ -75,8 +121,14 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
         R (int): The number of bootstrap replicates.
         mutation_count (int, optional): If 'm' is a vector of counts, then 'mutation_count' equals
             the summation of all the counts. If 'm' is probabilities, 'mutation_count' must be specified.
-        decomposition_method (function, optional): The method selected to get the optimal solution.
-            It should be a function. Default is 'decomposeQP'.
+        decomposition_method (function or str, optional): The method selected to get the optimal solution.
+            A function or a registered solver name (see 'findSigExposures'). Default is 'decomposeQP'.
+        rng (numpy.random.Generator or int, optional): Generator (or seed) used to draw the replicates.
+            If None, the global numpy random state is used.
+        gram (numpy.ndarray, optional): Precomputed P.T @ P, used by the default method.
+        dtype (numpy.dtype, optional): Storage of the replicates, exposures and errors, float64
+            by default. float32 halves the memory of large R, with the accuracy described
+            in 'findSigExposures'.
 
     Returns:
         tuple: A tuple containing two numpy arrays.
@@ -109,28 +161,110 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
 
     # Normalize m to be a vector of probabilities.
     m = m / np.sum(m)
+    decomposition_method = get_solver(decomposition_method)
 
     # Find optimal solutions using provided decomposition method for each bootstrap replicate
-    # Matrix of signature exposures per replicate (column)
-    K = len(m)  # number of mutation types
+    # Mutation frequencies per replicate (column), all R drawn at once
+    M = bootstrap_samples(m, mutation_count, R, rng, dtype=float if dtype is None else dtype)
 
-    def bootstrap_sample(m, mutation_count, K):
-        mutations_sampled = np.random.choice(K, size=mutation_count, p=m)
-        return np.bincount(mutations_sampled, minlength=K) / mutation_count
-
-    exposures = np.column_stack([
-        decomposition_method(bootstrap_sample(m, mutation_count, K), P) for _ in range(R)
-    ])
-    exposures = exposures / np.sum(exposures, axis=0)  # Normalize exposures
+    # Matrix of signature exposures per replicate (column)
+    exposures = decompose_columns(M, P, decomposition_method, gram, M.dtype)
+    exposures /= np.sum(exposures, axis=0)  # Normalize exposures
 
     # Compute estimation error for each replicate/trial (Frobenius norm)
     # G x R
-    errors = np.vectorize(lambda i: FrobeniusNorm(m, P, exposures[:, i]))(range(exposures.shape[1]))
+    if _compact(M):
+        errors = gram_reconstruction_errors(m, P, exposures, gram).astype(M.dtype)
+    else:
+        errors = reconstruction_errors(m, P, exposures)
 
     return exposures, errors
 
 
-def crossValidationSigExposures(m, P, fold_size, shuffle=True, decomposition_method=decomposeQP):
+def _bootstrap_chunk(m, P, R, mutation_count, decomposition_method, rng, gram, threshold, bins):
+    exposures, errors = bootstrapSigExposures(m, P, R, mutation_count, decomposition_method, rng, gram)
+    return BootstrapStats(P.shape[1], threshold, bins).add(exposures, errors)
+
+
+@timed()
+def bootstrapSigExposuresStream(m, P, R, mutation_count=None, decomposition_method=decomposeQP, chunk_size=1000,
+                                threshold=0.01, seed=None, n_jobs=1, executor=None, gram=None, bins=BINS):
+    """
+    Bootstrap distribution of the signature exposures of a sample, summarized on the fly.
+
+    The R replicates are drawn and solved in chunks of 'chunk_size' with bootstrapSigExposures,
+    and each chunk is reduced to a BootstrapStats (means, standard deviations, histogram
+    quantiles, replicates above 'threshold') before the next one, so memory does not grow
+    with R. Chunk i uses the i-th generator spawned from 'seed', so the result does not
+    depend on n_jobs; with a pool, CHUNKS_PER_WAVE chunks are solved at a time.
+
+    Parameters:
+        m, P, mutation_count, decomposition_method, gram: As in 'bootstrapSigExposures'.
+        R (int): The number of bootstrap replicates.
+        chunk_size (int, optional): Replicates drawn and solved at once. Default is 1000.
+        threshold (float, optional): Exposure above which a signature counts as present. Default is 0.01.
+        seed (int or numpy.random.SeedSequence, optional): Seed of the chunk generators. If None
+            (and n_jobs=1), the global numpy random state is used.
+        n_jobs (int, optional): Worker processes, -1 for all cores. Default is 1.
+        executor (concurrent.futures.Executor, optional): Pool to use instead of creating one.
+        bins (int, optional): Histogram bins; exposure quantiles are accurate to 1 / bins and
+            error quantiles to sqrt(2) / bins.
+
+    Returns:
+        BootstrapStats: e.g. stats.p_values() equals compute_p_value of all the replicates.
+
+    Examples:
+        stats = bootstrapSigExposuresStream(tumorBRCA[:, 1], signaturesCOSMIC, 100000, 2000, seed=0, n_jobs=4)
+        low, high = stats.quantiles([0.025, 0.975]).T
+    """
+    if mutation_count is None:
+        if not all(is_wholenumber(val) for val in m):
+            raise ValueError("Please specify the parameter 'mutation_count' in the function call or provide mutation counts in parameter 'm'.")
+        mutation_count = int(np.sum(m))
+    if gram is None:
+        gram = np.dot(P.T, P)
+
+    sizes = [min(chunk_size, R - start) for start in range(0, R, chunk_size)]
+    rngs = task_rngs(seed, len(sizes), n_jobs, executor)
+    stats = BootstrapStats(P.shape[1], threshold, bins)
+    with executor_for(n_jobs, executor) as pool:
+        wave = 1 if pool is None else CHUNKS_PER_WAVE
+        for start in range(0, len(sizes), wave):
+            chunks = run_tasks(_bootstrap_chunk,
+                               [(m, P, size, mutation_count, decomposition_method, rng, gram, threshold, bins)
+                                for size, rng in zip(sizes[start:start + wave], rngs[start:start + wave])],
+                               executor=pool)
+            for chunk in chunks:
+                stats.merge(chunk)
+    return stats
+
+
+def cross_validation_masks(K, fold_size, shuffle=True, repeats=1, rng=None):
+    """
+    Boolean masks (folds x K) of the mutation types held out in each cross-validation fold.
+
+    The mutation types are (optionally) shuffled and split into consecutive folds of
+    'fold_size'; the last fold holds the remainder. With 'repeats' > 1 this is done
+    again with a new shuffle and the folds of all repeats are stacked.
+    """
+    masks = []
+    for _ in range(repeats):
+        if not shuffle:
+            order = np.arange(K)
+        elif rng is None:
+            order = np.random.permutation(K)
+        else:
+            order = rng.permutation(K)
+        for start in range(0, K, fold_size):
+            mask = np.zeros(K, dtype=bool)
+            mask[order[start:start + fold_size]] = True
+            masks.append(mask)
+    return np.array(masks)
+
+
+@timed()
+def crossValidationSigExposures(m, P, fold_size, shuffle=True, decomposition_method=decomposeQP, rng=None,
+                                repeats=1, mask_signatures=False, gram=None):
     """
     Perform cross-validation to estimate signature exposures for a tumor sample.
 
@@ -144,8 +278,15 @@ def crossValidationSigExposures(m, P, fold_size, shuffle=True, decomposition_met
             where N is the number of signatures.
         fold_size (int): The number of cross-validation size.
         shuffle (bool): Change the order of mutations
-        decomposition_method (function, optional): The method selected to get the optimal solution.
-            It should be a function. Default is 'decomposeQP'.
+        decomposition_method (function or str, optional): The method selected to get the optimal solution.
+            A function or a registered solver name (see 'findSigExposures'). Default is 'decomposeQP'.
+        rng (numpy.random.Generator or int, optional): Generator (or seed) used to shuffle mutations.
+            If None, the global numpy random state is used.
+        repeats (int, optional): Number of times the folds are drawn with a new shuffle.
+        mask_signatures (bool, optional): Also leave the held-out mutation types out of 'P'
+            instead of only zeroing them in 'm'. The Gram matrix of each fold is then P.T @ P
+            minus the contribution of the held-out rows.
+        gram (numpy.ndarray, optional): Precomputed P.T @ P, used by the default method.
 
     Returns:
         tuple: A tuple containing two numpy arrays.
@@ -162,7 +303,8 @@ def crossValidationSigExposures(m, P, fold_size, shuffle=True, decomposition_met
         fold_exposures, errors = crossValidationSigExposures(tumorBRCA[:, 1], signaturesCOSMIC[:, sigsBRCA], num_folds=5, decomposeQP)
     """
     # Process and check function parameters
-    P = np.array(P)
+    P = np.asarray(P)
+    decomposition_method = get_solver(decomposition_method)
 
     if len(m) != P.shape[0]:
         raise ValueError("Length of vector 'm' and number of rows of matrix 'P' must be the same.")
@@ -172,33 +314,98 @@ def crossValidationSigExposures(m, P, fold_size, shuffle=True, decomposition_met
 
     m = m / np.sum(m)
 
-    if shuffle:
-        permutation_indices = np.random.permutation(len(m))
-        m = m[permutation_indices]
-        P = P[permutation_indices,:]
+    if rng is not None:
+        rng = np.random.default_rng(rng)
+    # Folds as masks of held-out mutation types; the problem does not depend on the order of
+    # mutation types, so the shuffle only decides which types end up in the same fold
+    masks = cross_validation_masks(len(m), fold_size, shuffle, repeats, rng)
+    count('cv_folds', len(masks))
+
+    # Profile of each fold (column) with the held-out mutation types set to zero
+    fold_profiles = np.where(masks.T, 0, m[:, None])
+    fold_profiles = fold_profiles / fold_profiles.sum(axis=0)
+
+    if decomposition_method is decomposeQP:
+        if gram is None:
+            gram = np.dot(P.T, P)
+        # Held-out types are zero in the fold profiles, so P.T @ profile needs no masking
+        D = np.dot(P.T, fold_profiles)
+        if mask_signatures:
+            fold_exposures = np.column_stack([
+                decomposeQPGram(gram - np.dot(P[mask].T, P[mask]), D[:, i])
+                for i, mask in enumerate(masks)
+            ])
+        else:
+            fold_exposures = decomposeQPGram(gram, D)
+    elif mask_signatures:
+        fold_exposures = np.column_stack([
+            decomposition_method(fold_profiles[~mask, i], P[~mask])
+            for i, mask in enumerate(masks)
+        ])
+    else:
+        fold_exposures = decompose_columns(fold_profiles, P, decomposition_method)
+    fold_exposures = fold_exposures / np.sum(fold_exposures, axis=0)
 
-    folds = [m[i:i + fold_size] for i in range(0, (len(m) - (len(m) % fold_size)), fold_size)]
+    # Compute estimation error for each replicate/trial (Frobenius norm)
+    errors = reconstruction_errors(m, P, fold_exposures)
 
-    # Handle the remaining elements that do not fit in full folds
-    if len(m) % fold_size != 0:
-        last_fold = m[-(len(m) % fold_size):]
-        folds.append(last_fold)
+    return fold_exposures, errors
 
-    def calculate_fold_exposures(i, num_folds):
-        fold = np.concatenate([folds[j] if j != i else [0] * len(folds[i] + 1) for j in range(num_folds)])
-        normalized_fold = fold / fold.sum()
-        return normalized_fold
 
-    # Perform cross-validation for each replicate
-    fold_exposures = np.column_stack([
-        decomposition_method(calculate_fold_exposures(i, len(folds)), P)
-        for i in range(len(folds))
-    ])
-    fold_exposures = fold_exposures / np.sum(fold_exposures, axis=0)
 
-    # Compute estimation error for each replicate/trial (Frobenius norm)
-    errors = np.vectorize(lambda i: FrobeniusNorm(m, P, fold_exposures[:, i]))(range(fold_exposures.shape[1]))
 
-    return fold_exposures, errors
+def _write_rows(f, sample_ids, values):
+    for sample, row in zip(sample_ids, values):
+        f.write(sample + ',' + ','.join('%.18e' % x for x in np.atleast_1d(row)) + '\n')
+
+
+@timed()
+def findSigExposuresStream(chunks, P, exposures_file, errors_file, decomposition_method=decomposeQP,
+                           signature_names=None):
+    """
+    Find signature exposures for a cohort given as a stream of sample chunks.
+
+    Each chunk is solved with 'findSigExposures' and its results are appended to the output
+    files before the next chunk is read, so memory use does not grow with the cohort size.
 
+    Parameters:
+        chunks (iterable): Pairs (sample_ids, M_chunk) as yielded by 'utils.iter_profile_chunks',
+            where M_chunk has shape (96, n) and sample_ids has n elements.
+        P (numpy.ndarray): Signature profile matrix with a shape of (96, N).
+        exposures_file (str or file): Output csv with one row per sample: ID and N exposures.
+        errors_file (str or file): Output csv with one row per sample: ID and estimation error.
+        decomposition_method (function, optional): The method selected to get the
+            optimal solution. Default is 'decomposeQP'.
+        signature_names (list, optional): Column names of the exposures file. Default is 1..N.
+
+    Returns:
+        int: The number of samples processed.
 
+    Examples:
+        chunks = iter_profile_chunks('data/M.csv', 1000, delimiter='\\t', skip_columns=2)
+        findSigExposuresStream(chunks, signaturesCOSMIC, 'output/exposures.csv', 'output/errors.csv')
+    """
+    if signature_names is None:
+        signature_names = [str(i) for i in range(1, P.shape[1] + 1)]
+    # Only the samples change between chunks
+    gram = np.dot(P.T, P)
+
+    exposures_out = open(exposures_file, 'w') if isinstance(exposures_file, str) else exposures_file
+    errors_out = open(errors_file, 'w') if isinstance(errors_file, str) else errors_file
+    try:
+        exposures_out.write('sample,' + ','.join(signature_names) + '\n')
+        errors_out.write('sample,error\n')
+
+        n_samples = 0
+        for sample_ids, M in chunks:
+            exposures, errors = findSigExposures(M, P, decomposition_method, gram=gram)
+            _write_rows(exposures_out, sample_ids, exposures.T)
+            _write_rows(errors_out, sample_ids, errors)
+            n_samples += len(sample_ids)
+    finally:
+        if isinstance(exposures_file, str):
+            exposures_out.close()
+        if isinstance(errors_file, str):
+            errors_out.close()
+
+    return n_samples
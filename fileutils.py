@@ -0,0 +1,26 @@
+"""
+File helpers shared by the caches and stores.
+"""
+import os
+import tempfile
+
+
+def atomic_write(target, write, mode='wb'):
+    """
+    Write 'target' with write(f) through a temporary file in the same directory, which
+    replaces 'target' only once write returned: readers, also in other processes, never
+    see a partially written file. The temporary file is removed when writing fails.
+
+    Parameters:
+        target (str): Path of the file to write.
+        write (callable): Called with the open temporary file.
+        mode (str, optional): Mode of the temporary file, 'wb' (default) or 'w'.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, target)
+    except BaseException:
+        os.remove(tmp)
+        raise
@@ -1,71 +1,184 @@
 import numpy as np
 from estimates_exposures import bootstrapSigExposures, crossValidationSigExposures, findSigExposures
 from decompose import decomposeQP
+import model_selection_new
+from model_selection_new import bootstraped_patient, sequential_p_values
+from parallel import executor_for, run_tasks, seed_sequence, task_rngs
+from profiling import count, timed
 
+
+def _bootstrap_column(column, P, R, mutation_count, threshold, decomposition_method, rng):
+    exposures, errors = bootstrapSigExposures(
+        column, P, R, mutation_count, decomposition_method, rng
+    )
+    # Only the number of replicates above the threshold is sent back
+    return (exposures > threshold).sum(axis=1)
+
+
+def _sequential_column(column, P, R, mutation_count, threshold, significance_level, batch_size, confidence,
+                       decomposition_method, stop_at_max, rng):
+    M = bootstraped_patient(column, mutation_count, R, rng)
+    return sequential_p_values(M, P, threshold, significance_level, batch_size, confidence, decomposition_method,
+                               stop_at_max)
+
+
+def _crossvalidation_column(column, P, fold_size, threshold, decomposition_method, rng, repeats=1,
+                            mask_signatures=False):
+    exposures, errors = crossValidationSigExposures(
+        column, P, fold_size, True, decomposition_method, rng, repeats, mask_signatures
+    )
+    return exposures > threshold
+
+
+def _replicate_chunks(R, chunk_size):
+    # Sizes of the blocks of bootstrap replicates solved as separate tasks
+    if chunk_size is None or chunk_size >= R:
+        return [R]
+    return [chunk_size] * (R // chunk_size) + ([R % chunk_size] if R % chunk_size else [])
+
+
+@timed()
 def runBootstrapOnMatrix(
-    m, P, R, mutation_count, threshold=0.01, decomposition_method=decomposeQP
+    m, P, R, mutation_count, threshold=0.01, decomposition_method=decomposeQP,
+    n_jobs=1, executor=None, seed=None, chunk_size=None
 ):
-    def process_column(column):
-        exposures, errors = bootstrapSigExposures(
-            column, P, R, mutation_count, decomposition_method
-        )
-        return exposures > threshold
+    # Patients (columns of m) and blocks of 'chunk_size' replicates are independent tasks.
+    # Each task gets its own generator spawned from 'seed', so results do not depend on n_jobs.
+    columns = m.reshape(m.shape[0], -1)
+    chunks = _replicate_chunks(R, chunk_size)
+    tasks = [(columns[:, i], r) for i in range(columns.shape[1]) for r in chunks]
+    rngs = task_rngs(seed, len(tasks), n_jobs, executor)
+
+    results = run_tasks(
+        _bootstrap_column,
+        [(column, P, r, mutation_count, threshold, decomposition_method, rng)
+         for (column, r), rng in zip(tasks, rngs)],
+        n_jobs,
+        executor,
+    )
+
+    # Replicates above the threshold per signature and patient
+    above = np.column_stack(results)
+    above = above.reshape(P.shape[1], columns.shape[1], len(chunks)).sum(axis=2)
+
+    p_values = 1 - above / R
+    return p_values if m.ndim > 1 else p_values[:, 0]
 
-    all_exposures = np.apply_along_axis(process_column, 0, m)
 
-    return 1 - all_exposures.sum(axis=1) / all_exposures.shape[1]
 
+@timed()
+def runSequentialBootstrapOnMatrix(
+    m, P, R, mutation_count, threshold=0.01, significance_level=0.01, decomposition_method=decomposeQP,
+    n_jobs=1, executor=None, seed=None, batch_size=50, confidence=0.99, stop_at_max=False
+):
+    # runBootstrapOnMatrix that stops early: every patient draws at most R replicates and
+    # stops once its p-values are decided (model_selection_new.sequential_p_values).
+    # Patients are the tasks; the replicates of a patient are solved in sequence, so they
+    # are not split into chunks. Returns (p_values, replicates_used).
+    columns = m.reshape(m.shape[0], -1)
+    rngs = task_rngs(seed, columns.shape[1], n_jobs, executor)
+    results = run_tasks(
+        _sequential_column,
+        [(columns[:, i], P, R, mutation_count, threshold, significance_level, batch_size, confidence,
+          decomposition_method, stop_at_max, rngs[i])
+         for i in range(columns.shape[1])],
+        n_jobs,
+        executor,
+    )
+    p_values = np.column_stack([p for p, _ in results])
+    replicates_used = np.column_stack([used for _, used in results])
+    if m.ndim == 1:
+        return p_values[:, 0], replicates_used[:, 0]
+    return p_values, replicates_used
 
 
+@timed()
 def runCrossvaldiationOnMatrix(
-    m, P, fold_size=4, threshold=0.01, decomposition_method=decomposeQP
+    m, P, fold_size=4, threshold=0.01, decomposition_method=decomposeQP,
+    n_jobs=1, executor=None, seed=None, repeats=1, mask_signatures=False
 ):
-    def process_column(column):
-        exposures, errors = crossValidationSigExposures(
-            column,
-            P,
-            fold_size,
-            True,
-            decomposition_method,
-        )
-        return exposures > threshold
+    columns = m.reshape(m.shape[0], -1)
+    rngs = task_rngs(seed, columns.shape[1], n_jobs, executor)
+
+    results = run_tasks(
+        _crossvalidation_column,
+        [(columns[:, i], P, fold_size, threshold, decomposition_method, rngs[i], repeats, mask_signatures)
+         for i in range(columns.shape[1])],
+        n_jobs,
+        executor,
+    )
 
-    all_exposures = np.apply_along_axis(process_column, 0, m)
+    # signatures x folds x patients
+    all_exposures = np.stack(results, axis=-1)
 
-    return 1 - all_exposures.sum(axis=1) / all_exposures.shape[1]
+    p_values = 1 - all_exposures.sum(axis=1) / all_exposures.shape[1]
+    return p_values if m.ndim > 1 else p_values[:, 0]
 
 
 
+@timed()
 def backward_elimination(
-    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP
+    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP,
+    n_jobs=1, executor=None, seed=None, chunk_size=None, adaptive=False
 ):
+    # Every bootstrap round gets a fresh child of 'seed'. With adaptive=True the p-values come
+    # from runSequentialBootstrapOnMatrix, whose replicates are not split into chunks.
+    if adaptive and chunk_size is not None:
+        raise ValueError("'chunk_size' does not apply to the adaptive bootstrap, whose replicates are solved in sequence.")
+    seeds = seed_sequence(seed) if seed is not None else None
+
+    def next_seed():
+        return seeds.spawn(1)[0] if seeds is not None else None
+
+    # Ties between equal p-values are broken with a generator of its own when seeded, and
+    # with the global random state otherwise (so 'np.random.seed' keeps runs reproducible)
+    tie_rng = np.random.default_rng(next_seed()) if seeds is not None else np.random
     best_columns = np.arange(P.shape[1])
     P_temp = P
     model_error, _ = findSigExposures(
         m.reshape(-1, 1), P_temp, decomposition_method
     )
-    while True:
-        changed = False
-        p_values = runBootstrapOnMatrix(
-            m,
-            P_temp,
-            R,
-            mutation_count=mutation_count,
-            threshold=threshold,
-            decomposition_method=decomposition_method,
-        )
-
-        max_p_value = p_values.max()
-        if max_p_value > significance_level:
-            indices_with_max = np.where(p_values == max_p_value)[0]
-            max_p_var = np.random.choice(indices_with_max)
-            best_columns = np.delete(best_columns, max_p_var)
-            P_temp = P[:, best_columns]
-
-            changed = True
-
-        if not changed:
-            break
+    with executor_for(n_jobs, executor) as pool:
+        while True:
+            count('elimination_iterations')
+            changed = False
+            if adaptive:
+                p_values, _ = runSequentialBootstrapOnMatrix(
+                    m,
+                    P_temp,
+                    R,
+                    mutation_count=mutation_count,
+                    threshold=threshold,
+                    significance_level=significance_level,
+                    decomposition_method=decomposition_method,
+                    executor=pool,
+                    seed=next_seed(),
+                    stop_at_max=True,
+                )
+            else:
+                p_values = runBootstrapOnMatrix(
+                    m,
+                    P_temp,
+                    R,
+                    mutation_count=mutation_count,
+                    threshold=threshold,
+                    decomposition_method=decomposition_method,
+                    executor=pool,
+                    seed=next_seed(),
+                    chunk_size=chunk_size,
+                )
+
+            max_p_value = p_values.max()
+            if max_p_value > significance_level:
+                indices_with_max = np.where(p_values == max_p_value)[0]
+                max_p_var = tie_rng.choice(indices_with_max)
+                best_columns = np.delete(best_columns, max_p_var)
+                P_temp = P[:, best_columns]
+
+                changed = True
+
+            if not changed:
+                break
 
     return (
         best_columns,
@@ -75,6 +188,7 @@ def backward_elimination(
             mutation_count=mutation_count,
             R=R,
             decomposition_method=decomposition_method,
+            rng=next_seed(),
         ),
         findSigExposures(
             m.reshape(-1, 1), P_temp, decomposition_method=decomposition_method
@@ -84,56 +198,9 @@ def backward_elimination(
 
 
 def forward_elimination(
-    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP
+    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP, seed=None
 ):
-    best_columns = [1]
-    P_temp = np.zeros((P.shape[0], 0))
-    while True:
-        changed = False
-        best_p_value = 1
-        best_p_var = -1
-
-        for i in range(P.shape[1] - 1, 0, -1):
-            if i in best_columns:
-                continue
-
-            # Try adding the ith column to the model
-            P_temp_with_i = np.hstack([P_temp, P[:, [i]]])
-            p_values = runBootstrapOnMatrix(
-                m, P_temp_with_i, R, mutation_count=mutation_count, threshold=threshold
-            )
-
-            # Check if the new variable is significant and better than the current best
-            if p_values[-1] < best_p_value and p_values[-1] < significance_level:
-                best_p_value = p_values[-1]
-                best_p_var = i
-
-        # If a significant variable was found, add it to the model
-        if best_p_var != -1:
-            best_columns.append(best_p_var)
-            P_temp = np.hstack([P_temp, P[:, [best_p_var]]])
-            changed = True
-
-        # Stop if no new significant variable was found
-        if not changed:
-            break
-
-    return (
-        best_columns,
-        bootstrapSigExposures(
-            m,
-            P_temp,
-            mutation_count=mutation_count,
-            R=R,
-            decomposition_method=decomposition_method,
-        ),
-        findSigExposures(
-            m.reshape(m.shape[0], 1), P_temp, decomposition_method=decomposition_method
-        ),
+    # Forward selection on one shared set of replicates, see model_selection_new.forward_elimination
+    return model_selection_new.forward_elimination(
+        m, P, R, threshold, mutation_count, significance_level, decomposition_method, rng=seed
     )
-
-
-
-
-
-
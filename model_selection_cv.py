@@ -1,73 +1,68 @@
 import numpy as np
-from estimates_exposures import crossValidationSigExposures, findSigExposures
+from estimates_exposures import findSigExposures
 from decompose import decomposeQP
+from model_selection import runCrossvaldiationOnMatrix
+from parallel import executor_for, seed_sequence
+from profiling import count, timed
 
 
 
-
-def runCrossvaldiationOnMatrix(
-    m, P, fold_size=4, threshold=0.01, decomposition_method=decomposeQP
+@timed()
+def backward_elimination(
+    m, P, fold_size, threshold, significance_level, decomposition_method=decomposeQP,
+    n_jobs=1, executor=None, seed=None
 ):
-    def process_column(column):
-        exposures, errors = crossValidationSigExposures(
-            column,
-            P,
-            fold_size,
-            True,
-            decomposition_method,
-        )
-        return exposures > threshold
-
-    all_exposures = np.apply_along_axis(process_column, 0, m)
-
-    return 1 - all_exposures.sum(axis=1) / all_exposures.shape[1]
-
+    seeds = seed_sequence(seed) if seed is not None else None
 
+    def next_seed():
+        return seeds.spawn(1)[0] if seeds is not None else None
 
-def backward_elimination(
-    m, P, fold_size, threshold, significance_level, decomposition_method=decomposeQP
-):
+    # Ties between equal p-values are broken with a generator of its own when seeded, and
+    # with the global random state otherwise (so 'np.random.seed' keeps runs reproducible)
+    tie_rng = np.random.default_rng(next_seed()) if seeds is not None else np.random
     best_columns = np.arange(P.shape[1])
     P_temp = P
     model_error, _ = findSigExposures(
         m.reshape(-1, 1), P_temp, decomposition_method
     )
-    while True:
-        changed = False
-        p_values = runCrossvaldiationOnMatrix(
+    with executor_for(n_jobs, executor) as pool:
+        while True:
+            count('elimination_iterations')
+            changed = False
+            p_values = runCrossvaldiationOnMatrix(
+                m,
+                P_temp,
+                fold_size=fold_size,
+                threshold=threshold,
+                decomposition_method=decomposition_method,
+                executor=pool,
+                seed=next_seed(),
+            )
+
+            max_p_value = p_values.max()
+            if max_p_value > significance_level:
+                indices_with_max = np.where(p_values == max_p_value)[0]
+                max_p_var = tie_rng.choice(indices_with_max)
+                best_columns = np.delete(best_columns, max_p_var)
+                P_temp = P[:, best_columns]
+
+                changed = True
+
+            if not changed:
+                break
+
+        cross_validation = runCrossvaldiationOnMatrix(
             m,
             P_temp,
-            fold_size=fold_size,
-            threshold=threshold,
             decomposition_method=decomposition_method,
+            executor=pool,
+            seed=next_seed(),
         )
 
-        max_p_value = p_values.max()
-        if max_p_value > significance_level:
-            indices_with_max = np.where(p_values == max_p_value)[0]
-            max_p_var = np.random.choice(indices_with_max)
-            best_columns = np.delete(best_columns, max_p_var)
-            P_temp = P[:, best_columns]
-
-            changed = True
-
-        if not changed:
-            break
-
     return (
         best_columns,
-        runCrossvaldiationOnMatrix(
-            m,
-            P_temp,
-            decomposition_method=decomposition_method,
-        ),
+        cross_validation,
         findSigExposures(
             m.reshape(-1, 1), P_temp, decomposition_method=decomposition_method
         ),
     )
-
-
-
-
-
-
@@ -1,16 +1,102 @@
 import numpy as np
+from scipy.stats import beta
 from estimates_exposures import bootstrapSigExposures, crossValidationSigExposures, findSigExposures
-from decompose import decomposeQP
-from utils import is_wholenumber
+from decompose import decomposeQP, decomposeQPGram, ActiveSetQP
+from utils import is_wholenumber, bootstrap_samples, reconstruction_errors
+import profiling
+from profiling import count, timed
 def compute_p_value(exposures, threshold=0.01):
     grater_than_threshold = exposures > threshold
 
     return 1 - grater_than_threshold.sum(axis=1) / grater_than_threshold.shape[1]
 
 
-def bootstraped_patient(m, mutation_count, R):
-    K = len(m)
+def p_value_bounds(below, replicates, confidence=0.99):
+    """
+    Clopper-Pearson confidence interval of p-values estimated from 'below' replicates
+    at or below the threshold out of 'replicates'.
+    """
+    below = np.asarray(below, dtype=float)
+    replicates = np.asarray(replicates, dtype=float)
+    alpha = 1 - confidence
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(below > 0, beta.ppf(alpha / 2, below, replicates - below + 1), 0.0)
+        upper = np.where(below < replicates, beta.ppf(1 - alpha / 2, below + 1, replicates - below), 1.0)
+    return lower, upper
 
+
+@timed()
+def sequential_p_values(
+    M, P, threshold=0.01, significance_level=0.01, batch_size=50, confidence=0.99, decomposition_method=decomposeQP,
+    stop_at_max=False
+):
+    """
+    Bootstrap p-values that stop early once they are clearly on one side of 'significance_level'.
+
+    The replicates (columns of M) are solved in batches of 'batch_size'. After each batch the
+    Clopper-Pearson interval of every signature's p-value is computed; a signature whose
+    interval lies entirely above 'significance_level', or whose upper bound is at or below it,
+    keeps its current estimate and stops counting. Solving stops when every signature is
+    decided or all replicates are used.
+
+    With 'stop_at_max', which is what backward elimination needs, only signatures below the
+    level stop counting, and solving also stops once the signature with the largest p-value
+    estimate is above the level and so is every signature whose interval reaches above that
+    signature's lower bound. The largest estimate then belongs to a signature that all R
+    replicates would also put above the level (at the confidence of the intervals), though not always to the one with the
+    largest p-value over all R replicates when several are within the intervals of each
+    other; removing it makes backward elimination take another path through such
+    signatures, which usually ends in the same model.
+
+    Parameters:
+        M (numpy.ndarray): Bootstrap replicates (96, R), e.g. from 'bootstraped_patient'.
+        P (numpy.ndarray): Signature profile matrix (96, N).
+        threshold (float): Exposure at or below which a signature counts as absent in a replicate.
+        significance_level (float): Level the p-values are compared with.
+        batch_size (int): Replicates solved between two checks.
+        confidence (float): Confidence of the interval used for stopping.
+        stop_at_max (bool): Stop once the signature with the largest p-value is known up to
+            signatures that are all above the level.
+
+    Returns:
+        tuple: (p_values, replicates_used), two arrays of length N.
+    """
+    G = np.dot(P.T, P)
+    D = np.dot(P.T, M)
+    N, R = P.shape[1], M.shape[1]
+
+    below = np.zeros(N)
+    used = np.zeros(N, dtype=int)
+    undecided = np.ones(N, dtype=bool)
+    for start in range(0, R, batch_size):
+        stop = min(start + batch_size, R)
+        if decomposition_method is decomposeQP:
+            exposures = decomposeQPGram(G, D[:, start:stop])
+        else:
+            exposures, _ = findSigExposures(M[:, start:stop], P, decomposition_method=decomposition_method)
+
+        below[undecided] += (exposures[undecided] <= threshold).sum(axis=1)
+        used[undecided] = stop
+
+        lower, upper = p_value_bounds(below, used, confidence)
+        if stop_at_max:
+            undecided &= upper > significance_level
+            p_values = below / used
+            tied = p_values == p_values.max()
+            best = np.argmax(p_values)
+            # Signatures that may have a larger p-value than 'best' must all be above the level
+            contenders = ~tied & (upper > lower[best])
+            if lower[best] > significance_level and np.all(lower[contenders] > significance_level):
+                break
+        else:
+            undecided &= (lower <= significance_level) & (upper > significance_level)
+        if not undecided.any():
+            break
+
+    return below / used, used
+
+
+def bootstraped_patient(m, mutation_count, R, rng=None):
     if mutation_count is None:
         if all(is_wholenumber(val) for val in m):
             mutation_count = int(m.sum())
@@ -18,38 +104,67 @@ def bootstraped_patient(m, mutation_count, R):
             raise ValueError("Please specify the parameter 'mutation_count' in the function call or provide mutation counts in parameter 'm'.")
     m = m / np.sum(m)
 
-
-    def bootstrap_sample(m, mutation_count, K):
-        mutations_sampled = np.random.choice(K, size=mutation_count, p=m)
-        return np.bincount(mutations_sampled, minlength=K) / mutation_count
-
-    M = np.column_stack([bootstrap_sample(m, mutation_count, K) for _ in range(R)])
-    return M
+    return bootstrap_samples(m, mutation_count, R, rng)
 
 
+@timed()
 def backward_elimination(
-    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP
+    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP, rng=None,
+    drop_level=None, adaptive=False, batch_size=50, confidence=0.99
 ):
+    # drop_level: signatures with a p-value at or above it are clearly not present and are
+    # all removed in the same round; the others are removed one per round as before.
+    # adaptive: p-values from sequential_p_values(stop_at_max=True), which stops solving
+    # replicates once the signature to remove is known (R is then the maximum); among
+    # signatures above the level whose p-values are within the confidence intervals of each
+    # other it may remove another one than the fixed-R path
+    if rng is not None:
+        rng = np.random.default_rng(rng)
+    # Ties between equal p-values are broken with 'rng' when it is given, and with the
+    # global random state otherwise (so 'np.random.seed' keeps runs reproducible)
+    tie_rng = rng if rng is not None else np.random
     best_columns = np.arange(P.shape[1])
     P_temp = P
     model_error, _ = findSigExposures(
         m.reshape(-1, 1), P_temp, decomposition_method
     )
-    M = bootstraped_patient(m, mutation_count, R)
+    M = bootstraped_patient(m, mutation_count, R, rng)
+
+    # The replicates are fixed, so the default method keeps every replicate's active set
+    # and factorization between rounds and only updates them when a signature is dropped
+    solver = ActiveSetQP(M, P) if decomposition_method is decomposeQP and not adaptive else None
 
     while True:
+        count('elimination_iterations')
         changed = False
 
-        exposures, errors = findSigExposures(
-            M, P_temp, decomposition_method=decomposition_method
-        )
-        p_values = compute_p_value(exposures, threshold=threshold)
+        if adaptive:
+            p_values, _ = sequential_p_values(
+                M, P_temp, threshold, significance_level, batch_size, confidence, decomposition_method,
+                stop_at_max=True,
+            )
+        elif solver is not None:
+            exposures = solver.solve()
+            p_values = compute_p_value(exposures, threshold=threshold)
+        else:
+            exposures, errors = findSigExposures(
+                M, P_temp, decomposition_method=decomposition_method
+            )
+            p_values = compute_p_value(exposures, threshold=threshold)
 
         max_p_value = p_values.max()
         if max_p_value > significance_level:
             indices_with_max = np.where(p_values == max_p_value)[0]
-            max_p_var = np.random.choice(indices_with_max)
-            best_columns = np.delete(best_columns, max_p_var)
+            removed = [tie_rng.choice(indices_with_max)]
+            if drop_level is not None:
+                clearly_absent = np.where(p_values >= max(drop_level, significance_level))[0]
+                # Keep at least one signature
+                if len(clearly_absent) < len(p_values):
+                    removed = sorted(set(removed) | set(clearly_absent))
+            for max_p_var in sorted(removed, reverse=True):
+                best_columns = np.delete(best_columns, max_p_var)
+                if solver is not None:
+                    solver.drop(max_p_var)
             P_temp = P[:, best_columns]
 
             changed = True
@@ -65,14 +180,94 @@ def backward_elimination(
             mutation_count=mutation_count,
             R=R,
             decomposition_method=decomposition_method,
+            rng=rng,
         ),
         findSigExposures(
             m.reshape(-1, 1), P_temp, decomposition_method=decomposition_method
         ),
     )
 
-import cProfile
-import pstats
+@timed()
+def forward_elimination(
+    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP, rng=None,
+    tol=1e-10
+):
+    """
+    Forward selection on one shared set of bootstrap replicates.
+
+    Every round tries each remaining signature together with the selected ones and adds the
+    candidate with the lowest p-value below 'significance_level' (ties, e.g. in the first
+    round where a single signature always has exposure 1, go to the lowest mean
+    reconstruction error).
+
+    All candidates of a round are screened with one product from the solution X of the
+    current model S: with g = P.T @ (P[:, S] @ X - M) and mu the smallest g over S, adding
+    signature i leaves a replicate's optimum unchanged (i gets exposure 0) wherever
+    g_i >= mu - 'tol', as the KKT conditions still hold there. A candidate must be present
+    in more than (1 - significance_level) * R replicates to be selected, so only candidates
+    that may enter that many replicates are solved, and only on those replicates, from
+    sub-blocks of P.T @ P and P.T @ M computed once.
+    """
+    if rng is not None:
+        rng = np.random.default_rng(rng)
+    M = bootstraped_patient(m, mutation_count, R, rng)
+    G = np.dot(P.T, P)
+    D = np.dot(P.T, M)
+
+    best_columns = []
+    # Exposures of the selected signatures in every replicate
+    X = np.zeros((0, R))
+    while len(best_columns) < P.shape[1]:
+        count('elimination_iterations')
+        candidates = np.setdiff1d(np.arange(P.shape[1]), best_columns)
+        if best_columns:
+            mu = (np.dot(G[np.ix_(best_columns, best_columns)], X) - D[best_columns]).min(axis=0)
+            entering = np.dot(G[np.ix_(candidates, best_columns)], X) - D[candidates] < mu - tol
+        else:
+            entering = np.ones((len(candidates), R), dtype=bool)
+        eligible = np.where(entering.sum(axis=1) > (1 - significance_level) * R)[0]
+        count('candidates_screened_out', len(candidates) - len(eligible))
+
+        best = None
+        for c in eligible:
+            columns = best_columns + [candidates[c]]
+            exposures = np.vstack([X, np.zeros(R)])
+            solve = entering[c]
+            if len(columns) == 1:
+                exposures[:] = 1
+            elif decomposition_method is decomposeQP:
+                exposures[:, solve] = decomposeQPGram(G[np.ix_(columns, columns)], D[np.ix_(columns, solve)])
+            else:
+                exposures[:, solve], _ = findSigExposures(M[:, solve], P[:, columns],
+                                                          decomposition_method=decomposition_method)
+            p_value = compute_p_value(exposures[-1:], threshold=threshold)[0]
+            if p_value >= significance_level:
+                continue
+            error = reconstruction_errors(M, P[:, columns], exposures).mean()
+            if best is None or (p_value, error) < best[:2]:
+                best = (p_value, error, candidates[c], exposures)
+
+        if best is None:
+            break
+        best_columns.append(best[2])
+        X = best[3]
+
+    best_columns = np.array(best_columns, dtype=int)
+    P_temp = P[:, best_columns]
+    return (
+        best_columns,
+        bootstrapSigExposures(
+            m,
+            P_temp,
+            mutation_count=mutation_count,
+            R=R,
+            decomposition_method=decomposition_method,
+            rng=rng,
+        ),
+        findSigExposures(
+            m.reshape(-1, 1), P_temp, decomposition_method=decomposition_method
+        ),
+    )
 
 def main_block():
     tumorBRCA = np.genfromtxt('data/M.csv', delimiter='\t', skip_header=1)
@@ -89,7 +284,7 @@ def main_block():
         print(best_columns)
 
 if __name__ == '__main__':
-    #cProfile.runctx('main_block()', globals(), locals(), 'profile_results.prof')
-    #s = pstats.Stats('profile_results.prof')
-    #s.strip_dirs().sort_stats('time').print_stats()
-    print(main_block())
\ No newline at end of file
+    # Where the time goes: run with MUTATION_SIGNATURES_PROFILE=1
+    print(main_block())
+    if profiling.enabled():
+        print(profiling.report())
\ No newline at end of file
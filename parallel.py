@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+import profiling
+
+
+def seed_sequence(seed=None):
+    # Accept an int, None or an already built SeedSequence
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def spawn_rngs(seed, n):
+    """
+    Create n independent random generators derived from one seed.
+
+    The i-th generator depends only on 'seed' and i, so a task receives the same
+    random stream whether it runs serially or in a worker process.
+    """
+    return [np.random.default_rng(s) for s in seed_sequence(seed).spawn(n)]
+
+
+def task_rngs(seed, n, n_jobs=1, executor=None):
+    # Serial runs without a seed keep using the global numpy random state.
+    # Worker processes must never share it (forked children would draw the same numbers).
+    if seed is None and n_jobs == 1 and executor is None:
+        return [None] * n
+    return spawn_rngs(seed, n)
+
+
+@contextmanager
+def executor_for(n_jobs=1, executor=None):
+    """
+    Yield the executor tasks should be submitted to.
+
+    A given executor is reused as is, n_jobs == 1 yields None (run in this process),
+    otherwise a process pool with n_jobs workers (all cores for n_jobs=-1) is
+    created and shut down on exit.
+    """
+    if executor is not None or n_jobs == 1:
+        yield executor
+        return
+    max_workers = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        yield pool
+
+
+def run_tasks(func, tasks, n_jobs=1, executor=None):
+    """
+    Call 'func(*args)' for every tuple in 'tasks' and return the results in order.
+
+    'func' and the arguments must be picklable when running in a process pool.
+    When profiling is on, the timers and counters of the workers are added to this process.
+    """
+    tasks = list(tasks)
+    with executor_for(n_jobs, executor) as pool:
+        if pool is None or not tasks:
+            return [func(*args) for args in tasks]
+        if not profiling.enabled():
+            return list(pool.map(func, *zip(*tasks)))
+        results = []
+        for result, stats in pool.map(profiling.profiled_call, [func] * len(tasks), *zip(*tasks)):
+            profiling.merge(stats)
+            results.append(result)
+        return results
@@ -0,0 +1,176 @@
+"""
+Lightweight instrumentation: per-stage timers and counters.
+
+Profiling is off unless the environment variable MUTATION_SIGNATURES_PROFILE is set
+(to anything but 0), or code runs inside 'with profiling():'. When it is off, the
+timers and counters cost a single check.
+
+Stages are the instrumented functions (decomposition, exposure estimation, model
+selection); their times include the stages they call. Counters:
+    qp_solves               quadratic programs solved (one per sample, replicate or fold)
+    bootstrap_replicates    bootstrap replicates drawn
+    cv_folds                cross-validation folds solved
+    elimination_iterations  rounds of backward/forward elimination
+    cache_hits, cache_misses              result_cache.ResultCache lookups
+    catalogue_cache_hits, catalogue_cache_builds    binary catalogue cache (catalogue.py)
+
+Work done in worker processes by parallel.run_tasks is counted in the parent. A
+'with profiling():' block only collects the work of its own thread (or asyncio task);
+other threads keep counting into the Stats of the environment variable, if any.
+
+Examples:
+    with profiling() as stats:
+        backward_elimination(m, P, 100, 0.01, 1000, 0.01)
+    print(stats.report())
+
+    MUTATION_SIGNATURES_PROFILE=1 python model_selection_new.py
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENV_VAR = 'MUTATION_SIGNATURES_PROFILE'
+
+
+class Stats:
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            total_calls, total_seconds = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (total_calls + calls, total_seconds + seconds)
+
+    def add_count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {'timers': {name: {'calls': calls, 'seconds': seconds}
+                               for name, (calls, seconds) in self.timers.items()},
+                    'counters': dict(self.counters)}
+
+    def merge(self, data):
+        for name, timer in data['timers'].items():
+            self.add_time(name, timer['seconds'], timer['calls'])
+        for name, n in data['counters'].items():
+            self.add_count(name, n)
+
+    def report(self):
+        return report(self.snapshot())
+
+
+def enabled_by_environment():
+    return os.environ.get(ENV_VAR, '0') != '0'
+
+
+# Stats collecting the current context's numbers, None when profiling is off
+_active = contextvars.ContextVar('profiling_stats', default=Stats() if enabled_by_environment() else None)
+
+
+def enabled():
+    return _active.get() is not None
+
+
+@contextmanager
+def profiling():
+    """
+    Collect timers and counters of the code inside the block into a new Stats object.
+
+    When profiling was already on (environment variable or an outer block), the numbers
+    are also added to the outer Stats on exit.
+    """
+    outer = _active.get()
+    stats = Stats()
+    token = _active.set(stats)
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+        if outer is not None:
+            outer.merge(stats.snapshot())
+
+
+@contextmanager
+def stage(name):
+    stats = _active.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    """Decorator timing every call of a function as stage 'name' (default module.function)."""
+    def decorator(func):
+        stage_name = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _active.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add_time(stage_name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    stats = _active.get()
+    if stats is not None:
+        stats.add_count(name, int(n))
+
+
+def snapshot():
+    # Numbers collected so far by the active Stats (empty when profiling is off)
+    stats = _active.get()
+    return stats.snapshot() if stats is not None else {'timers': {}, 'counters': {}}
+
+
+def merge(data):
+    # Add a snapshot taken elsewhere (e.g. by profiled_call in a worker process)
+    stats = _active.get()
+    if stats is not None:
+        stats.merge(data)
+
+
+def profiled_call(func, *args, **kwargs):
+    # Run func with profiling on (e.g. in a worker process); returns (result, snapshot of the call)
+    with profiling() as stats:
+        result = func(*args, **kwargs)
+    return result, stats.snapshot()
+
+
+def report(data=None):
+    """Summary table of a snapshot (default: the active one): stages by total time, then the counters."""
+    data = snapshot() if data is None else data
+    lines = [f"{'stage':<60} {'calls':>8} {'seconds':>10} {'mean ms':>10}"]
+    for name, timer in sorted(data['timers'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append(f"{name:<60} {timer['calls']:>8} {timer['seconds']:>10.3f} "
+                     f"{1000 * timer['seconds'] / timer['calls']:>10.3f}")
+    lines.append(f"{'counter':<60} {'value':>8}")
+    for name, n in sorted(data['counters'].items()):
+        lines.append(f'{name:<60} {n:>8}')
+    return '\n'.join(lines)
+
+
+def export(path, data=None):
+    # Snapshot as JSON, e.g. for comparing production runs
+    data = snapshot() if data is None else data
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
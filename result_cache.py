@@ -0,0 +1,150 @@
+import copy
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+from fileutils import atomic_write
+from profiling import count
+
+# Parameters that make a function random; calls leaving them at None are not cached
+RANDOM_PARAMETERS = ('rng', 'seed')
+
+
+@lru_cache(maxsize=None)
+def _source_hash(func):
+    # Hash of the source of a function, so that editing it changes the keys of its calls
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        # Built-in or compiled, e.g. a numpy function: only the name is hashed
+        return ''
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _update(h, value):
+    # Feed a description of 'value' into the hash; arrays are hashed by content
+    if isinstance(value, np.ndarray):
+        h.update(b'ndarray')
+        h.update(str(value.dtype).encode())
+        h.update(str(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(type(value).__name__.encode())
+        for item in value:
+            _update(h, item)
+        h.update(b'end')
+    elif isinstance(value, dict):
+        _update(h, sorted(value.items()))
+    elif callable(value):
+        h.update(f'{value.__module__}.{value.__qualname__}'.encode())
+        h.update(_source_hash(value).encode())
+    elif value is None or isinstance(value, (bool, int, float, str, bytes, np.generic)):
+        h.update(repr(value).encode())
+    else:
+        raise TypeError(f"Cannot build a cache key from a value of type {type(value).__name__}.")
+
+
+class ResultCache:
+    """
+    Content-addressed cache of function results.
+
+    The key of a call is a hash of the function name and source and all its bound
+    arguments, arrays included, so the same patient column, signature matrix and
+    parameters give the same key whatever variable they come from. Editing the function
+    changes its keys, but editing only the functions it calls does not: clear the disk
+    cache by hand after such a change. Results live in an in-memory LRU and, if
+    'directory' is given, also as pickles on disk, which outlive the process. The cache
+    keeps its own copies: changing a result that was put or returned leaves it unchanged.
+
+    Calls of random functions (with an 'rng' or 'seed' parameter) are only cached when
+    that parameter is set to an int, and calls with arguments that cannot be hashed
+    (e.g. a numpy Generator) are simply computed.
+
+    Examples:
+        results = ResultCache(maxsize=64, directory='output/cache')
+        exposures, errors = results.call(bootstrapSigExposures, m, P, 100, 1000, rng=0)
+    """
+
+    def __init__(self, maxsize=128, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, func, *args, **kwargs):
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        for name in RANDOM_PARAMETERS:
+            if name in bound.arguments and bound.arguments[name] is None:
+                raise TypeError(f"'{name}' must be set to cache a call of {func.__qualname__}.")
+
+        h = hashlib.sha256()
+        _update(h, func)
+        for name, value in bound.arguments.items():
+            _update(h, name)
+            _update(h, value)
+        return h.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                count('cache_hits')
+                # A copy, so a caller changing its arrays does not change the cached result
+                return True, copy.deepcopy(self._memory[key])
+
+        if self.directory is not None and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), 'rb') as f:
+                value = pickle.load(f)
+            self.put(key, value, disk=False)
+            with self._lock:
+                self.hits += 1
+            count('cache_hits')
+            return True, value
+
+        with self._lock:
+            self.misses += 1
+        count('cache_misses')
+        return False, None
+
+    def put(self, key, value, disk=True):
+        # The cache keeps its own copy of 'value'
+        stored = copy.deepcopy(value)
+        with self._lock:
+            self._memory[key] = stored
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+        if disk and self.directory is not None:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, lambda f: pickle.dump(stored, f))
+
+    def call(self, func, *args, **kwargs):
+        try:
+            key = self.key(func, *args, **kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        found, value = self.get(key)
+        if not found:
+            value = func(*args, **kwargs)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
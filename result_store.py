@@ -0,0 +1,175 @@
+"""
+Chunked binary store of per-sample results: exposures, errors, bootstrap distributions,
+p-values and selected signature sets.
+
+Layout of a store directory:
+    manifest.json          format version and signature names
+    <kind>/<shard>.npz     arrays of one chunk of samples, samples on axis 0
+    <kind>/<shard>.json    sample IDs and array shapes of that shard
+
+A kind groups the results of one computation ('exposures', 'bootstrap', 'selection', ...).
+Every append writes a new shard, first the arrays and then their index, each with an
+atomic rename, so any number of processes can append to the same store without locks
+and a reader only ever sees complete shards. Reads open only the shards holding the
+requested samples and only the requested arrays.
+
+Examples:
+    store = ResultStore('output/results', signature_names)
+    store.append_exposures(sample_ids, *findSigExposures(M, P))
+    ids, exposures = store.read('exposures', 'exposures', samples=['PD4120a'], signatures=['SBS1'])
+"""
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+from fileutils import atomic_write
+
+FORMAT_VERSION = 1
+# Arrays with signatures on axis 1, which can be read for a subset of signatures
+SIGNATURE_ARRAYS = ('exposures', 'p_values', 'selected')
+
+
+class ResultStore:
+    """
+    Append-only store of results per sample, written as npz shards with a manifest.
+
+    Parameters:
+        path (str): Directory of the store; created if it does not exist.
+        signature_names (list, optional): Names of the signatures (the columns of P).
+            Required to create a store; an existing store must have the same names.
+    """
+
+    def __init__(self, path, signature_names=None):
+        self.path = path
+        manifest_file = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+            if signature_names is not None and list(signature_names) != manifest['signature_names']:
+                raise ValueError(f"Signature names differ from those of the store in {path}.")
+        elif signature_names is None:
+            raise ValueError(f"No result store in {path}; 'signature_names' are needed to create one.")
+        else:
+            manifest = {'version': FORMAT_VERSION, 'signature_names': [str(s) for s in signature_names]}
+            os.makedirs(path, exist_ok=True)
+            atomic_write(manifest_file, lambda f: f.write(json.dumps(manifest).encode()))
+        self.signature_names = manifest['signature_names']
+
+    def _shard_path(self, kind, shard, extension):
+        return os.path.join(self.path, kind, shard + extension)
+
+    def append(self, kind, sample_ids, shard=None, **arrays):
+        """
+        Write a shard of 'kind' with one row per sample in every array.
+
+        The shard name defaults to a unique, time-ordered name; giving one (e.g. the
+        chunk number) makes the append idempotent, see 'has_shard'.
+        """
+        sample_ids = [str(s) for s in sample_ids]
+        for name, values in arrays.items():
+            if np.shape(values)[0] != len(sample_ids):
+                raise ValueError(f"Array '{name}' has {np.shape(values)[0]} rows for {len(sample_ids)} samples.")
+            if name in SIGNATURE_ARRAYS and np.shape(values)[1] != len(self.signature_names):
+                raise ValueError(f"Array '{name}' must have {len(self.signature_names)} signature columns.")
+        if shard is None:
+            shard = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+
+        os.makedirs(os.path.join(self.path, kind), exist_ok=True)
+        atomic_write(self._shard_path(kind, shard, '.npz'), lambda f: np.savez(f, **arrays))
+        entry = {'shard': shard, 'samples': sample_ids,
+                 'arrays': {name: list(np.shape(values)) for name, values in arrays.items()}}
+        atomic_write(self._shard_path(kind, shard, '.json'), lambda f: f.write(json.dumps(entry).encode()))
+        return shard
+
+    def append_exposures(self, sample_ids, exposures, errors, kind='exposures', shard=None):
+        # exposures (N, n) and errors (n,) as returned by findSigExposures
+        return self.append(kind, sample_ids, shard, exposures=np.asarray(exposures).T, errors=errors)
+
+    def append_bootstrap(self, sample_ids, exposures, errors, kind='bootstrap', shard=None):
+        # Bootstrap distributions of several samples: exposures (n, N, R) and errors (n, R),
+        # i.e. the stacked results of bootstrapSigExposures
+        exposures = np.asarray(exposures).reshape(len(sample_ids), len(self.signature_names), -1)
+        errors = np.asarray(errors).reshape(len(sample_ids), -1)
+        return self.append(kind, sample_ids, shard, exposures=exposures, errors=errors)
+
+    def append_selection(self, sample_ids, columns, kind='selection', shard=None):
+        # columns: the selected signature columns of every sample (e.g. best_columns)
+        selected = np.zeros((len(sample_ids), len(self.signature_names)), dtype=bool)
+        for row, best_columns in enumerate(columns):
+            selected[row, np.asarray(best_columns, dtype=int)] = True
+        return self.append(kind, sample_ids, shard, selected=selected)
+
+    def has_shard(self, kind, shard):
+        return os.path.exists(self._shard_path(kind, shard, '.json'))
+
+    def shards(self, kind):
+        """Index entries of all complete shards of 'kind', in shard name order."""
+        directory = os.path.join(self.path, kind)
+        if not os.path.isdir(directory):
+            return []
+        entries = []
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.json'):
+                with open(os.path.join(directory, file_name)) as f:
+                    entries.append(json.load(f))
+        return entries
+
+    def samples(self, kind):
+        return [sample for entry in self.shards(kind) for sample in entry['samples']]
+
+    def _signature_columns(self, signatures):
+        return [self.signature_names.index(s) if isinstance(s, str) else int(s) for s in signatures]
+
+    def read(self, kind, name, samples=None, signatures=None):
+        """
+        Read array 'name' of 'kind' for a subset of samples and signatures.
+
+        Parameters:
+            samples (list, optional): Sample IDs; default is all samples in shard order.
+            signatures (list, optional): Signature names or column indices, for the
+                arrays with signatures on axis 1 (see SIGNATURE_ARRAYS).
+
+        Returns:
+            tuple: (sample_ids, values) with the samples on axis 0 of 'values'.
+
+        Raises:
+            KeyError: If a requested sample is not in the store.
+        """
+        if signatures is not None and name not in SIGNATURE_ARRAYS:
+            raise ValueError(f"Array '{name}' has no signature axis.")
+        columns = None if signatures is None else self._signature_columns(signatures)
+        wanted = None if samples is None else set(str(s) for s in samples)
+
+        sample_ids, parts = [], []
+        for entry in self.shards(kind):
+            rows = [i for i, s in enumerate(entry['samples']) if wanted is None or s in wanted]
+            if not rows or name not in entry['arrays']:
+                continue
+            with np.load(self._shard_path(kind, entry['shard'], '.npz')) as data:
+                values = data[name][rows]
+            if columns is not None:
+                values = values[:, columns]
+            sample_ids.extend(entry['samples'][i] for i in rows)
+            parts.append(values)
+
+        position = {s: i for i, s in enumerate(sample_ids)}
+        missing = [s for s in (samples or []) if str(s) not in position]
+        if missing:
+            raise KeyError(f"Samples not in '{kind}': {missing}")
+        if not parts:
+            return [], np.empty((0,))
+        values = np.concatenate(parts)
+        if samples is None:
+            return sample_ids, values
+        # Requested order; a sample written twice is read from its last shard
+        order = [position[str(s)] for s in samples]
+        return [sample_ids[i] for i in order], values[order]
+
+    def selected(self, samples=None, kind='selection'):
+        """Names of the selected signatures of every sample."""
+        sample_ids, selected = self.read(kind, 'selected', samples)
+        return {sample: [self.signature_names[j] for j in np.flatnonzero(row)]
+                for sample, row in zip(sample_ids, selected)}
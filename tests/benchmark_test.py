@@ -0,0 +1,61 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import benchmark
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+GRID = {'G': [3], 'N': [6], 'R': [5], 'mutation_count': [200]}
+
+
+@mock.patch.object(benchmark, 'CATALOGUE', os.path.join(DATA, 'COSMIC_v3.4_SBS_GRCh37.txt'))
+@mock.patch.object(benchmark, 'PROFILES', os.path.join(DATA, 'M.csv'))
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def run_quiet(self, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            return benchmark.run(*args, **kwargs), stdout.getvalue()
+
+    def test_run(self):
+        for source in ('simulated', 'real'):
+            results, printed = self.run_quiet(GRID, repeat=1, source=source,
+                                              only=['decomposeQPBatch', 'bootstrapSigExposures'])
+
+            self.assertEqual([r['case'] for r in results], ['decomposeQPBatch', 'bootstrapSigExposures'])
+            for result in results:
+                self.assertGreater(result['throughput'], 0)
+                self.assertIn(benchmark._key(result), printed)
+
+    def test_output_and_compare(self):
+        path = os.path.join(self.output, 'results.json')
+        argv = ['--quick', '--repeat', '1', '--case', 'findSigExposures', '--output', path]
+        with mock.patch.object(benchmark, 'QUICK', GRID), contextlib.redirect_stdout(io.StringIO()) as stdout:
+            benchmark.main(argv)
+            benchmark.main(argv[:-2] + ['--compare', path])
+
+        self.assertTrue(os.path.exists(path))
+        self.assertRegex(stdout.getvalue(), r'findSigExposures G=3 .* +\d+\.\d+x')
+
+    def test_empty_cohort(self):
+        # Mutation type labels only, no sample columns
+        path = os.path.join(self.output, 'M.csv')
+        with open(os.path.join(DATA, 'M.csv')) as source, open(path, 'w') as f:
+            f.writelines('\t'.join(line.split('\t')[:2]) + '\n' for line in source)
+
+        with mock.patch.object(benchmark, 'PROFILES', path), self.assertRaises(ValueError):
+            self.run_quiet(GRID, repeat=1, source='real')
+        with self.assertRaises(ValueError):
+            self.run_quiet(dict(GRID, G=[0]), repeat=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
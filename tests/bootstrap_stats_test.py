@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from bootstrap_stats import BootstrapStats, QuantileSketch
+from estimates_exposures import bootstrapSigExposures, bootstrapSigExposuresStream
+from model_selection_new import compute_p_value
+from parallel import spawn_rngs
+from utils import load_and_process_data
+
+
+class TestBootstrapStats(unittest.TestCase):
+    def setUp(self):
+        profiles, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        self.m = profiles[:, 3]
+        self.P = signatures[:, :10]
+
+    def test_sketch_quantiles(self):
+        values = np.random.default_rng(0).beta(0.5, 3, size=(4, 5000))
+        sketch = QuantileSketch(4, bins=1000)
+        for block in np.split(values, 5, axis=1):
+            sketch.add(block)
+
+        q = [0, 0.025, 0.5, 0.975, 1]
+        np.testing.assert_allclose(sketch.quantiles(q), np.quantile(values, q, axis=1).T, atol=1e-3)
+
+    def test_merge(self):
+        exposures = np.random.default_rng(1).dirichlet(np.ones(10), size=300).T
+        errors = np.random.default_rng(2).random(300)
+        whole = BootstrapStats(10).add(exposures, errors)
+        merged = BootstrapStats(10).add(exposures[:, :100], errors[:100]).merge(
+            BootstrapStats(10).add(exposures[:, 100:], errors[100:]))
+
+        np.testing.assert_array_equal(merged.above, whole.above)
+        np.testing.assert_array_equal(merged.exposures.counts, whole.exposures.counts)
+        np.testing.assert_array_almost_equal(merged.mean(), exposures.mean(axis=1))
+        np.testing.assert_array_almost_equal(merged.std(), exposures.std(axis=1))
+        self.assertAlmostEqual(merged.mean_error(), errors.mean())
+
+    def test_error_quantiles(self):
+        # Errors of profiles far from every signature exceed 1
+        errors = np.random.default_rng(3).uniform(0.9, np.sqrt(2), size=1000)
+        stats = BootstrapStats(2).add(np.full((2, 1000), 0.5), errors)
+
+        np.testing.assert_allclose(stats.error_quantiles([0.5, 0.99]), np.quantile(errors, [0.5, 0.99]),
+                                   atol=np.sqrt(2) / 2000)
+
+    def test_stream(self):
+        stats = bootstrapSigExposuresStream(self.m, self.P, 250, 1000, chunk_size=100, seed=5)
+        # Chunks of 100, 100 and 50 replicates with the generators spawned from the seed
+        exposures = np.hstack([bootstrapSigExposures(self.m, self.P, size, 1000, rng=rng)[0]
+                               for size, rng in zip([100, 100, 50], spawn_rngs(5, 3))])
+
+        self.assertEqual(stats.replicates, 250)
+        np.testing.assert_array_equal(stats.p_values(), compute_p_value(exposures))
+        np.testing.assert_array_almost_equal(stats.mean(), exposures.mean(axis=1))
+
+    def test_stream_parallel(self):
+        serial = bootstrapSigExposuresStream(self.m, self.P, 200, 1000, chunk_size=50, seed=7)
+        parallel = bootstrapSigExposuresStream(self.m, self.P, 200, 1000, chunk_size=50, seed=7, n_jobs=2)
+
+        np.testing.assert_array_equal(parallel.above, serial.above)
+        np.testing.assert_array_equal(parallel.exposures.counts, serial.exposures.counts)
+        np.testing.assert_array_almost_equal(parallel.mean(), serial.mean())
+
+    def test_stream_requires_counts(self):
+        with self.assertRaises(ValueError):
+            bootstrapSigExposuresStream(self.m, self.P, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
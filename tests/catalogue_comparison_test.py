@@ -0,0 +1,91 @@
+import os
+import unittest
+
+import numpy as np
+
+from catalogue import get_catalogue
+from catalogue_comparison import (canonical_type, compare_catalogues, cohort_replicates, comparison_table,
+                                  fit_catalogues, merge_stats, row_order)
+from estimates_exposures import findSigExposures
+from utils import calculate_BIC, load_and_process_data, normalize_columns, reconstruction_errors
+
+
+class TestCatalogueComparison(unittest.TestCase):
+    def setUp(self):
+        profiles, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        self.M = np.round(profiles[:, :40] * 1000)
+        self.catalogues = {'all': signatures, 'subset': signatures[:, [0, 1, 2, 4, 12]]}
+
+    def test_table(self):
+        rows = compare_catalogues(self.M, self.catalogues)
+
+        self.assertEqual([row['bic'] for row in rows], sorted(row['bic'] for row in rows))
+        for row in rows:
+            P = self.catalogues[row['catalogue']]
+            exposures, errors = findSigExposures(self.M, P)
+            self.assertEqual(row['signatures'], P.shape[1])
+            self.assertAlmostEqual(row['bic'], calculate_BIC(self.M, exposures, errors))
+            self.assertAlmostEqual(row['error_mean'], np.mean(errors))
+
+    def test_shared_replicates(self):
+        M = normalize_columns(self.M)
+        replicates = cohort_replicates(M, 20, 1000, rng=3)
+        stats = fit_catalogues(M, self.catalogues, replicates)
+
+        # Errors of the replicates of every sample, with respect to that sample as in bootstrapSigExposures
+        P = self.catalogues['all']
+        errors = np.array([reconstruction_errors(M[:, s], P,
+                                                 findSigExposures(replicates[:, 20 * s:20 * (s + 1)], P)[0])
+                           for s in range(40)])
+        self.assertEqual(replicates.shape, (96, 40 * 20))
+        np.testing.assert_array_equal(replicates, cohort_replicates(M, 20, 1000, rng=3))
+        # Without a generator the global random state is used
+        np.random.seed(3)
+        unseeded = cohort_replicates(M, 20, 1000)
+        np.random.seed(3)
+        np.testing.assert_array_equal(unseeded, cohort_replicates(M, 20, 1000))
+        np.testing.assert_array_almost_equal(stats['all']['replicate_rss'], np.sum(errors ** 2, axis=0))
+        np.testing.assert_array_almost_equal(stats['all']['replicate_error_sum'], np.sum(errors, axis=0))
+
+        rows = comparison_table(stats)
+        self.assertAlmostEqual(sum(row['best_fraction'] for row in rows), 1)
+        for row in rows:
+            self.assertLessEqual(row['bic_low'], row['bic_high'])
+
+    def test_merge_chunks(self):
+        M = normalize_columns(self.M)
+        whole = fit_catalogues(M, self.catalogues)
+        merged = merge_stats(fit_catalogues(M[:, :15], self.catalogues), fit_catalogues(M[:, 15:], self.catalogues))
+
+        for name in self.catalogues:
+            self.assertEqual(merged[name]['samples'], 40)
+            self.assertAlmostEqual(merged[name]['rss'], whole[name]['rss'])
+        self.assertEqual(comparison_table(merged)[0]['catalogue'], comparison_table(whole)[0]['catalogue'])
+
+    def test_row_order(self):
+        types = ['A[C>A]A', 'A[C>A]C', 'C[C>G]T']
+        self.assertEqual(canonical_type('CCT>CGT'), 'C[C>G]T')
+        np.testing.assert_array_equal(row_order(['CCT>CGT', 'ACA>AAA', 'ACC>AAC'], types), [1, 2, 0])
+        self.assertIsNone(row_order([], types))
+        with self.assertRaises(ValueError):
+            row_order(['A[C>A]A', 'A[C>A]C', 'A[C>A]G'], types)
+
+    def test_profile_labels(self):
+        # The labels of ../data/M.csv match its counts: aligned, the COSMIC catalogue fits closely
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'M.csv')
+        M = normalize_columns(np.genfromtxt(path, delimiter='\t', skip_header=1, max_rows=96)[:, 2:22])
+        catalogue = get_catalogue(os.path.join(os.path.dirname(path), 'COSMIC_v3.4_SBS_GRCh37.txt'))
+        labels = np.genfromtxt(path, delimiter='\t', skip_header=1, usecols=1, dtype=str)
+        P = catalogue.signatures[row_order(list(catalogue.mutation_types), list(labels))]
+
+        self.assertLess(findSigExposures(M, P)[1].mean(), 0.01)
+
+    def test_input_checks(self):
+        rows = compare_catalogues(self.M.tolist(), self.catalogues)
+        self.assertEqual(len(rows), 2)
+        with self.assertRaises(ValueError):
+            comparison_table(merge_stats(None, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from catalogue_index import build_index, load_index, reference_name
+
+
+class TestCatalogueIndex(unittest.TestCase):
+    def setUp(self):
+        # A COSMIC catalogue and an organ catalogue mapped to it
+        self.tmp = tempfile.mkdtemp()
+        shutil.copy('../data/COSMIC_v3.4_SBS_GRCh37.txt', self.tmp)
+        os.makedirs(os.path.join(self.tmp, 'signatures_organ', 'latest'))
+        shutil.copy('../data/signatures_organ/latest/Breast_Signature.csv',
+                    os.path.join(self.tmp, 'signatures_organ', 'latest'))
+        self.index = load_index(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lookups(self):
+        index = self.index
+        self.assertEqual(index.catalogues(), ['COSMIC_v3.4_SBS_GRCh37.txt'])
+        self.assertEqual(index.organs('latest'), ['Breast'])
+        self.assertEqual(index.columns('COSMIC_v3.4_SBS_GRCh37.txt', ['SBS5', 'SBS1', 3]), [4, 0, 3])
+
+        catalogue = index.catalogue('COSMIC_v3.4_SBS_GRCh37.txt', ['SBS1', 'SBS5'])
+        self.assertEqual(catalogue.names, ('SBS1', 'SBS5'))
+        self.assertIs(catalogue, index.catalogue('COSMIC_v3.4_SBS_GRCh37.txt', [0, 4]))
+
+        # Organ signatures and their COSMIC counterparts
+        reference = index.catalogue('COSMIC_v3.4_SBS_GRCh37.txt')
+        organ = index.catalogue('Breast', version='latest')
+        columns = index.reference_columns('Breast')
+        self.assertEqual(organ.names[0], 'GEL-Breast_common_SBS13')
+        self.assertEqual(reference.names[columns[0]], 'SBS13')
+        self.assertEqual(len(columns), organ.signatures.shape[1])
+        with self.assertRaises(KeyError):
+            index.catalogue('Breast', version='version_1')
+
+    def test_cached_on_disk(self):
+        index_path = os.path.join(self.tmp, '.cache', 'catalogue_index.json')
+        self.assertTrue(os.path.exists(index_path))
+        mtime = os.path.getmtime(index_path)
+        self.assertEqual(load_index(self.tmp).index, self.index.index)
+        self.assertEqual(os.path.getmtime(index_path), mtime)
+
+        # A new catalogue is picked up
+        shutil.copy('data/signaturesCOSMIC.csv', self.tmp)
+        self.assertIn('signaturesCOSMIC.csv', load_index(self.tmp).catalogues())
+        self.assertEqual(load_index(self.tmp).index, build_index(self.tmp))
+
+    def test_reference_name(self):
+        self.assertEqual(reference_name('GEL-Breast_common_SBS13'), 'SBS13')
+        self.assertEqual(reference_name('Breast_J (RefSig 1)'), 'SBS1')
+        self.assertEqual(reference_name('Breast_A (RefSig MMR1)'), 'MMR1')
+
+    def test_catalogue_without_label_column(self):
+        # The older organ catalogues have no mutation type column; no signature is lost
+        path = os.path.join(self.tmp, 'signatures_organ', 'latest', 'Breast_Signature.csv')
+        with open(path) as f:
+            lines = [line.split(',', 1)[1] for line in f]
+        os.makedirs(os.path.join(self.tmp, 'signatures_organ', 'version_2'))
+        with open(os.path.join(self.tmp, 'signatures_organ', 'version_2', 'Breast_Signature_2.csv'), 'w') as f:
+            f.writelines(lines)
+
+        index = load_index(self.tmp)
+        self.assertEqual(index.names('Breast', 'version_2'), index.names('Breast', 'latest'))
+        np.testing.assert_array_equal(index.catalogue('Breast', version='version_2').signatures,
+                                      index.catalogue('Breast', version='latest').signatures)
+
+
+if __name__ == '__main__':
+    unittest.main()
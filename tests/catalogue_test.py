@@ -0,0 +1,76 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from catalogue import MappedCatalogue, get_catalogue, load_catalogue, read_catalogue
+from model_selection import runBootstrapOnMatrix
+
+
+class TestCatalogue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'signaturesCOSMIC.csv')
+        shutil.copy('data/signaturesCOSMIC.csv', self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_load_matches_text(self):
+        signatures, names, mutation_types = load_catalogue(self.path)
+        expected, expected_names, expected_types = read_catalogue(self.path)
+
+        self.assertIsInstance(signatures, np.memmap)
+        self.assertFalse(signatures.flags.writeable)
+        np.testing.assert_array_equal(signatures, expected)
+        self.assertEqual(names, expected_names)
+        self.assertEqual(mutation_types, expected_types)
+
+    def test_rebuild_when_source_changes(self):
+        signatures, _, _ = load_catalogue(self.path)
+        self.assertEqual(signatures.shape[1], 65)
+
+        with open(self.path) as f:
+            lines = f.readlines()
+        # Keep only the first two signatures
+        with open(self.path, 'w') as f:
+            f.writelines(','.join(line.split(',')[:3]) + '\n' for line in lines)
+
+        signatures, names, _ = load_catalogue(self.path)
+        self.assertEqual(signatures.shape[1], 2)
+        self.assertEqual(names, ['0', '1'])
+
+    def test_pickled_as_path(self):
+        signatures, _, _ = load_catalogue(self.path)
+        copy = pickle.loads(pickle.dumps(signatures))
+
+        # Only the path of the cache file is pickled; slices and results are plain arrays
+        self.assertLess(len(pickle.dumps(signatures)), 1000)
+        self.assertIsInstance(copy, MappedCatalogue)
+        np.testing.assert_array_equal(copy, signatures)
+        self.assertIs(type(signatures[:, :3]), np.ndarray)
+        self.assertIs(type(signatures * 2), np.ndarray)
+        np.testing.assert_array_equal(pickle.loads(pickle.dumps(signatures[:, :3])), signatures[:, :3])
+
+    def test_workers_map_the_catalogue(self):
+        signatures, _, _ = load_catalogue(self.path)
+        M = np.random.default_rng(0).multinomial(1000, signatures[:, :4].mean(axis=1), size=3).T
+
+        np.testing.assert_array_equal(runBootstrapOnMatrix(M, signatures, 10, 1000, n_jobs=2, seed=0),
+                                      runBootstrapOnMatrix(M, np.array(signatures), 10, 1000, seed=0))
+
+    def test_registry(self):
+        catalogue = get_catalogue(self.path, columns=[0, 2, 5])
+
+        self.assertIs(catalogue, get_catalogue(self.path, columns=[0, 2, 5]))
+        self.assertEqual(catalogue.signatures.shape, (96, 3))
+        self.assertEqual(catalogue.names, ('0', '2', '5'))
+        np.testing.assert_array_almost_equal(catalogue.gram, catalogue.signatures.T @ catalogue.signatures)
+        self.assertIsNot(catalogue, get_catalogue(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
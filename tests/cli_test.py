@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cli import build_parser, main, run
+from estimates_exposures import findSigExposures
+from result_store import ResultStore
+from utils import calculate_BIC, load_and_process_data
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def run_command(self, *argv):
+        return run(build_parser().parse_args(list(argv) + ['-o', self.output]))
+
+    def test_fit(self):
+        output_file = self.run_command('fit', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv',
+                                       '--chunk-size', '200')
+        profile, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        exposures, errors = findSigExposures(profile, signatures)
+
+        result = np.genfromtxt(output_file, delimiter=',', skip_header=1)[:, 1:]
+        np.testing.assert_array_almost_equal(result[:, :-1].T, exposures, decimal=8)
+        np.testing.assert_array_almost_equal(result[:, -1], errors, decimal=8)
+
+    def test_store_format(self):
+        path = self.run_command('fit', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv',
+                                '--chunk-size', '200', '--format', 'store')
+        profile, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        exposures, errors = findSigExposures(profile, signatures)
+
+        store = ResultStore(path)
+        self.assertEqual(len(store.shards('fit')), -(-profile.shape[1] // 200))
+        _, stored = store.read('fit', 'exposures')
+        np.testing.assert_array_almost_equal(stored.T, exposures, decimal=12)
+
+    def test_profile(self):
+        profile_file = os.path.join(self.output, 'profile.json')
+        main(['fit', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv', '-o', self.output,
+              '--profile', profile_file])
+
+        profile, _ = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+
+        with open(profile_file) as f:
+            counters = json.load(f)['counters']
+        self.assertEqual(counters['qp_solves'], profile.shape[1])
+
+    def test_resume(self):
+        argv = ['bootstrap', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv', '--chunk-size', '200',
+                '-R', '5', '--mutation-count', '500', '--seed', '7']
+        output_file = self.run_command(*argv)
+        with open(output_file) as f:
+            expected = f.read()
+
+        os.remove(os.path.join(self.output, 'bootstrap', 'chunk_00001.csv'))
+        self.run_command(*argv, '--resume')
+        with open(output_file) as f:
+            self.assertEqual(f.read(), expected)
+        # Another seed would continue with other random numbers
+        with self.assertRaises(SystemExit):
+            self.run_command(*argv[:-1], '8', '--resume')
+
+    def test_tab_separated_csv(self):
+        # data/M.csv is tab separated despite its extension
+        tab_file = os.path.join(self.output, 'tab.csv')
+        with open('data/tumorBRCA.csv') as f, open(tab_file, 'w') as out:
+            out.writelines(line.replace(',', '\t') for line in f)
+
+        result = np.genfromtxt(self.run_command('fit', tab_file, 'data/signaturesCOSMIC.csv'), delimiter=',')
+        expected = np.genfromtxt(self.run_command('fit', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv'),
+                                 delimiter=',')
+        self.assertEqual(result.shape, expected.shape)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_compare(self):
+        # The catalogue against the same catalogue without its first 10 signatures
+        subset = os.path.join(self.output, 'subset.csv')
+        with open('data/signaturesCOSMIC.csv') as f, open(subset, 'w') as out:
+            out.writelines(','.join(line.split(',')[:1] + line.split(',')[11:]) for line in f)
+
+        output_file = self.run_command('compare', 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv', subset,
+                                       '--chunk-size', '200', '-R', '3', '--mutation-count', '500', '--seed', '7')
+        with open(output_file) as f:
+            header = f.readline().strip().split(',')
+            rows = [dict(zip(header, line.strip().split(','))) for line in f]
+
+        profile, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        exposures, errors = findSigExposures(profile, signatures)
+        full = next(row for row in rows if row['catalogue'] == 'data/signaturesCOSMIC.csv')
+        self.assertEqual(len(rows), 2)
+        self.assertAlmostEqual(float(full['bic']), calculate_BIC(profile, exposures, errors), places=6)
+        self.assertAlmostEqual(sum(float(row['best_fraction']) for row in rows), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
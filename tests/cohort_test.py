@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from estimates_exposures import findSigExposures
+from utils import load_and_process_data
+from web.cohort import cohort_tasks, downsample, page, prevalence
+
+
+class TestCohort(unittest.TestCase):
+    def test_cohort_tasks(self):
+        profiles, signatures = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        counts = np.round(profiles[:, :7] * 500)
+
+        func, tasks, kwargs, combine = cohort_tasks(counts, signatures, 5, seed=0, chunk_size=3)
+        exposures, errors, p_values = combine([func(*args, **kw) for args, kw in zip(tasks, kwargs)])
+
+        self.assertEqual(len(tasks), 3)
+        self.assertEqual(p_values.shape, (signatures.shape[1], 7))
+        np.testing.assert_array_almost_equal(exposures, findSigExposures(counts, signatures)[0])
+        self.assertEqual(prevalence(p_values).shape, (signatures.shape[1],))
+
+    def test_page_and_downsample(self):
+        values = np.arange(2 * 250.).reshape(2, 250)
+
+        last, columns = page(values, 2)
+        np.testing.assert_array_equal(columns, np.arange(200, 250))
+        np.testing.assert_array_equal(last, values[:, 200:])
+
+        means, starts = downsample(values, max_columns=100)
+        self.assertEqual(means.shape, (2, 100))
+        self.assertEqual(means[0, 0], values[0, :starts[1]].mean())
+        self.assertIs(downsample(values, max_columns=300)[0], values)
+
+
+if __name__ == '__main__':
+    unittest.main()
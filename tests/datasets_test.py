@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from web.datasets import DatasetRegistry, dataset_key
+
+
+class TestDatasetRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = DatasetRegistry(self.directory, idle_seconds=60)
+        self.data = np.arange(12.).reshape(4, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        key = self.registry.put(dataset_key('data:text/csv;base64,AAAA'), self.data, ['a', 'b', 'c'], 'M.csv')
+        data, patients = self.registry.get(key)
+
+        self.assertIn(key, self.registry)
+        self.assertIsInstance(data, np.memmap)
+        np.testing.assert_array_equal(data, self.data)
+        np.testing.assert_array_equal(patients, ['a', 'b', 'c'])
+
+    def test_evict_idle(self):
+        self.registry.put('old', self.data, ['a', 'b', 'c'])
+        self.registry.put('recent', self.data, ['a', 'b', 'c'])
+        self.registry.get('recent')
+
+        self.assertEqual(self.registry.evict_idle(now=time.time() + 30), [])
+        # 'old' was last used two minutes ago
+        past = time.time() - 120
+        for path in (os.path.join(self.directory, 'old.npy'), os.path.join(self.directory, 'old.json')):
+            os.utime(path, (past, past))
+        self.assertEqual(self.registry.evict_idle(), ['old'])
+        self.assertNotIn('old', self.registry)
+        with self.assertRaises(KeyError):
+            self.registry.get('old')
+
+
+if __name__ == '__main__':
+    unittest.main()
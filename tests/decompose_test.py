@@ -1,7 +1,9 @@
 import numpy as np
 import unittest
 
-from decompose import decomposeQP, decomposeQPScipy
+from decompose import (decomposeQP, decomposeQPScipy, decomposeQPBatch, ActiveSetQP, decomposeFISTABatch,
+                       decomposeActiveSetBatch, get_solver, project_simplex)
+from estimates_exposures import findSigExposures
 from utils import load_and_process_data
 
 class TestDecomposeQP(unittest.TestCase):
@@ -27,6 +29,104 @@ class TestDecomposeQP(unittest.TestCase):
 
         np.testing.assert_array_almost_equal(exposuresFast, exposuresSlow, decimal=4)
 
+    def test_decomposeQPBatch(self):
+        profiles, signaturesCOSMIC = (
+            load_and_process_data(patient_index=None,
+                                  mutational_profiles='data/tumorBRCA.csv',
+                                  predf_mutational_signatures='data/signaturesCOSMIC.csv'))
+        profiles = profiles[:, :20] / profiles[:, :20].sum(axis=0)
+
+        exposuresBatch = decomposeQPBatch(profiles, signaturesCOSMIC)
+        exposuresSingle = np.column_stack([decomposeQP(profiles[:, i], signaturesCOSMIC)
+                                           for i in range(profiles.shape[1])])
+
+        np.testing.assert_array_almost_equal(exposuresBatch, exposuresSingle, decimal=10)
+
+    def test_active_set_drop(self):
+        profiles, signaturesCOSMIC = (
+            load_and_process_data(patient_index=None,
+                                  mutational_profiles='data/tumorBRCA.csv',
+                                  predf_mutational_signatures='data/signaturesCOSMIC.csv'))
+        profiles = profiles[:, :20] / profiles[:, :20].sum(axis=0)
+
+        solver = ActiveSetQP(profiles, signaturesCOSMIC)
+        columns = np.arange(signaturesCOSMIC.shape[1])
+        np.testing.assert_array_almost_equal(solver.solve(),
+                                             decomposeQPBatch(profiles, signaturesCOSMIC), decimal=10)
+
+        # Drop signatures that carry most of the exposure, so the warm start has to move
+        for _ in range(5):
+            j = int(np.argmax(solver.solve().sum(axis=1)))
+            solver.drop(j)
+            columns = np.delete(columns, j)
+            np.testing.assert_array_almost_equal(
+                solver.solve(), decomposeQPBatch(profiles, signaturesCOSMIC[:, columns]), decimal=10)
+
+    def test_fista_reference(self):
+        M = np.array([[0.5, 0.3, 0.2], [0.9, 0.05, 0.05], [0.7, 0.1, 0.2]])
+        P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+
+        exposures, info = decomposeFISTABatch(M / M.sum(axis=0), P, return_info=True)
+        #data obtaining from R code
+        expected_exposures = np.array([
+            [0.2007233, 0.4317862, 0.6437908],
+            [0.4755877, 0.2883263, 0.0000000],
+            [0.3236890, 0.2798875, 0.3562092]
+        ])
+
+        self.assertTrue(info.converged.all())
+        np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
+
+    def test_fista_matches_quadprog(self):
+        profiles, signaturesCOSMIC = (
+            load_and_process_data(patient_index=None,
+                                  mutational_profiles='data/tumorBRCA.csv',
+                                  predf_mutational_signatures='data/signaturesCOSMIC.csv'))
+        profiles = profiles[:, :50] / profiles[:, :50].sum(axis=0)
+
+        exposures, info = decomposeFISTABatch(profiles, signaturesCOSMIC, return_info=True)
+
+        self.assertTrue(np.all(info.gap <= 1e-12))
+        np.testing.assert_array_almost_equal(exposures, decomposeQPBatch(profiles, signaturesCOSMIC), decimal=7)
+        # Without enough iterations the diagnostics say so
+        _, info = decomposeFISTABatch(profiles, signaturesCOSMIC, max_iter=5, return_info=True)
+        self.assertFalse(info.converged.any())
+
+    def test_active_set_batch(self):
+        profiles, signaturesCOSMIC = (
+            load_and_process_data(patient_index=None,
+                                  mutational_profiles='data/tumorBRCA.csv',
+                                  predf_mutational_signatures='data/signaturesCOSMIC.csv'))
+        rng = np.random.default_rng(0)
+        m = profiles[:, 5] / profiles[:, 5].sum()
+        # Replicates with many mutations share a few supports, those with few mostly fall back to quadprog
+        for mutation_count in (100000, 1000):
+            replicates = rng.multinomial(mutation_count, m, size=200).T / mutation_count
+            expected = decomposeQPBatch(replicates, signaturesCOSMIC)
+
+            np.testing.assert_array_almost_equal(
+                decomposeActiveSetBatch(replicates, signaturesCOSMIC), expected, decimal=10)
+        np.testing.assert_array_almost_equal(
+            decomposeActiveSetBatch(replicates, signaturesCOSMIC, max_supports=0), expected, decimal=10)
+
+    def test_project_simplex(self):
+        V = np.random.default_rng(0).normal(size=(6, 20))
+        projected = project_simplex(V)
+
+        np.testing.assert_array_almost_equal(projected.sum(axis=0), np.ones(20))
+        self.assertTrue(np.all(projected >= 0))
+        np.testing.assert_array_almost_equal(project_simplex(projected), projected, decimal=15)
+
+    def test_solver_registry(self):
+        M = np.array([[50., 30., 20.], [90., 5., 5.], [70., 10., 20.]])
+        P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+
+        self.assertIs(get_solver('quadprog'), decomposeQP)
+        np.testing.assert_array_almost_equal(findSigExposures(M, P, 'fista')[0], findSigExposures(M, P)[0])
+        np.testing.assert_array_almost_equal(findSigExposures(M, P, 'active-set')[0], findSigExposures(M, P)[0])
+        with self.assertRaises(ValueError):
+            findSigExposures(M, P, 'simplex')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from estimates_exposures import *
-from utils import load_and_process_data
+import io
+from utils import load_and_process_data, iter_profile_chunks
 
 class TestEstimateExposures(unittest.TestCase):
     def test_findSigExposures(self):
@@ -34,15 +35,63 @@ class TestEstimateExposures(unittest.TestCase):
 
         np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
         np.testing.assert_array_almost_equal(errors, expected_errors, decimal=7)
+
+    def test_findSigExposuresStream(self):
+        profile, signatures = load_and_process_data(None,
+                                                    'data/tumorBRCA.csv',
+                                                    'data/signaturesCOSMIC.csv')
+        exposures_file, errors_file = io.StringIO(), io.StringIO()
+
+        n = findSigExposuresStream(iter_profile_chunks('data/tumorBRCA.csv', chunk_size=100), signatures,
+                                   exposures_file, errors_file)
+        exposures, errors = findSigExposures(profile, signatures)
+
+        self.assertEqual(n, profile.shape[1])
+        streamed = np.genfromtxt(io.StringIO(exposures_file.getvalue()), delimiter=',', skip_header=1)[:, 1:]
+        streamed_errors = np.genfromtxt(io.StringIO(errors_file.getvalue()), delimiter=',', skip_header=1)[:, 1]
+        np.testing.assert_array_almost_equal(streamed.T, exposures, decimal=12)
+        np.testing.assert_array_almost_equal(streamed_errors, errors, decimal=12)
+
+    def test_findSigExposures_float32(self):
+        M = np.array([[0.5, 0.3, 0.2], [0.9, 0.05, 0.05], [0.7, 0.1, 0.2]], dtype=np.float32)
+        P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+
+        exposures, errors = findSigExposures(M, P, dtype=np.float32, inplace=True)
+        # data obtaining from R code, within the documented float32 accuracy
+        expected_exposures = np.array([
+            [0.2007233, 0.4317862, 0.6437908],
+            [0.4755877, 0.2883263, 0.0000000],
+            [0.3236890, 0.2798875, 0.3562092]
+        ])
+        expected_errors = np.array([0.1245907, 0.4137049, 0.1939068])
+
+        self.assertEqual((exposures.dtype, errors.dtype), (np.float32, np.float32))
+        np.testing.assert_array_almost_equal(M.sum(axis=0), np.ones(3))
+        np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=5)
+        np.testing.assert_array_almost_equal(errors, expected_errors, decimal=5)
+
+    def test_findSigExposures_sparse(self):
+        profile, signatures = load_and_process_data(None,
+                                                    'data/tumorBRCA.csv',
+                                                    'data/signaturesCOSMIC.csv')
+        counts = np.round(profile * 100)
+
+        exposures, errors = findSigExposures(counts, signatures)
+        sparse_exposures, sparse_errors = findSigExposures(sparse.csc_matrix(counts), signatures)
+
+        np.testing.assert_array_almost_equal(sparse_exposures, exposures, decimal=10)
+        np.testing.assert_array_almost_equal(sparse_errors, errors, decimal=8)
+
+
 class TestBootstrapSigExposures(unittest.TestCase):
     def test_bootstrap_sample(self):
         m = np.array([0.5, 0.3, 0.2])
         P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
 
         expected_exposures = np.array(
-            [[0.1025316, 0.2443038, 0.0481013],
-            [0.664557, 0.4797468, 0.7065823],
-            [0.2329114, 0.2759494, 0.2453165]]
+            [[0.2113924, 0., 0.1417722],
+            [0.5205063, 0.78, 0.5951899],
+            [0.2681013, 0.22, 0.263038]]
         )
 
         np.random.seed(42)
@@ -51,6 +100,16 @@ class TestBootstrapSigExposures(unittest.TestCase):
 
         np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
 
+    def test_bootstrap_generator(self):
+        m = np.array([0.5, 0.3, 0.2])
+        P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+
+        exposures1, errors1 = bootstrapSigExposures(m, P, 5, 100, rng=np.random.default_rng(7))
+        exposures2, errors2 = bootstrapSigExposures(m, P, 5, 100, rng=np.random.default_rng(7))
+
+        np.testing.assert_array_equal(exposures1, exposures2)
+        np.testing.assert_array_equal(errors1, errors2)
+
 
 class TestCrossValidationSigExposures(unittest.TestCase):
 
@@ -67,5 +126,20 @@ class TestCrossValidationSigExposures(unittest.TestCase):
         exposures, errors = crossValidationSigExposures(m, P, fold_size=1)
         np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
 
+    def test_crossvalidation_masked(self):
+        profile, signatures = load_and_process_data(0, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+
+        exposures, errors = crossValidationSigExposures(profile, signatures, fold_size=10, rng=0,
+                                                        repeats=2, mask_signatures=True)
+        # 10 folds per repeat
+        self.assertEqual(exposures.shape, (signatures.shape[1], 20))
+
+        # Every fold solved on the rows that are kept
+        masks = cross_validation_masks(96, 10, repeats=2, rng=np.random.default_rng(0))
+        m = profile / profile.sum()
+        for i, mask in enumerate(masks):
+            expected = decomposeQP(m[~mask] / m[~mask].sum(), signatures[~mask])
+            np.testing.assert_array_almost_equal(exposures[:, i], expected, decimal=8)
+
 if __name__ == '__main__':
     unittest.main()
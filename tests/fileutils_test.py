@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fileutils import atomic_write
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write(self):
+        atomic_write(self.path, lambda f: f.write('first'), mode='w')
+        atomic_write(self.path, lambda f: f.write(b'second'))
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'second')
+        self.assertEqual(os.listdir(self.directory), ['file.txt'])
+
+    def test_failed_write(self):
+        atomic_write(self.path, lambda f: f.write(b'kept'))
+
+        def fail(f):
+            f.write(b'partial')
+            raise RuntimeError('interrupted')
+
+        with self.assertRaises(RuntimeError):
+            atomic_write(self.path, fail)
+        # The old content is kept and the temporary file removed
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'kept')
+        self.assertEqual(os.listdir(self.directory), ['file.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
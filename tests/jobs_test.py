@@ -0,0 +1,91 @@
+import time
+import unittest
+from concurrent.futures import CancelledError
+from unittest import mock
+
+import numpy as np
+
+from estimates_exposures import findSigExposures
+from result_cache import ResultCache
+from web.jobs import JobManager, bootstrap_chunks
+
+
+def _wait(jobs, job_id):
+    while jobs.status(job_id)['state'] == 'running':
+        time.sleep(0.01)
+    return jobs.status(job_id)
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.m = np.array([50., 30., 20.])
+        self.P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+        self.jobs = JobManager(max_workers=2, cache=ResultCache())
+
+    def tearDown(self):
+        self.jobs.shutdown()
+
+    def test_submit_and_cache(self):
+        job_id = self.jobs.submit(findSigExposures, self.m.reshape(-1, 1), self.P)
+
+        self.assertEqual(_wait(self.jobs, job_id), {'state': 'done', 'progress': 1.0})
+        exposures, _ = self.jobs.result(job_id)
+        np.testing.assert_array_almost_equal(exposures, findSigExposures(self.m.reshape(-1, 1), self.P)[0])
+        # The same call is served from the cache without a worker
+        cached = self.jobs.submit(findSigExposures, self.m.reshape(-1, 1), self.P)
+        self.assertEqual(self.jobs.status(cached)['state'], 'done')
+
+    def test_bootstrap_chunks(self):
+        job_id = self.jobs.submit_tasks(*bootstrap_chunks(self.m, self.P, 25, 100, seed=0))
+
+        self.assertEqual(_wait(self.jobs, job_id)['state'], 'done')
+        exposures, errors = self.jobs.result(job_id)
+        self.assertEqual((exposures.shape, errors.shape), ((3, 25), (25,)))
+
+    def test_cancel(self):
+        job_id = self.jobs.submit_tasks(time.sleep, [(0.2,)] * 6)
+        job = self.jobs.get(job_id)
+        self.jobs.cancel(job_id)
+
+        # The tasks not started yet are cancelled, and the job produces no result
+        self.assertTrue(any(future.cancelled() for future in job.futures))
+        self.assertEqual(job.state, 'cancelled')
+        with self.assertRaises(CancelledError):
+            job.result()
+        self.assertEqual(self.jobs.status(job_id)['state'], 'missing')
+        with self.assertRaises(KeyError):
+            self.jobs.result(job_id)
+
+    def test_cached_once_when_done(self):
+        cache = mock.Mock(wraps=ResultCache())
+        jobs = JobManager(max_workers=1, cache=cache)
+        try:
+            job_id = jobs.submit(findSigExposures, self.m.reshape(-1, 1), self.P)
+            _wait(jobs, job_id)
+            for _ in range(3):
+                jobs.result(job_id)
+        finally:
+            jobs.shutdown()
+
+        self.assertEqual(cache.put.call_count, 1)
+
+    def test_finished_jobs_evicted(self):
+        jobs = JobManager(max_workers=1, max_finished=2, ttl=60)
+        try:
+            ids = [jobs.submit(findSigExposures, self.m.reshape(-1, 1), self.P) for _ in range(3)]
+            for job_id in ids:
+                _wait(jobs, job_id)
+            # Evicted when a job is added: the least recently used beyond max_finished, and
+            # those not looked up for ttl seconds
+            jobs.submit_tasks(time.sleep, [(0,)])
+            self.assertEqual([jobs.status(job_id)['state'] for job_id in ids], ['missing', 'done', 'done'])
+
+            jobs.ttl = 0
+            jobs.submit_tasks(time.sleep, [(0,)])
+            self.assertEqual([jobs.status(job_id)['state'] for job_id in ids], ['missing'] * 3)
+        finally:
+            jobs.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import numpy as np
+import unittest
+from unittest import mock
+
+from model_selection import (backward_elimination, forward_elimination, runBootstrapOnMatrix,
+                             runCrossvaldiationOnMatrix, runSequentialBootstrapOnMatrix)
+import model_selection_cv
+import model_selection_new
+from decompose import decomposeQPBatch
+from utils import load_and_process_data, reconstruction_errors
+
+
+class TestParallelModelSelection(unittest.TestCase):
+    def setUp(self):
+        profiles, self.signatures = load_and_process_data(None,
+                                                          'data/tumorBRCA.csv',
+                                                          'data/signaturesCOSMIC.csv')
+        self.profiles = profiles[:, :4]
+
+    def test_bootstrap_parallel_matches_serial(self):
+        serial = runBootstrapOnMatrix(self.profiles, self.signatures, 20, 1000,
+                                      seed=123, chunk_size=7)
+        parallel = runBootstrapOnMatrix(self.profiles, self.signatures, 20, 1000,
+                                        n_jobs=2, seed=123, chunk_size=7)
+
+        self.assertEqual(serial.shape, (self.signatures.shape[1], 4))
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_crossvalidation_parallel_matches_serial(self):
+        serial = runCrossvaldiationOnMatrix(self.profiles, self.signatures, seed=5)
+        parallel = runCrossvaldiationOnMatrix(self.profiles, self.signatures, n_jobs=2, seed=5)
+
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_single_patient(self):
+        p_values = runBootstrapOnMatrix(self.profiles[:, 0], self.signatures, 10, 1000, seed=1)
+
+        self.assertEqual(p_values.shape, (self.signatures.shape[1],))
+
+    def test_seeded_elimination_ignores_global_state(self):
+        # Ties are broken with the seeded generators, never with the global random state
+        with mock.patch('numpy.random.choice', side_effect=AssertionError('global random state used')):
+            serial, _, _ = backward_elimination(self.profiles[:, 0], self.signatures, 10, 0.01, 1000, 0.01, seed=3)
+            parallel, _, _ = backward_elimination(self.profiles[:, 0], self.signatures, 10, 0.01, 1000, 0.01,
+                                                  n_jobs=2, seed=3)
+            shared, _, _ = model_selection_new.backward_elimination(self.profiles[:, 0], self.signatures, 10,
+                                                                    0.01, 1000, 0.01, rng=3)
+
+        self.assertLess(len(serial), self.signatures.shape[1])
+        self.assertLess(len(shared), self.signatures.shape[1])
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_unseeded_elimination_uses_global_state(self):
+        m = self.profiles[:, 0]
+        for select in (lambda: backward_elimination(m, self.signatures, 10, 0.01, 1000, 0.01)[0],
+                       lambda: model_selection_cv.backward_elimination(m, self.signatures, 10, 0.01, 0.01)[0],
+                       lambda: model_selection_new.backward_elimination(m, self.signatures, 10, 0.01, 1000,
+                                                                        0.01)[0]):
+            selections = []
+            for _ in range(2):
+                np.random.seed(1)
+                selections.append(select())
+
+            np.testing.assert_array_equal(selections[0], selections[1])
+
+
+class TestSharedReplicatesSelection(unittest.TestCase):
+    def setUp(self):
+        profiles, self.signatures = load_and_process_data(None,
+                                                          'data/tumorBRCA.csv',
+                                                          'data/signaturesCOSMIC.csv')
+        self.m = profiles[:, 0]
+
+    def test_forward_elimination(self):
+        best_columns, (exposures, _), _ = model_selection_new.forward_elimination(
+            self.m, self.signatures, 50, 0.01, 1000, 0.01, rng=0)
+
+        self.assertGreater(len(best_columns), 1)
+        self.assertEqual(len(set(best_columns)), len(best_columns))
+        self.assertEqual(exposures.shape, (len(best_columns), 50))
+
+    def test_forward_elimination_screening(self):
+        # Screening the candidates from the current model selects what solving every candidate does
+        M = model_selection_new.bootstraped_patient(self.m, 1000, 50, np.random.default_rng(0))
+        best_columns, _, _ = model_selection_new.forward_elimination(
+            self.m, self.signatures, 50, 0.01, 1000, 0.01, rng=0)
+
+        selected = []
+        for chosen in best_columns:
+            scores = {}
+            for i in set(range(self.signatures.shape[1])) - set(selected):
+                P = self.signatures[:, selected + [i]]
+                exposures = decomposeQPBatch(M, P)
+                errors = reconstruction_errors(M, P, exposures)
+                p_value = model_selection_new.compute_p_value(exposures[-1:])[0]
+                if p_value < 0.01:
+                    scores[i] = (p_value, errors.mean())
+            self.assertEqual(chosen, min(scores, key=scores.get))
+            selected.append(chosen)
+
+    def test_delegated_forward_elimination(self):
+        best_columns, _, _ = forward_elimination(self.m, self.signatures, 50, 0.01, 1000, 0.01, seed=0)
+        shared, _, _ = model_selection_new.forward_elimination(self.m, self.signatures, 50, 0.01, 1000, 0.01, rng=0)
+
+        np.testing.assert_array_equal(best_columns, shared)
+
+    def test_bulk_drop(self):
+        # Dropping several signatures at once changes the other p-values, so the result may
+        # differ from removing them one by one; check what holds on the shared replicates
+        M = model_selection_new.bootstraped_patient(self.m, 1000, 50, np.random.default_rng(0))
+        exposures, _ = model_selection_new.findSigExposures(M, self.signatures)
+        clearly_absent = np.where(model_selection_new.compute_p_value(exposures) >= 0.99)[0]
+
+        kept, _, _ = model_selection_new.backward_elimination(
+            self.m, self.signatures, 50, 0.01, 1000, 0.01, rng=0, drop_level=0.99)
+        exposures, _ = model_selection_new.findSigExposures(M, self.signatures[:, kept])
+
+        self.assertGreater(len(clearly_absent), 0)
+        self.assertFalse(set(clearly_absent) & set(kept))
+        self.assertTrue(np.all(model_selection_new.compute_p_value(exposures) <= 0.01))
+
+    def test_sequential_p_values(self):
+        M = model_selection_new.bootstraped_patient(self.m, 1000, 400, np.random.default_rng(0))
+        exposures, _ = model_selection_new.findSigExposures(M, self.signatures)
+        full = model_selection_new.compute_p_value(exposures)
+
+        p_values, used = model_selection_new.sequential_p_values(M, self.signatures, batch_size=50)
+
+        # Absent signatures are decided after the first batch
+        self.assertEqual(used[full == 1].max(), 50)
+        np.testing.assert_array_almost_equal(p_values[used == 400], full[used == 400])
+
+    def test_sequential_bootstrap_on_matrix(self):
+        p_values, used = runSequentialBootstrapOnMatrix(self.m, self.signatures, 200, 1000, seed=0)
+
+        self.assertEqual(p_values.shape, used.shape)
+        self.assertTrue(np.all((used >= 50) & (used <= 200)))
+        with self.assertRaises(ValueError):
+            backward_elimination(self.m, self.signatures, 200, 0.01, 1000, 0.01, adaptive=True, chunk_size=50)
+
+    def test_sequential_p_values_stop_at_max(self):
+        M = model_selection_new.bootstraped_patient(self.m, 1000, 1000, np.random.default_rng(0))
+        exposures, _ = model_selection_new.findSigExposures(M, self.signatures)
+        full = model_selection_new.compute_p_value(exposures)
+
+        p_values, used = model_selection_new.sequential_p_values(M, self.signatures, stop_at_max=True)
+
+        # Stops early with a signature that all replicates also put above the level, and
+        # one whose p-value is within the intervals of the largest
+        best = np.argmax(p_values)
+        self.assertLess(used.max(), 1000)
+        self.assertGreater(full[best], 0.01)
+        lower, _ = model_selection_new.p_value_bounds(p_values * used, used)
+        self.assertGreaterEqual(full.max(), lower[best])
+
+    def test_adaptive_backward_elimination(self):
+        # The adaptive path may remove other signatures among those whose p-values cannot
+        # be told apart, but it ends in a model where every signature is significant
+        M = model_selection_new.bootstraped_patient(self.m, 1000, 200, np.random.default_rng(0))
+        fixed, _, _ = model_selection_new.backward_elimination(self.m, self.signatures, 200, 0.01, 1000, 0.01,
+                                                               rng=0)
+        adaptive, _, _ = model_selection_new.backward_elimination(self.m, self.signatures, 200, 0.01, 1000, 0.01,
+                                                                  rng=0, adaptive=True)
+        exposures, _ = model_selection_new.findSigExposures(M, self.signatures[:, adaptive])
+
+        self.assertTrue(np.all(model_selection_new.compute_p_value(exposures) <= 0.01))
+        np.testing.assert_array_equal(np.sort(adaptive), np.sort(fixed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import importlib
+import os
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import model_selection_new
+import profiling
+from decompose import ActiveSetQP, decomposeQPBatch
+from estimates_exposures import bootstrapSigExposures, findSigExposures
+from model_selection import runBootstrapOnMatrix
+from utils import load_and_process_data
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        profiles, self.P = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        self.M = profiles[:, :3]
+
+    def test_counters_and_timers(self):
+        with profiling.profiling() as stats:
+            findSigExposures(self.M, self.P)
+            bootstrapSigExposures(self.M[:, 0], self.P, 20, 1000, rng=0)
+        data = stats.snapshot()
+
+        self.assertEqual(data['counters']['qp_solves'], 3 + 20)
+        self.assertEqual(data['counters']['bootstrap_replicates'], 20)
+        self.assertEqual(data['timers']['estimates_exposures.findSigExposures']['calls'], 1)
+        self.assertIn('decompose.decomposeQPGram', stats.report())
+
+    def test_active_set_fallback_counted_once(self):
+        M = self.M / self.M.sum(axis=0)
+        solver = ActiveSetQP(M, self.P)
+        # Every column falls back to quadprog
+        with mock.patch('decompose._chol_solve', side_effect=np.linalg.LinAlgError), \
+                profiling.profiling() as stats:
+            exposures = solver.solve()
+
+        self.assertEqual(stats.counters['qp_solves'], 3)
+        np.testing.assert_array_almost_equal(exposures, decomposeQPBatch(M, self.P))
+
+    def test_disabled(self):
+        # Off by default, whatever the environment of the test run
+        with mock.patch.dict(os.environ, {profiling.ENV_VAR: '0'}):
+            importlib.reload(profiling)
+        self.addCleanup(importlib.reload, profiling)
+
+        self.assertFalse(profiling.enabled())
+        findSigExposures(self.M, self.P)
+
+        self.assertEqual(profiling.snapshot(), {'timers': {}, 'counters': {}})
+
+    def test_nested_and_elimination(self):
+        with profiling.profiling() as outer:
+            with profiling.profiling() as inner:
+                model_selection_new.backward_elimination(self.M[:, 0], self.P, 20, 0.01, 1000, 0.01, rng=0)
+
+        self.assertGreater(inner.counters['elimination_iterations'], 1)
+        self.assertEqual(outer.snapshot(), inner.snapshot())
+
+    def test_threads_are_isolated(self):
+        barrier = threading.Barrier(2)
+        counts = {}
+
+        def work(n):
+            with profiling.profiling() as stats:
+                # Both blocks are open while the threads count
+                barrier.wait()
+                profiling.count('test_count', n)
+                barrier.wait()
+            counts[n] = stats.counters
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counts, {1: {'test_count': 1}, 2: {'test_count': 2}})
+
+    def test_worker_stats_are_merged(self):
+        with profiling.profiling() as stats:
+            runBootstrapOnMatrix(self.M, self.P, 10, 1000, n_jobs=2, seed=0)
+
+        self.assertEqual(stats.counters['bootstrap_replicates'], 3 * 10)
+        self.assertEqual(stats.counters['qp_solves'], 3 * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
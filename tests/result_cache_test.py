@@ -0,0 +1,92 @@
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from estimates_exposures import bootstrapSigExposures, findSigExposures
+from result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.m = np.array([50., 30., 20.])
+        self.P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]])
+
+    def test_memory_hit(self):
+        cache = ResultCache(maxsize=2)
+        first = cache.call(findSigExposures, self.m.reshape(-1, 1), self.P)
+        second = cache.call(findSigExposures, self.m.reshape(-1, 1).copy(), P=self.P.copy())
+
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_hits_are_copies(self):
+        cache = ResultCache()
+        first, _ = cache.call(findSigExposures, self.m.reshape(-1, 1), self.P)
+        expected = first.copy()
+        first[:] = 0
+        second, _ = cache.call(findSigExposures, self.m.reshape(-1, 1), self.P)
+        second[:] = 0
+
+        # Changing a returned result does not change the cached one
+        np.testing.assert_array_equal(cache.call(findSigExposures, self.m.reshape(-1, 1), self.P)[0], expected)
+
+    def test_parameters_change_key(self):
+        cache = ResultCache()
+        cache.call(bootstrapSigExposures, self.m, self.P, 5, rng=1)
+        cache.call(bootstrapSigExposures, self.m, self.P, 6, rng=1)
+        cache.call(bootstrapSigExposures, self.m, self.P, 5, rng=2)
+
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    def test_code_change_changes_key(self):
+        directory = tempfile.mkdtemp()
+        sys.path.insert(0, directory)
+        try:
+            path = os.path.join(directory, 'cached_module.py')
+            with open(path, 'w') as f:
+                f.write('def scale(x):\n    return 2 * x\n')
+            import cached_module
+            key = ResultCache().key(cached_module.scale, self.m)
+
+            with open(path, 'w') as f:
+                f.write('def scale(x):\n    return 3 * x\n')
+            importlib.reload(cached_module)
+
+            self.assertNotEqual(ResultCache().key(cached_module.scale, self.m), key)
+        finally:
+            sys.path.remove(directory)
+            sys.modules.pop('cached_module', None)
+            shutil.rmtree(directory)
+
+    def test_unseeded_calls_are_not_cached(self):
+        cache = ResultCache()
+        cache.call(bootstrapSigExposures, self.m, self.P, 5)
+        cache.call(bootstrapSigExposures, self.m, self.P, 5, rng=np.random.default_rng(0))
+
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_disk_tier(self):
+        directory = tempfile.mkdtemp()
+        try:
+            exposures, _ = ResultCache(directory=directory).call(bootstrapSigExposures, self.m, self.P, 5, rng=3)
+            cache = ResultCache(directory=directory)
+            cached, _ = cache.call(bootstrapSigExposures, self.m, self.P, 5, rng=3)
+
+            np.testing.assert_array_equal(exposures, cached)
+            self.assertEqual(cache.hits, 1)
+
+            # A value that cannot be pickled leaves no temporary file behind
+            with self.assertRaises(Exception):
+                cache.put('0' * 64, lambda: None)
+            self.assertEqual([name for name in os.listdir(os.path.join(directory, '00'))], [])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
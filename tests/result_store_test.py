@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from estimates_exposures import bootstrapSigExposures, findSigExposures
+from result_store import ResultStore
+from utils import load_and_process_data
+
+
+def _append_chunk(path, sample_ids, M, P):
+    ResultStore(path).append_exposures(sample_ids, *findSigExposures(M, P))
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        profiles, self.P = load_and_process_data(None, 'data/tumorBRCA.csv', 'data/signaturesCOSMIC.csv')
+        self.M = profiles[:, :12]
+        self.sample_ids = [f'sample{i}' for i in range(12)]
+        self.names = [f'SBS{i}' for i in range(1, self.P.shape[1] + 1)]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parallel_appends(self):
+        ResultStore(self.path, self.names)
+        with ProcessPoolExecutor(2) as pool:
+            list(pool.map(_append_chunk, [self.path] * 3, [self.sample_ids[i:i + 4] for i in range(0, 12, 4)],
+                          [self.M[:, i:i + 4] for i in range(0, 12, 4)], [self.P] * 3))
+        exposures, errors = findSigExposures(self.M, self.P)
+
+        store = ResultStore(self.path)
+        self.assertEqual(sorted(store.samples('exposures')), sorted(self.sample_ids))
+        ids, stored = store.read('exposures', 'exposures', samples=['sample9', 'sample2'],
+                                 signatures=['SBS3', 'SBS13'])
+        self.assertEqual(ids, ['sample9', 'sample2'])
+        np.testing.assert_array_almost_equal(stored, exposures[np.ix_([2, 12], [9, 2])].T)
+        ids, stored_errors = store.read('exposures', 'errors')
+        np.testing.assert_array_almost_equal(stored_errors, errors[[self.sample_ids.index(s) for s in ids]])
+
+    def test_bootstrap_and_selection(self):
+        store = ResultStore(self.path, self.names)
+        distributions = [bootstrapSigExposures(self.M[:, i], self.P, 5, 1000, rng=i) for i in range(2)]
+        store.append_bootstrap(self.sample_ids[:2], [d[0] for d in distributions], [d[1] for d in distributions])
+        store.append_selection(self.sample_ids[:2], [[0, 2], [4]])
+
+        _, exposures = store.read('bootstrap', 'exposures', samples=['sample1'])
+        np.testing.assert_array_equal(exposures[0], distributions[1][0])
+        self.assertEqual(store.selected(), {'sample0': ['SBS1', 'SBS3'], 'sample1': ['SBS5']})
+        with self.assertRaises(KeyError):
+            store.read('bootstrap', 'errors', samples=['missing'])
+
+    def test_signature_names_must_match(self):
+        ResultStore(self.path, self.names)
+        with self.assertRaises(ValueError):
+            ResultStore(self.path, self.names[::-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
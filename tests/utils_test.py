@@ -1,5 +1,8 @@
+import io
+import tempfile
 import numpy as np
 import unittest
+from unittest import mock
 from utils import *
 import os
 
@@ -16,12 +19,71 @@ class TestUtils(unittest.TestCase):
 
         # Check if the result matches the expected result
         self.assertAlmostEqual(result, expected_result, places=5)
+
+    def test_reconstruction_errors(self):
+        rng = np.random.default_rng(0)
+        M = rng.random((96, 7))
+        P = rng.random((96, 4))
+        E = rng.random((4, 7))
+
+        expected = [FrobeniusNorm(M[:, i], P, E[:, i]) for i in range(7)]
+        np.testing.assert_array_almost_equal(reconstruction_errors(M, P, E), expected)
+        # One profile against every column
+        expected = [FrobeniusNorm(M[:, 0], P, E[:, i]) for i in range(7)]
+        np.testing.assert_array_almost_equal(reconstruction_errors(M[:, 0], P, E), expected)
+
+    def test_gram_reconstruction_errors(self):
+        rng = np.random.default_rng(0)
+        M = rng.random((96, 7)) * (rng.random((96, 7)) < 0.2)
+        P = rng.random((96, 4))
+        E = rng.random((4, 7))
+
+        expected = reconstruction_errors(M, P, E)
+        np.testing.assert_array_almost_equal(gram_reconstruction_errors(M, P, E), expected)
+        np.testing.assert_array_almost_equal(gram_reconstruction_errors(sparse.csc_matrix(M), P, E), expected)
+        np.testing.assert_array_almost_equal(gram_reconstruction_errors(M[:, 0], P, E),
+                                             reconstruction_errors(M[:, 0], P, E))
+
+    def test_normalize_columns(self):
+        M = np.array([[1., 0.], [3., 2.]])
+
+        np.testing.assert_array_equal(normalize_columns(M), [[0.25, 0.], [0.75, 1.]])
+        self.assertEqual(normalize_columns(M, np.float32).dtype, np.float32)
+        np.testing.assert_array_equal(normalize_columns(sparse.csr_matrix(M)).toarray(), [[0.25, 0.], [0.75, 1.]])
+        self.assertIs(normalize_columns(M, inplace=True), M)
+        with self.assertRaises(ValueError):
+            normalize_columns(M, np.float32, inplace=True)
+
+    def test_reconstruction_metrics(self):
+        P = np.array([[0.2, 0.3], [0.3, 0.1], [0.5, 0.6]])
+        E = np.array([[0.5, 1.0], [0.5, 0.0]])
+        M = np.dot(P, E)
+
+        metrics = reconstruction_metrics(M, P, E)
+        np.testing.assert_array_almost_equal(metrics['error'], [0, 0])
+        np.testing.assert_array_almost_equal(metrics['cosine'], [1, 1])
+        np.testing.assert_array_almost_equal(metrics['kl'], [0, 0])
+        self.assertEqual(metrics['residuals'].shape, (3, 2))
+
     def test_valid_data_files(self):
         """Test loading and processing with valid data files."""
         profile, signatures = load_and_process_data(0, "data/tumorBRCA.csv", "data/signaturesCOSMIC.csv")
         self.assertIsNotNone(profile, "Profile should not be None")
         self.assertIsNotNone(signatures, "Signatures should not be None")
 
+    def test_catalogue_cache_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'signatures.csv')
+            with open("data/signaturesCOSMIC.csv") as source, open(path, 'w') as f:
+                f.write(source.read())
+
+            _, signatures = load_and_process_data(0, "data/tumorBRCA.csv", path)
+            self.assertIs(type(signatures), np.ndarray)
+            self.assertEqual(os.listdir(directory), ['signatures.csv'])
+            _, cached = load_and_process_data(0, "data/tumorBRCA.csv", path, cache=True)
+            np.testing.assert_array_equal(cached, signatures)
+            self.assertIn('.cache', os.listdir(directory))
+
     def test_nonexistent_files(self):
         """Test handling of non-existent files."""
         with self.assertRaises(FileNotFoundError):
@@ -37,6 +99,33 @@ class TestUtils(unittest.TestCase):
         os.remove('data/empty.csv')
 
 
+    def test_bootstrap_samples(self):
+        m = np.array([0.5, 0.3, 0.2])
+        samples = bootstrap_samples(m, 1000, 50, rng=0)
+
+        self.assertEqual(samples.shape, (3, 50))
+        np.testing.assert_array_almost_equal(samples.sum(axis=0), np.ones(50))
+        np.testing.assert_array_equal(samples, bootstrap_samples(m, 1000, 50, rng=0))
+
+    def test_iter_profile_chunks(self):
+        profiles, _ = load_and_process_data(None, "data/tumorBRCA.csv", "data/signaturesCOSMIC.csv")
+        chunks = list(iter_profile_chunks("data/tumorBRCA.csv", chunk_size=128))
+
+        self.assertEqual([len(ids) for ids, _ in chunks], [128, 128, 128, 128, 48])
+        self.assertEqual(chunks[0][0][0], "PD10010")
+        np.testing.assert_array_equal(np.hstack([chunk for _, chunk in chunks]), profiles)
+
+    def test_iter_profile_chunks_invalid(self):
+        # A ragged row, no rows and no samples
+        for text in ["a,b\nx,1\ny,2,3\n", "a,b\n", "a\nx\ny\n"]:
+            created = []
+            temporary_file = tempfile.TemporaryFile
+            with mock.patch('tempfile.TemporaryFile', lambda: created.append(temporary_file()) or created[-1]):
+                with self.assertRaises(ValueError):
+                    list(iter_profile_chunks(io.StringIO(text)))
+            # The temporary file is closed after the error
+            self.assertTrue(created[0].closed)
+
     def test_is_wholenumber(self):
         # Test with whole numbers
         self.assertTrue(is_wholenumber(2), "2 should be identified as a whole number")
@@ -1,26 +1,172 @@
+import tempfile
+
 import numpy as np
+from scipy import sparse
+from catalogue import load_catalogue
+from profiling import count
 
 
 def FrobeniusNorm(M, P, E):
     return np.sqrt(np.sum((M - np.dot(P, E))**2))
 
 
+def residuals(M, P, E):
+    """
+    Reconstruction residuals M - P @ E of all columns, computed with one matrix product.
+
+    M can be a matrix (96, G) matching the columns of E (N, G), or a single profile (96,)
+    compared with every column of E (e.g. bootstrap replicates or cross-validation folds).
+    """
+    M = np.asarray(M, dtype=float)
+    reconstructed = np.dot(P, E)
+    if M.ndim == 1 and reconstructed.ndim == 2:
+        M = M[:, None]
+    return M - reconstructed
+
+
+def reconstruction_errors(M, P, E):
+    """Frobenius norm of the residual of each column, as FrobeniusNorm(M[:, i], P, E[:, i])."""
+    R = residuals(M, P, E)
+    return np.sqrt(np.einsum('i...,i...->...', R, R))
+
+
+def gram_reconstruction_errors(M, P, E, G=None):
+    """
+    reconstruction_errors from ||m||^2 - 2 e.(P.T m) + e.(G e), without the (96, G) residual.
+
+    M can be a scipy.sparse matrix or a float32 array, or a single profile (96,) compared with
+    every column of E; the sums are accumulated in float64.
+    The expansion cancels for near-perfect fits, so an error is accurate to about
+    sqrt(eps * ||m||^2), i.e. ~1e-9 for a normalized profile.
+    """
+    if G is None:
+        G = np.dot(P.T, P)
+    E = np.asarray(E, dtype=float)
+    if sparse.issparse(M):
+        squares = np.asarray(M.multiply(M).sum(axis=0, dtype=float)).ravel()
+    else:
+        squares = np.einsum('i...,i...->...', M, M, dtype=float)
+    D = np.asarray(P.T @ M, dtype=float).reshape(E.shape[0], -1)
+    squared = squares - 2 * np.einsum('ij,ij->j', E, D) + np.einsum('ij,ij->j', E, np.dot(G, E))
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def normalize_columns(M, dtype=None, inplace=False):
+    """
+    Scale every column of M to sum up to 1.
+
+    Parameters:
+        M (numpy.ndarray or scipy.sparse matrix): Profiles (96, G), counts or frequencies.
+        dtype (numpy.dtype, optional): Storage of the result, float64 by default.
+            float32 halves the memory of cohort-scale matrices.
+        inplace (bool): Overwrite M instead of copying it. M must already be an array
+            (or sparse matrix) of 'dtype'.
+
+    Returns:
+        numpy.ndarray or scipy.sparse.csc_matrix: The normalized profiles. Sparse input
+        stays sparse, so the zero counts of exome samples are never stored.
+    """
+    dtype = np.dtype(float if dtype is None else dtype)
+    if inplace and M.dtype != dtype:
+        raise ValueError(f"In-place normalization needs 'M' of dtype {dtype}, not {M.dtype}.")
+
+    if sparse.issparse(M):
+        M = M.tocsc(copy=not inplace).astype(dtype, copy=False)
+        sums = np.asarray(M.sum(axis=0, dtype=float)).ravel()
+        M.data /= np.repeat(sums, np.diff(M.indptr)).astype(dtype)
+        return M
+    if inplace:
+        M /= M.sum(axis=0)
+        return M
+    return np.divide(M, M.sum(axis=0), dtype=dtype)
+
+
+def reconstruction_metrics(M, P, E, metrics=('error', 'cosine', 'kl', 'residuals')):
+    """
+    Compare every column of E with its profile in M using a single reconstruction P @ E.
+
+    Parameters:
+        M (numpy.ndarray): Profiles (96, G), or one profile (96,) for all columns of E.
+        P (numpy.ndarray): Signature profile matrix (96, N).
+        E (numpy.ndarray): Exposures (N, G).
+        metrics (tuple): Any of 'error' (Frobenius norm), 'cosine' (cosine similarity),
+            'kl' (KL divergence of the reconstruction from the profile, both normalized)
+            and 'residuals' (the (96, G) matrix M - P @ E).
+
+    Returns:
+        dict: One array per requested metric.
+    """
+    M = np.asarray(M, dtype=float)
+    reconstructed = np.dot(P, E)
+    if M.ndim == 1 and reconstructed.ndim == 2:
+        M = np.broadcast_to(M[:, None], reconstructed.shape)
+    R = M - reconstructed
+
+    out = {}
+    if 'error' in metrics:
+        out['error'] = np.sqrt(np.einsum('i...,i...->...', R, R))
+    if 'cosine' in metrics:
+        norms = np.linalg.norm(M, axis=0) * np.linalg.norm(reconstructed, axis=0)
+        out['cosine'] = np.einsum('i...,i...->...', M, reconstructed) / norms
+    if 'kl' in metrics:
+        p = M / M.sum(axis=0)
+        q = reconstructed / reconstructed.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(p > 0, p * np.log(p / q), 0.0)
+        out['kl'] = terms.sum(axis=0)
+    if 'residuals' in metrics:
+        out['residuals'] = R
+    return out
+
+
 def is_wholenumber(x, tol=1e-15):
     return np.abs(x - np.round(x)) < tol
 
 
+def bootstrap_samples(m, mutation_count, R, rng=None, dtype=float):
+    """
+    Draw R bootstrap replicates of a mutational profile in one multinomial call.
+
+    Parameters:
+        m (numpy.ndarray): Mutation type probabilities, shape (K,).
+        mutation_count (int): Number of mutations drawn for each replicate.
+        R (int): The number of bootstrap replicates.
+        rng (numpy.random.Generator or int, optional): Generator (or seed for one) used
+            for the draws. If None, the global numpy random state is used, so
+            'np.random.seed' keeps results reproducible.
+        dtype (numpy.dtype, optional): Storage of the frequencies, e.g. float32.
+
+    Returns:
+        numpy.ndarray: Matrix of shape (K, R) with the mutation frequencies of each replicate (column).
+    """
+    m = np.asarray(m, dtype=float)
+    mutation_count = int(mutation_count)
+    count('bootstrap_replicates', R)
+    if rng is None:
+        counts = np.random.multinomial(mutation_count, m, size=R)
+    else:
+        counts = np.random.default_rng(rng).multinomial(mutation_count, m, size=R)
+
+    return np.divide(counts.T, mutation_count, dtype=dtype)
+
+
 def calculate_BIC(M, exposures, errors):
     n = M.shape[1]  # Number of patients
     k = exposures.shape[0]  # Number of signatures
     RSS = np.sum(errors**2)
 
+    return BIC_from_RSS(RSS, n, k)
+
+
+def BIC_from_RSS(RSS, n, k):
+    # calculate_BIC from its sums, e.g. accumulated over chunks of patients; RSS may be an array
     log_likelihood = -n/2 * np.log(RSS)
     BIC = k * np.log(n) - 2 * log_likelihood
 
     return BIC
 
 
-def load_and_process_data(patient_index, mutational_profiles, predf_mutational_signatures):
+def load_and_process_data(patient_index, mutational_profiles, predf_mutational_signatures, cache=False):
         # Load and process the first file
         profiles = np.genfromtxt(mutational_profiles, delimiter=',', skip_header=1)
         if profiles.size == 0:
@@ -32,14 +178,73 @@ def load_and_process_data(patient_index, mutational_profiles, predf_mutational_s
             profile = profiles[:, patient_index]
 
         # Load and process the second file
-        signatures = np.genfromtxt(predf_mutational_signatures, delimiter=',', skip_header=1)
-        if signatures.size == 0:
-            raise ValueError(f"Empty data in {predf_mutational_signatures}")
-        signatures = np.delete(signatures, 0, axis=1)
+        if cache:
+            # Read-only memory map of its binary cache in .cache/ next to the file, which pool
+            # workers share; the label column is detected as in catalogue.read_catalogue
+            signatures, _, _ = load_catalogue(predf_mutational_signatures)
+        else:
+            signatures = np.genfromtxt(predf_mutational_signatures, delimiter=',', skip_header=1)
+            if signatures.size == 0:
+                raise ValueError(f"Empty data in {predf_mutational_signatures}")
+            signatures = np.delete(signatures, 0, axis=1)
 
         # Return processed data
         return profile, signatures
 
+def _split_line(line, delimiter):
+    return [x.strip().strip('"') for x in line.rstrip('\r\n').split(delimiter)]
+
+
+def iter_profile_chunks(source, chunk_size=1000, delimiter=',', skip_columns=1):
+    """
+    Read a mutation count matrix (mutation types x samples) in chunks of samples.
+
+    The file is read once, line by line, into a temporary binary file, so memory use
+    depends on 'chunk_size' and not on the number of samples in the file.
+
+    Parameters:
+        source (str or file): Path or open text file. The first line holds the sample IDs.
+        chunk_size (int): Number of samples (columns) per chunk.
+        delimiter (str): Field delimiter, ',' for csv and '\t' for tsv files.
+        skip_columns (int): Number of leading label columns (e.g. 2 for data/M.csv).
+
+    Yields:
+        tuple: (sample_ids, profiles) with a list of up to 'chunk_size' IDs and the
+            matching (96, chunk) matrix.
+
+    Raises:
+        ValueError: If a row has another number of values than there are samples, or the
+            file has no rows or no samples.
+    """
+    # The temporary file is closed when the chunks are consumed and also when parsing fails
+    with tempfile.TemporaryFile() as rows:
+        f = open(source) if isinstance(source, str) else source
+        try:
+            sample_ids = _split_line(next(f), delimiter)[skip_columns:]
+            n_rows = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                values = np.array(_split_line(line, delimiter)[skip_columns:], dtype=float)
+                if len(values) != len(sample_ids):
+                    raise ValueError(f"Row {n_rows + 1} has {len(values)} values for {len(sample_ids)} samples.")
+                rows.write(values.tobytes())
+                n_rows += 1
+        finally:
+            if isinstance(source, str):
+                f.close()
+
+        if n_rows == 0:
+            raise ValueError(f"Empty data in {source}")
+        if not sample_ids:
+            raise ValueError(f"No samples in {source}")
+
+        rows.flush()
+        profiles = np.memmap(rows, dtype=float, mode='r', shape=(n_rows, len(sample_ids)))
+        for start in range(0, len(sample_ids), chunk_size):
+            yield sample_ids[start:start + chunk_size], np.array(profiles[:, start:start + chunk_size])
+
+
 def calculate_sensitivity_specificity(predicted, actual, total_values):
     predicted_set = set(predicted)
     actual_set = set(actual)
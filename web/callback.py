@@ -1,14 +1,26 @@
-from web.layout import app, data, organs
+from web.layout import app, index
 import plotly.graph_objects as go
 import plotly.express as px
-from web.uploader import parse_contents, load_signatures, load_names
-from estimates_exposures import bootstrapSigExposures, crossValidationSigExposures, findSigExposures
-from model_selection import forward_elimination, backward_elimination
+from web.uploader import parse_contents
+from result_cache import ResultCache
+from web.datasets import DatasetRegistry, dataset_key
+from web.cohort import PAGE_SIZE, cohort_tasks, downsample, page, prevalence
+from web.jobs import JobManager, bootstrap_chunks
+from estimates_exposures import crossValidationSigExposures, findSigExposures
+from model_selection import backward_elimination
 import numpy as np
 from utils import is_wholenumber
 from dash import Input, Output, State
 import dash
 
+# Results of the per-patient computations; panels whose inputs did not change are served from here.
+# Random computations use a fixed seed so their results can be cached.
+results = ResultCache(maxsize=64)
+SEED = 0
+# Worker pool of the background computations
+jobs = JobManager(cache=results)
+# Uploaded matrices, kept on the server and memory-mapped
+datasets = DatasetRegistry()
 
 
 @app.callback(
@@ -17,7 +29,9 @@ import dash
     [Input('dropdown', 'value')]
 )
 def set_options(selected_category):
-    return [{'label': f"Sig {i}", 'value': i} for i in data[selected_category]], [i for i in data[selected_category]]
+    # Values are the signature columns of the catalogue
+    options = [{'label': name, 'value': j} for j, name in enumerate(index.names(selected_category))]
+    return options, index.default(selected_category)
 
 @app.callback(
     [Output('session', 'data')],
@@ -27,19 +41,72 @@ def set_options(selected_category):
 )
 def update_output(contents, organ, filename):
     if contents is not None:
-        data, patients = parse_contents(contents, filename)
-        return [{'data': data, 'patients': patients, 'filename': filename, 'organ': organ}]
+        # The matrix stays on the server; the browser only gets its key
+        key = dataset_key(contents)
+        if key in datasets:
+            _, patients = datasets.get(key)
+        else:
+            data, patients = parse_contents(contents, filename)
+            datasets.put(key, data, patients, filename)
+        return [{'key': key, 'patients': list(patients), 'filename': filename, 'organ': organ}]
     else:
         return dash.no_update
 
 
 
-# Callback to update the plot based on data and parameters
+def _strip_with_boxes(exposures, distributions, names):
+    fig = px.strip(x=range(1, exposures.shape[0] + 1),
+                   y=exposures.squeeze(),
+                   stripmode='overlay')
+    for i in range(distributions.shape[0]):
+        fig.add_trace(go.Box(
+            y=distributions[i, :],
+            name=names[i]))
+    return fig
+
+
+def crossvalid_figure(patient, exposures, exposures_cv):
+    fig_cross = _strip_with_boxes(exposures, exposures_cv, [f'Sig {i}' for i in range(exposures_cv.shape[0])])
+    fig_cross.update_layout(
+        title=f'Cross valid for {patient}',
+        xaxis_title='Sig',
+        yaxis_title='Signature contribution'
+    )
+    return fig_cross
+
+
+def bootstrap_figure(patient, exposures, exposures_bt):
+    fig_bootstrap = _strip_with_boxes(exposures, exposures_bt,
+                                      [f'Sig {i + 1}' for i in range(exposures_bt.shape[0])])
+    fig_bootstrap.update_layout(
+        title=f'Bootstrap for {patient}',
+        xaxis_title='Sig',
+        yaxis_title='Signature contribution'
+    )
+    return fig_bootstrap
+
+
+def selection_figure(patient, best_signatures, bootstrap_r, decompos_r, offset=1):
+    fig_model_selection = _strip_with_boxes(decompos_r[0], bootstrap_r[0],
+                                            [f'Sig {best_signatures[i] + 1}' for i in range(bootstrap_r[0].shape[0])])
+    fig_model_selection.update_layout(
+        title=f'Backward elimination selection signatures for {patient}',
+        xaxis_title='Sig',
+        yaxis_title='Signature contribution',
+        xaxis=dict(
+            tickmode='array',
+            tickvals=list(range(1, decompos_r[0].shape[0] + 1)),
+            ticktext=[f'Sig {best_signatures[i] + offset}' for i in range(decompos_r[0].shape[0])]
+        )
+    )
+    return fig_model_selection
+
+
+# The computations run as background jobs: this callback submits them (cancelling the jobs
+# of the previous inputs) and the figures below are drawn as each job completes.
 @app.callback(
-    [Output('bar-plot-crossvalid', 'figure'),
-     Output('bar-plot-bootstrap', 'figure'),
-     Output('bar-plot-modelselection', 'figure'),
-     Output('bar-plot-forward_model', 'figure'),
+    [Output('jobs', 'data'),
+     Output('job-poll', 'disabled'),
      Output('input-mutation-count', 'value'),
      ],
     [
@@ -52,111 +119,247 @@ def update_output(contents, organ, filename):
      Input('organ-dropdown', 'value')
      ],
     [State('dropdown', 'value'),
-     State('dropdown-switch', 'on')]
+     State('dropdown-switch', 'on'),
+     State('jobs', 'data')]
 )
-def update_output(fold_size, R, mutation_count, patient, stored_data, signatures, organ, dropdown_value, boolean_on):
-    if stored_data is not None and patient is not None:
-        data, patients = np.array(stored_data['data']), np.array(stored_data['patients'])
-        column_index = np.where(patients == patient)[0]
+def submit_jobs(fold_size, R, mutation_count, patient, stored_data, signatures, organ, dropdown_value, boolean_on,
+                previous):
+    if stored_data is None or patient is None:
+        return dash.no_update, dash.no_update, dash.no_update
 
-        patient_column = data[:, column_index].squeeze()
+    for job_id in (previous or {}).get('ids', {}).values():
+        jobs.cancel(job_id)
 
-        if mutation_count == 0:
-            if all(is_wholenumber(val) for val in patient_column):
-                mutation_count = patient_column.sum()
-        else:
-            mutation_count = 1000
+    try:
+        data, patients = datasets.get(stored_data['key'])
+    except KeyError:
+        # Evicted after being idle; the file has to be uploaded again
+        return None, True, dash.no_update
+    column_index = np.where(patients == patient)[0]
 
-        #if boolean_on:
-        #    signatures = load_signatures(organ, organ=True)
-        #    sigsBRCA = load_names(organ)
-        #else:
-        sigsBRCA = [x - 1 for x in signatures]
+    patient_column = np.array(data[:, column_index]).squeeze()
 
-        signatures = load_signatures(dropdown_value, organ=False)
+    requested_mutation_count = mutation_count
+    if mutation_count == 0:
+        if all(is_wholenumber(val) for val in patient_column):
+            mutation_count = patient_column.sum()
+    else:
+        mutation_count = 1000
 
-        exposures, errors = findSigExposures(patient_column.reshape(patient_column.shape[0], 1), signatures)
+    #if boolean_on:
+    #    catalogue = index.catalogue(organ, version='latest')
+    #else:
+    # The selected columns of the catalogue; the sliced matrix and its Gram matrix are kept between callbacks
+    catalogue = index.catalogue(dropdown_value, signatures or None)
+    signatures = catalogue.signatures
 
-        exposures_cv, errors_cv = crossValidationSigExposures(patient_column, signatures, fold_size)
+    ids = {
+        'fit': jobs.submit(findSigExposures, patient_column.reshape(patient_column.shape[0], 1), signatures,
+                           gram=catalogue.gram),
+        'crossvalid': jobs.submit(crossValidationSigExposures, patient_column, signatures, fold_size,
+                                  rng=SEED, gram=catalogue.gram),
+        'bootstrap': jobs.submit_tasks(*bootstrap_chunks(patient_column, signatures, R, 1000, SEED, catalogue.gram),
+                                       key=jobs.key(bootstrap_chunks, patient_column, signatures, R, 1000, SEED,
+                                                    catalogue.gram)),
+        'selection': jobs.submit(backward_elimination, patient_column, signatures,
+                                 threshold=0.01, mutation_count=1000, R=R,
+                                 significance_level=0.01, seed=SEED),
+    }
+    # Writing back an unchanged value would trigger this callback (and the jobs) again
+    if mutation_count == requested_mutation_count:
+        mutation_count = dash.no_update
+    return {'patient': patient, 'ids': ids}, False, mutation_count
 
-        fig_cross = px.strip(x=range(1, exposures.shape[0] + 1),
-                             y=exposures.squeeze(),
-                             stripmode='overlay')
 
-        for i in range(exposures_cv.shape[0]):
-            fig_cross.add_trace(go.Box(
-                y=exposures_cv[i, :],
-                name=f'Sig {i}'))
+def _finished(submitted, *panels):
+    # Results of the jobs of 'panels' once all of them are done, otherwise None
+    if not submitted:
+        return None
+    if not all(jobs.status(submitted['ids'][panel])['state'] == 'done' for panel in panels):
+        return None
+    return [jobs.result(submitted['ids'][panel]) for panel in panels]
 
-        fig_cross.update_layout(
-            title=f'Cross valid for {patient}',
-            xaxis_title='Sig',
-            yaxis_title='Signature contribution'
-        )
 
-        exposures_bt, errors_bt = bootstrapSigExposures(patient_column, signatures, R, mutation_count=1000)
-        fig_bootstrap = px.strip(x=range(1, exposures.shape[0] + 1),
-                             y=exposures.squeeze(),
-                             stripmode='overlay')
+@app.callback(
+    Output('bar-plot-crossvalid', 'figure'),
+    [Input('job-poll', 'n_intervals')],
+    [State('jobs', 'data'), State('bar-plot-crossvalid', 'figure')]
+)
+def update_crossvalid(_, submitted, figure):
+    finished = _finished(submitted, 'fit', 'crossvalid')
+    if finished is None or _drawn(figure, submitted['ids']):
+        return dash.no_update
+    (exposures, _), (exposures_cv, _) = finished
+    return _tagged(crossvalid_figure(submitted['patient'], exposures, exposures_cv), submitted['ids'])
 
-        for i in range(exposures_bt.shape[0]):
-            fig_bootstrap.add_trace(go.Box(
-                y=exposures_bt[i, :],
-                name=f'Sig {i + 1}'))
 
-        fig_bootstrap.update_layout(
-            title=f'Bootstrap for {patient}',
-            xaxis_title='Sig',
-            yaxis_title='Signature contribution'
-        )
+@app.callback(
+    Output('bar-plot-bootstrap', 'figure'),
+    [Input('job-poll', 'n_intervals')],
+    [State('jobs', 'data'), State('bar-plot-bootstrap', 'figure')]
+)
+def update_bootstrap(_, submitted, figure):
+    finished = _finished(submitted, 'fit', 'bootstrap')
+    if finished is None or _drawn(figure, submitted['ids']):
+        return dash.no_update
+    (exposures, _), (exposures_bt, _) = finished
+    return _tagged(bootstrap_figure(submitted['patient'], exposures, exposures_bt), submitted['ids'])
 
-        best_signatures, bootstrap_r, decompos_r = backward_elimination(patient_column, signatures, threshold=0.01, mutation_count=1000, R=R, significance_level=0.01)
-
-        fig_model_selection = px.strip(x=range(1, decompos_r[0].shape[0] + 1),
-                                 y=decompos_r[0].squeeze(),
-                                 stripmode='overlay')
-        for i in range(bootstrap_r[0].shape[0]):
-            fig_model_selection.add_trace(go.Box(
-                y=bootstrap_r[0][i, :],
-                name=f'Sig {best_signatures[i] + 1}'))
-
-        fig_model_selection.update_layout(
-            title=f'Backward elimination selection signatures for {patient}',
-            xaxis_title='Sig',
-            yaxis_title='Signature contribution',
-            xaxis=dict(
-                tickmode='array',
-                tickvals=list(range(1, decompos_r[0].shape[0] + 1)),
-                ticktext=[f'Sig {best_signatures[i] + 1}' for i in range(decompos_r[0].shape[0])]
-            )
-        )
-        from decompose import decomposeQ
-        #best_signatures, bootstrap_r, decompos_r = backward_elimination(patient_column, signatures, R=100,
-        #                                                                significance_level=0.05,
-        #                                                                decomposition_method=decomposeQ)
-
-        fig_model_selection_forward = px.strip(x=range(1, decompos_r[0].shape[0] + 1),
-                                       y=decompos_r[0].squeeze(),
-                                       stripmode='overlay')
-        for i in range(bootstrap_r[0].shape[0]):
-            fig_model_selection_forward.add_trace(go.Box(
-                y=bootstrap_r[0][i, :],
-                name=f'Sig {best_signatures[i] + 1}'))
-
-        fig_model_selection_forward.update_layout(
-            title=f'Backward elimination selection signatures for {patient}',
-            xaxis_title='Sig',
-            yaxis_title='Signature contribution',
-            xaxis=dict(
-                tickmode='array',
-                tickvals=list(range(1, decompos_r[0].shape[0] + 1)),
-                ticktext=[f'Sig {best_signatures[i]}' for i in range(decompos_r[0].shape[0])]
-            )
-        )
 
-        return fig_cross, fig_bootstrap, fig_model_selection, fig_model_selection_forward, mutation_count
-    else:
-        return None, None, 0
+@app.callback(
+    [Output('bar-plot-modelselection', 'figure'),
+     Output('bar-plot-forward_model', 'figure')],
+    [Input('job-poll', 'n_intervals')],
+    [State('jobs', 'data'), State('bar-plot-modelselection', 'figure')]
+)
+def update_selection(_, submitted, figure):
+    finished = _finished(submitted, 'selection')
+    if finished is None or _drawn(figure, submitted['ids']):
+        return dash.no_update, dash.no_update
+    best_signatures, bootstrap_r, decompos_r = finished[0]
+    return (_tagged(selection_figure(submitted['patient'], best_signatures, bootstrap_r, decompos_r),
+                    submitted['ids']),
+            _tagged(selection_figure(submitted['patient'], best_signatures, bootstrap_r, decompos_r, offset=0),
+                    submitted['ids']))
+
+
+def _tagged(figure, tag):
+    # The figure remembers what it was drawn from (job ids, page), so polling does not redraw it
+    figure.update_layout(meta={'drawn_from': tag})
+    return figure
+
+
+def _drawn(figure, tag):
+    return bool(figure) and (figure.get('layout') or {}).get('meta', {}).get('drawn_from') == tag
+
+
+@app.callback(
+    [Output('job-progress', 'children'),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    [Input('job-poll', 'n_intervals')],
+    [State('jobs', 'data')],
+    prevent_initial_call=True
+)
+def update_progress(_, submitted):
+    if not submitted:
+        return '', True
+    statuses = {panel: jobs.status(job_id) for panel, job_id in submitted['ids'].items()}
+    text = ', '.join(f"{panel}: {status['state']} {status['progress']:.0%}" for panel, status in statuses.items())
+    # Polling stops when no job is left running
+    return text, all(status['state'] != 'running' for status in statuses.values())
+
+
+# Cohort view: all patients of the upload are fitted and bootstrapped as one background job,
+# and only pages or a downsampled overview of the results are sent to the browser.
+@app.callback(
+    [Output('cohort-job', 'data'),
+     Output('cohort-poll', 'disabled')],
+    [Input('cohort-button', 'n_clicks')],
+    [State('session', 'data'),
+     State('input-R', 'value'),
+     State('dropdown', 'value'),
+     State('signatures-dropdown', 'value'),
+     State('cohort-job', 'data')],
+    prevent_initial_call=True
+)
+def submit_cohort(_, stored_data, R, dropdown_value, signatures, previous):
+    if stored_data is None:
+        return dash.no_update, dash.no_update
+    if previous:
+        jobs.cancel(previous['id'])
+    try:
+        data, patients = datasets.get(stored_data['key'])
+    except KeyError:
+        return None, True
+
+    # The signatures selected for the per-patient panels
+    catalogue = index.catalogue(dropdown_value, signatures or None)
+    job_id = jobs.submit_tasks(*cohort_tasks(data, catalogue.signatures, R, SEED, catalogue.gram),
+                               key=jobs.key(cohort_tasks, data, catalogue.signatures, R, SEED, catalogue.names))
+    return {'id': job_id, 'dataset': stored_data['key'], 'catalogue': dropdown_value,
+            'signatures': signatures or None}, False
+
+
+@app.callback(
+    [Output('cohort-progress', 'children'),
+     Output('cohort-poll', 'disabled', allow_duplicate=True)],
+    [Input('cohort-poll', 'n_intervals')],
+    [State('cohort-job', 'data')],
+    prevent_initial_call=True
+)
+def update_cohort_progress(_, cohort_job):
+    if not cohort_job:
+        return '', True
+    status = jobs.status(cohort_job['id'])
+    return f"cohort: {status['state']} {status['progress']:.0%}", status['state'] != 'running'
+
+
+def _cohort_results(cohort_job):
+    # (exposures, errors, p_values), patient IDs and signature names of a finished cohort job
+    if not cohort_job or jobs.status(cohort_job['id'])['state'] != 'done':
+        return None
+    try:
+        _, patients = datasets.get(cohort_job['dataset'])
+    except KeyError:
+        return None
+    names = index.catalogue(cohort_job['catalogue'], cohort_job.get('signatures')).names
+    return jobs.result(cohort_job['id']), patients, names
+
+
+@app.callback(
+    [Output('cohort-overview', 'figure'),
+     Output('cohort-prevalence', 'figure')],
+    [Input('cohort-poll', 'n_intervals')],
+    [State('cohort-job', 'data'),
+     State('cohort-overview', 'figure')]
+)
+def update_cohort_overview(_, cohort_job, figure):
+    finished = _cohort_results(cohort_job)
+    if finished is None or _drawn(figure, cohort_job['id']):
+        return dash.no_update, dash.no_update
+    (exposures, _, p_values), patients, names = finished
+
+    means, starts = downsample(exposures)
+    fig_overview = go.Figure(go.Heatmap(z=means, x=[patients[i] for i in starts], y=names, colorscale='Viridis'))
+    fig_overview.update_layout(
+        title=f'Mean exposures of {len(patients)} patients'
+              + (f' ({len(patients) // len(starts)}+ patients per column)' if len(starts) < len(patients) else ''),
+        xaxis_title='Patients',
+        yaxis_title='Signature'
+    )
+
+    fig_prevalence = px.bar(x=names, y=prevalence(p_values))
+    fig_prevalence.update_layout(
+        title='Fraction of patients with the signature present (bootstrap p-value < 0.01)',
+        xaxis_title='Signature',
+        yaxis_title='Prevalence'
+    )
+    return _tagged(fig_overview, cohort_job['id']), _tagged(fig_prevalence, cohort_job['id'])
+
+
+@app.callback(
+    Output('cohort-heatmap', 'figure'),
+    [Input('cohort-poll', 'n_intervals'),
+     Input('cohort-page', 'value')],
+    [State('cohort-job', 'data'),
+     State('cohort-heatmap', 'figure')]
+)
+def update_cohort_page(_, page_number, cohort_job, figure):
+    finished = _cohort_results(cohort_job)
+    tag = [cohort_job['id'], page_number] if cohort_job else None
+    if finished is None or _drawn(figure, tag):
+        return dash.no_update
+    (exposures, _, _), patients, names = finished
+
+    values, columns = page(exposures, max((page_number or 1) - 1, 0))
+    fig_page = go.Figure(go.Heatmap(z=values, x=[patients[i] for i in columns], y=names, colorscale='Viridis'))
+    fig_page.update_layout(
+        title=f'Exposures, page {page_number or 1} of {-(-len(patients) // PAGE_SIZE)}',
+        xaxis_title='Patient',
+        yaxis_title='Signature'
+    )
+    return _tagged(fig_page, tag)
+
 
 # Callback to display the value of the slider
 @app.callback(
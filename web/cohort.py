@@ -0,0 +1,73 @@
+"""
+Cohort view of the Dash app: exposures and bootstrap p-values of all uploaded patients.
+
+The cohort is split into chunks of patients which run as the tasks of one background job
+(see web/jobs.py); a chunk is fitted with the batched findSigExposures and its p-values
+come from runBootstrapOnMatrix. The results are computed once and kept on the server;
+the browser only receives a page of patients, or the whole cohort downsampled to a
+fixed number of columns.
+"""
+import numpy as np
+
+from estimates_exposures import findSigExposures
+from model_selection import runBootstrapOnMatrix
+
+# Patients per task of a cohort job
+CHUNK_SIZE = 100
+# Patients per heatmap page and columns of the downsampled overview
+PAGE_SIZE = 100
+OVERVIEW_COLUMNS = 200
+
+
+def cohort_chunk(M, P, R, mutation_count, seed, gram=None, threshold=0.01):
+    # Exposures, errors and bootstrap p-values (signatures x patients) of a chunk of patients
+    exposures, errors = findSigExposures(M, P, gram=gram)
+    p_values = runBootstrapOnMatrix(M, P, R, mutation_count, threshold=threshold, seed=seed)
+    return exposures, errors, p_values
+
+
+def cohort_tasks(data, P, R, seed, gram=None, chunk_size=CHUNK_SIZE):
+    """
+    Tasks of a cohort job and the function that joins their results.
+
+    Counts are bootstrapped with the mutation count of each patient, frequencies with
+    1000 mutations. Every chunk gets its own seed spawned from 'seed'.
+
+    Returns:
+        tuple: (func, tasks, kwargs, combine), the arguments of JobManager.submit_tasks.
+    """
+    data = np.asarray(data)
+    mutation_count = None if np.all(data == np.round(data)) else 1000
+    starts = range(0, data.shape[1], chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(np.array(data[:, start:start + chunk_size]), P, R, mutation_count, s)
+             for start, s in zip(starts, seeds)]
+
+    def combine(parts):
+        return tuple(np.concatenate([part[k] for part in parts], axis=-1) for k in range(3))
+
+    return cohort_chunk, tasks, [{'gram': gram}] * len(tasks), combine
+
+
+def prevalence(p_values, significance_level=0.01):
+    # Fraction of patients in which each signature is present (bootstrap p-value below the level)
+    return np.mean(p_values < significance_level, axis=1)
+
+
+def page(values, number, page_size=PAGE_SIZE):
+    """Columns of page 'number' (from 0) and their indices; the last page may be shorter."""
+    columns = np.arange(number * page_size, min((number + 1) * page_size, values.shape[1]))
+    return values[:, columns], columns
+
+
+def downsample(values, max_columns=OVERVIEW_COLUMNS):
+    """
+    Mean of consecutive columns, so that at most 'max_columns' are left.
+
+    Returns:
+        tuple: (means, starts) where starts[j] is the first column averaged into column j.
+    """
+    if values.shape[1] <= max_columns:
+        return values, np.arange(values.shape[1])
+    starts = np.linspace(0, values.shape[1], max_columns + 1).astype(int)[:-1]
+    return np.add.reduceat(values, starts, axis=1) / np.diff(np.append(starts, values.shape[1])), starts
@@ -0,0 +1,89 @@
+"""
+Server-side registry of uploaded datasets.
+
+An upload is parsed once and saved as a .npy file (with a .json sidecar holding the
+patient IDs and the file name) under a key that is the hash of the upload. The browser
+only keeps that key; callbacks open the matrix as a read-only memory map, which the
+operating system shares between all server processes. Datasets that were not used for
+'idle_seconds' are removed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from fileutils import atomic_write
+
+DATASET_DIR = os.path.join(tempfile.gettempdir(), 'mutation_signatures_datasets')
+IDLE_SECONDS = 3600
+
+
+def dataset_key(contents):
+    # Same upload, same key: a re-upload is not parsed again
+    return hashlib.sha256(contents.encode()).hexdigest()
+
+
+class DatasetRegistry:
+    def __init__(self, directory=DATASET_DIR, idle_seconds=IDLE_SECONDS):
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.npy', base + '.json'
+
+    def __contains__(self, key):
+        return all(os.path.exists(path) for path in self._paths(key))
+
+    def put(self, key, data, patients, filename=None):
+        """Save a parsed upload (mutation types x patients) under 'key'."""
+        os.makedirs(self.directory, exist_ok=True)
+        matrix_path, info_path = self._paths(key)
+        # Written under temporary names and renamed, so other processes never see half a file
+        atomic_write(matrix_path, lambda f: np.save(f, np.asarray(data, dtype=float)))
+        atomic_write(info_path, lambda f: f.write(json.dumps(
+            {'patients': [str(p) for p in patients], 'filename': filename}).encode()))
+        self.evict_idle()
+        return key
+
+    def get(self, key):
+        """
+        Memory-mapped matrix and patient IDs of a dataset.
+
+        Raises:
+            KeyError: If there is no such dataset, e.g. it was evicted.
+        """
+        matrix_path, info_path = self._paths(key)
+        try:
+            # The modification time marks the last use, for every server process
+            for path in (matrix_path, info_path):
+                os.utime(path)
+            with open(info_path) as f:
+                info = json.load(f)
+            return np.load(matrix_path, mmap_mode='r'), np.array(info['patients'])
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def evict_idle(self, now=None):
+        """Remove the datasets not used for 'idle_seconds'; returns their keys."""
+        now = time.time() if now is None else now
+        evicted = []
+        if not os.path.isdir(self.directory):
+            return evicted
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.npy'):
+                continue
+            key = file_name[:-len('.npy')]
+            try:
+                if now - os.path.getmtime(self._paths(key)[0]) <= self.idle_seconds:
+                    continue
+                for path in self._paths(key):
+                    os.remove(path)
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            evicted.append(key)
+        return evicted
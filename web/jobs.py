@@ -0,0 +1,244 @@
+"""
+Background jobs of the Dash app.
+
+Heavy computations run on a local process pool, so a callback only submits them and
+returns at once; the browser polls the jobs (dcc.Interval) and every figure is drawn as
+soon as its own job is done. A job is made of one or more tasks, and its progress is the
+fraction of finished tasks. When the inputs change, the jobs of the old inputs are
+cancelled, so stale requests stop using workers.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+from estimates_exposures import bootstrapSigExposures
+
+
+# Bootstrap jobs are split into this many tasks, for progress and parallelism
+BOOTSTRAP_CHUNKS = 10
+
+
+def bootstrap_chunks(m, P, R, mutation_count, seed, gram=None):
+    """
+    Tasks of bootstrapSigExposures split into chunks of replicates, and the function that
+    joins their results; each chunk has its own seed spawned from 'seed'.
+
+    Returns:
+        tuple: (func, tasks, kwargs, combine), the arguments of JobManager.submit_tasks.
+    """
+    chunk_size = max(1, -(-R // BOOTSTRAP_CHUNKS))
+    sizes = [min(chunk_size, R - start) for start in range(0, R, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(m, P, size, mutation_count) for size in sizes]
+    kwargs = [{'gram': gram, 'rng': np.random.default_rng(s)} for s in seeds]
+
+    def combine(parts):
+        return np.hstack([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    return bootstrapSigExposures, tasks, kwargs, combine
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class Job:
+    def __init__(self, futures, combine=None, key=None, profiled=False):
+        self.id = uuid.uuid4().hex
+        self.futures = futures
+        self.combine = combine
+        self.key = key
+        # Tasks run through profiling.profiled_call return (result, stats)
+        self.profiled = profiled
+        # Last time the job was looked up, for JobManager's eviction of finished jobs
+        self.accessed = time.monotonic()
+        # Whether the result went into the cache
+        self.stored = False
+        self._lock = threading.Lock()
+        self._collected = False
+        self._value = None
+        self._stats = []
+
+    @property
+    def progress(self):
+        return sum(f.done() for f in self.futures) / len(self.futures)
+
+    @property
+    def state(self):
+        if any(f.cancelled() for f in self.futures):
+            return 'cancelled'
+        if not all(f.done() for f in self.futures):
+            return 'running'
+        return 'failed' if any(f.exception() is not None for f in self.futures) else 'done'
+
+    def cancel(self):
+        # Tasks already running in a worker finish, but their results are dropped
+        for future in self.futures:
+            future.cancel()
+
+    def value(self):
+        """The joined result of a finished job, computed once."""
+        with self._lock:
+            if not self._collected:
+                results = [future.result() for future in self.futures]
+                if self.profiled:
+                    self._stats = [stats for _, stats in results]
+                    results = [result for result, _ in results]
+                self._value = self.combine(results) if self.combine is not None else results[0]
+                self._collected = True
+                # The results of the tasks are only kept joined
+                self.futures = [_done(None) for _ in self.futures]
+            return self._value
+
+    def result(self):
+        value = self.value()
+        with self._lock:
+            # The timers and counters of the workers are counted once, when the result is first read
+            stats, self._stats = self._stats, []
+        for worker_stats in stats:
+            profiling.merge(worker_stats)
+        return value
+
+
+class JobManager:
+    """
+    Submit computations to a process pool and follow them by job id.
+
+    Finished jobs keep their results until they have not been looked up for 'ttl'
+    seconds, or until more than 'max_finished' are finished, when the least recently used
+    are forgotten; their ids then report 'missing'. Running jobs are always kept.
+
+    Parameters:
+        max_workers (int, optional): Size of the pool, all cores by default. The pool is
+            started at the first submission.
+        cache (result_cache.ResultCache, optional): Results of finished jobs are stored
+            in it, and a job whose result is already cached is done at once.
+        max_finished (int, optional): Finished jobs kept. Default is 64.
+        ttl (float, optional): Seconds a finished job is kept after it was last looked up.
+            Default is 600.
+    """
+
+    def __init__(self, max_workers=None, cache=None, max_finished=64, ttl=600):
+        self.max_workers = max_workers
+        self.cache = cache
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def _evict(self):
+        # Called with the lock held
+        now = time.monotonic()
+        finished = sorted((job for job in self._jobs.values() if job.state != 'running'),
+                          key=lambda job: job.accessed)
+        for i, job in enumerate(finished):
+            if now - job.accessed > self.ttl or i < len(finished) - self.max_finished:
+                del self._jobs[job.id]
+
+    def _add(self, job):
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job
+        return job.id
+
+    def _store(self, job):
+        # Called by the pool when a task of a cached job is done: the result goes into the
+        # cache once, when the last task is done
+        if job.state != 'done':
+            return
+        with self._lock:
+            if job.stored:
+                return
+            job.stored = True
+        self.cache.put(job.key, job.value())
+
+    def key(self, func, *args, **kwargs):
+        # Cache key of a call, None if there is no cache or the call cannot be cached
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.key(func, *args, **kwargs)
+        except TypeError:
+            return None
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) as a job and return the job id."""
+        return self.submit_tasks(func, [args], [kwargs], key=self.key(func, *args, **kwargs))
+
+    def submit_tasks(self, func, tasks, kwargs=None, combine=None, key=None):
+        """
+        Run func(*args, **kwargs) for every task as one job; 'combine' joins the results.
+
+        With a cache 'key' the joined result is cached when the job is done, and a job
+        whose key is already cached is done at once.
+        """
+        if key is not None:
+            found, value = self.cache.get(key)
+            if found:
+                return self._add(Job([_done(value)]))
+
+        kwargs = kwargs or [{}] * len(tasks)
+        # With profiling on, the timers and counters of the workers are added when the result is read
+        profiled = profiling.enabled()
+        if profiled:
+            futures = [self._executor().submit(profiling.profiled_call, func, *args, **kw)
+                       for args, kw in zip(tasks, kwargs)]
+        else:
+            futures = [self._executor().submit(func, *args, **kw) for args, kw in zip(tasks, kwargs)]
+        job = Job(futures, combine, key, profiled)
+        if key is not None:
+            for future in futures:
+                future.add_done_callback(lambda _: self._store(job))
+        return self._add(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.accessed = time.monotonic()
+        return job
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return {'state': 'missing', 'progress': 0.0}
+        return {'state': job.state, 'progress': job.progress}
+
+    def result(self, job_id):
+        """
+        Result of a finished job.
+
+        Raises:
+            KeyError: If the job is unknown, e.g. cancelled or evicted.
+        """
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(f"No job '{job_id}'")
+        if job.key is not None:
+            # In case the result is read before the pool called _store
+            self._store(job)
+        return job.result()
+
+    def cancel(self, job_id):
+        # Also forgets the job; its id reports 'missing' afterwards
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -2,22 +2,15 @@ import dash
 from dash import dcc, html
 import dash_daq as daq
 
+from catalogue_index import REFERENCE_CATALOGUE, get_index
+
 # Initialize Dash application
 app = dash.Dash(__name__)
 
-data = {
-    'signaturesCOSMIC.csv': [x for x in range(1, 31) ],
-    'WGS_signatures__sigProfiler_SBS_signatures_2019_05_22.modified.csv': [x for x in range(0, 64)],
-    'COSMIC_v1_SBS_GRCh37.txt': [1, 2, 3, 4, 5, 6, 7, 9, 15],
-    'COSMIC_v2_SBS_GRCh37.txt': [1, 2, 3, 5, 6, 8, 13, 17, 18, 20, 26, 30],
-    'COSMIC_v3.1_SBS_GRCh37.txt': [1, 2, 3, 5, 6, 8, 13, 17, 18, 20, 26, 30],
-}
-organs = [
-    "Breast", "Ovary", "Kidney", "Colorectal", "Bone_SoftTissue",
-    "Lung", "Uterus", "CNS", "Prostate", "Bladder", "Skin",
-    "Stomach", "NET", "Pancreas", "Biliary", "Liver", "Lymphoid",
-    "Myeloid", "Oral_Oropharyngeal", "Esophagus", "Head_neck"
-]
+# Signature catalogues and organs, indexed once per process
+index = get_index()
+organs = index.organs('latest')
+
 # Application layout
 app.layout = html.Div([
     html.Div([
@@ -37,6 +30,9 @@ app.layout = html.Div([
             multiple=False
         ),
         dcc.Store(id='session', storage_type='session', data=None),
+        # Ids of the background jobs of the current inputs, polled until they are done
+        dcc.Store(id='jobs', data=None),
+        dcc.Interval(id='job-poll', interval=500, disabled=True),
         daq.BooleanSwitch(
                 id='dropdown-switch',
                 on=True,
@@ -81,22 +77,15 @@ app.layout = html.Div([
     html.Div([
         dcc.Dropdown(
             id='dropdown',
-            options=[
-                {'label': 'signaturesProfiler', 'value': 'WGS_signatures__sigProfiler_SBS_signatures_2019_05_22.modified.csv'},
-                {'label': 'signaturesCOSMIC', 'value': 'signaturesCOSMIC.csv'},
-                {'label': 'COSMIC_v1_SBS_GRCh37', 'value': 'COSMIC_v1_SBS_GRCh37.txt'},
-                {'label': 'COSMIC_v2_SBS_GRCh37.txt', 'value': 'COSMIC_v2_SBS_GRCh37.txt'},
-                {'label': 'COSMIC_v3.1_SBS_GRCh37.txt', 'value': 'COSMIC_v3.1_SBS_GRCh37.txt'},
-                {'label': 'COSMIC_v3.4_SBS_GRCh37.txt', 'value': 'COSMIC_v3.4_SBS_GRCh37.txt'},
-            ],
+            options=[{'label': name.rsplit('.', 1)[0], 'value': name} for name in index.catalogues()],
             disabled=True,
-            value='WGS_signatures__sigProfiler_SBS_signatures_2019_05_22.modified.csv'
+            value=REFERENCE_CATALOGUE
         ),
         dcc.Dropdown(
             id='signatures-dropdown',
-            options=[{'label': k, 'value': k} for k in data.keys()],
+            options=[{'label': name, 'value': j} for j, name in enumerate(index.names(REFERENCE_CATALOGUE))],
             multi=True,
-            value=[k for k in data['WGS_signatures__sigProfiler_SBS_signatures_2019_05_22.modified.csv']],
+            value=index.default(REFERENCE_CATALOGUE),
         ),
     ], style={'padding': '10px'}),
 
@@ -116,8 +105,21 @@ app.layout = html.Div([
     html.Button('Wyczyść dane', id='clear-button'),
 
     html.Div(id='slider-output-container'),
+    html.Div(id='job-progress'),
     dcc.Graph(id='bar-plot-crossvalid'),
     dcc.Graph(id='bar-plot-bootstrap'),
     dcc.Graph(id='bar-plot-modelselection'),
-    dcc.Graph(id='bar-plot-forward_model')
+    dcc.Graph(id='bar-plot-forward_model'),
+
+    # Cohort view: all uploaded patients, computed in the background
+    html.Div([
+        html.Button('Analyse cohort', id='cohort-button'),
+        dcc.Store(id='cohort-job', data=None),
+        dcc.Interval(id='cohort-poll', interval=1000, disabled=True),
+        html.Div(id='cohort-progress'),
+        dcc.Graph(id='cohort-overview'),
+        dcc.Graph(id='cohort-prevalence'),
+        dcc.Input(id='cohort-page', type='number', min=1, value=1),
+        dcc.Graph(id='cohort-heatmap'),
+    ], style={'padding': '10px'}),
 ])
@@ -0,0 +1,16 @@
+from flask import jsonify, request
+
+import profiling
+from web.layout import app
+
+
+def profile():
+    if request.args.get('format') == 'text':
+        return profiling.report(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(profiling.snapshot())
+
+
+# Timers and counters of this server process as JSON, or as the text summary with
+# ?format=text; only served when the server was started with MUTATION_SIGNATURES_PROFILE=1
+if profiling.enabled_by_environment():
+    app.server.add_url_rule('/profile', view_func=profile)
@@ -2,7 +2,8 @@ import base64
 import numpy as np
 from dash import html
 import io
-import re
+from catalogue import get_catalogue
+from catalogue_index import get_index, reference_name
 
 # Function to parse CSV file content
 def parse_contents(contents, filename):
@@ -11,9 +12,10 @@ def parse_contents(contents, filename):
     decoded = base64.b64decode(content_string)
     try:
         if 'csv' in filename:
-            data = np.genfromtxt(io.StringIO(decoded.decode('utf-8')), delimiter=',', skip_header=1, dtype=float)[:, 1:]
-            patients = np.genfromtxt(io.StringIO(decoded.decode('utf-8')), delimiter=',', max_rows=1, dtype=str)[1:]
-            patients = np.char.strip(patients, '"')
+            # Decode once; the header line holds the patient IDs, the rest is parsed as numbers
+            header, _, body = decoded.decode('utf-8').partition('\n')
+            patients = np.char.strip(np.array(header.rstrip('\r').split(',')[1:]), '"')
+            data = np.genfromtxt(io.StringIO(body), delimiter=',', dtype=float, ndmin=2)[:, 1:]
         else:
             return html.Div([
                 'There was an error processing this file.'
@@ -26,20 +28,13 @@ def parse_contents(contents, filename):
 
     return data, patients
 
-def load_signatures(filename, organ=False):
-    delimiter = ','
-    if organ:
-        file_path = f"../data/signatures_organ/latest/{filename}_Signature.csv"
-    else:
-        delimiter = '\t' if '.txt' in filename else ','
-        file_path = f'data/{filename}'
-    signatures = np.genfromtxt(file_path, delimiter=delimiter, skip_header=1)
+def catalogue_path(filename, organ=False):
+    # 'filename' is a COSMIC catalogue file, or an organ when organ=True
+    return get_index().path(filename, version='latest' if organ else None)
 
-    return np.delete(signatures, 0, axis=1)
+def load_signatures(filename, organ=False):
+    return get_catalogue(catalogue_path(filename, organ)).signatures
 
 def load_names(filename):
-    file_path = f"../data/signatures_organ/latest/{filename}_Signature.csv"
-    signatures = np.genfromtxt(file_path, delimiter=',', max_rows=1, dtype='str')[1:]
-
-    pattern = r'([^_]+)$'
-    return [re.search(pattern, item).group() for item in signatures if re.search(pattern, item)]
\ No newline at end of file
+    # COSMIC names of the signatures of an organ, e.g. 'SBS13' for 'GEL-Breast_common_SBS13'
+    return [reference_name(name) for name in get_index().names(filename, version='latest')]